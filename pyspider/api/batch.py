@@ -28,6 +28,7 @@ def batch_create_tasks():
         }), 400
     
     results = []
+    valid_tasks = []
     for task in tasks:
         if not task.get('project') or not task.get('url'):
             results.append({
@@ -35,25 +36,30 @@ def batch_create_tasks():
                 'error': 'Project and URL are required',
             })
             continue
-        
-        try:
-            result = scheduler_rpc.newtask(task)
-            if result:
-                results.append({
-                    'success': True,
-                    'task': task,
-                })
-            else:
-                results.append({
-                    'success': False,
-                    'error': 'Failed to create task',
-                })
-        except Exception as e:
-            logger.exception(e)
-            results.append({
+        results.append(None)
+        valid_tasks.append((len(results) - 1, task))
+
+    # sent to scheduler in one call
+    try:
+        accepted = scheduler_rpc.newtask_batch([task for _, task in valid_tasks]) \
+            if valid_tasks else []
+        error = None
+    except Exception as e:
+        logger.exception(e)
+        accepted = [False] * len(valid_tasks)
+        error = str(e)
+
+    for (i, task), result in zip(valid_tasks, accepted):
+        if result:
+            results[i] = {
+                'success': True,
+                'task': task,
+            }
+        else:
+            results[i] = {
                 'success': False,
-                'error': str(e),
-            })
+                'error': error or 'Failed to create task',
+            }
     
     return jsonify(results)
 
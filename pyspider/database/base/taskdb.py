@@ -67,9 +67,53 @@ class TaskDB(object):
     def load_tasks(self, status, project=None, fields=None):
         raise NotImplementedError
 
+    def load_tasks_pages(self, status, project, fields=None, page_size=1000):
+        '''
+        load tasks of project page by page
+
+        yield lists of at most page_size tasks. backends should override it with
+        keyset pagination (taskid > last taskid of previous page, ordered by taskid),
+        so that no long running query is held while the pages are consumed.
+        '''
+        page = []
+        for task in self.load_tasks(status, project, fields):
+            page.append(task)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def load_tasks_since(self, project, updatetime, fields=None):
+        '''
+        load tasks of project in any status updated after updatetime
+
+        used to replay changes of taskdb onto a task queue snapshot. backends
+        should override it with a single query on updatetime.
+        '''
+        if fields:
+            fields = list(fields) + [x for x in ('status', 'updatetime') if x not in fields]
+        for status in (self.ACTIVE, self.SUCCESS, self.FAILED, self.BAD):
+            for task in self.load_tasks(status, project, fields):
+                if (task.get('updatetime') or 0) > updatetime:
+                    yield task
+
     def get_task(self, project, taskid, fields=None):
         raise NotImplementedError
 
+    def get_tasks(self, project, taskids, fields=None):
+        '''
+        get a batch of tasks of project in one call
+
+        yield the tasks found in any order, missing ones are skipped.
+        include 'taskid' in fields to match them with taskids.
+        backends should override it with a bulk query.
+        '''
+        for taskid in taskids:
+            task = self.get_task(project, taskid, fields=fields)
+            if task:
+                yield task
+
     def status_count(self, project):
         '''
         return a dict
@@ -82,6 +126,24 @@ class TaskDB(object):
     def update(self, project, taskid, obj={}, **kwargs):
         raise NotImplementedError
 
+    def insert_many(self, project, objs):
+        '''
+        insert a batch of tasks of project, each obj should have its taskid
+
+        backends should override it with a bulk write.
+        '''
+        for obj in objs:
+            self.insert(project, obj['taskid'], obj)
+
+    def update_many(self, project, objs):
+        '''
+        update a batch of tasks of project, each obj should have its taskid
+
+        backends should override it with a bulk write.
+        '''
+        for obj in objs:
+            self.update(project, obj['taskid'], obj)
+
     def drop(self, project):
         raise NotImplementedError
 
@@ -113,6 +113,59 @@ class BaseDB:
             dbcur = self._execute(sql_query)
         return dbcur.lastrowid
 
+    def _insert_many(self, tablename=None, rows=()):
+        '''
+        insert rows (list of dict) in one transaction
+
+        rows with the same keys are inserted with one executemany
+        '''
+        tablename = self.escape(tablename or self.__tablename__)
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row), []).append(row)
+
+        self._execute("BEGIN")
+        try:
+            for keys, _rows in groups.items():
+                _keys = ", ".join(self.escape(k) for k in keys)
+                _values = ", ".join([self.placeholder, ] * len(keys))
+                sql_query = "INSERT INTO %s (%s) VALUES (%s)" % (tablename, _keys, _values)
+                logger.debug("<sql: %s> * %d", sql_query, len(_rows))
+                self.dbcur.executemany(sql_query, [[row[k] for k in keys] for row in _rows])
+        except Exception:
+            self._execute("ROLLBACK")
+            raise
+        self._execute("COMMIT")
+
+    def _update_many(self, tablename=None, where_key='id', rows=()):
+        '''
+        update rows (list of dict) matched by row[where_key] in one transaction
+
+        rows with the same keys are updated with one executemany
+        '''
+        tablename = self.escape(tablename or self.__tablename__)
+        groups = {}
+        for row in rows:
+            keys = tuple(k for k in row if k != where_key)
+            groups.setdefault(keys, []).append(row)
+
+        self._execute("BEGIN")
+        try:
+            for keys, _rows in groups.items():
+                _key_values = ", ".join([
+                    "%s = %s" % (self.escape(k), self.placeholder) for k in keys
+                ])
+                sql_query = "UPDATE %s SET %s WHERE %s = %s" % (
+                    tablename, _key_values, self.escape(where_key), self.placeholder)
+                logger.debug("<sql: %s> * %d", sql_query, len(_rows))
+                self.dbcur.executemany(sql_query, [
+                    [row[k] for k in keys] + [row[where_key], ] for row in _rows
+                ])
+        except Exception:
+            self._execute("ROLLBACK")
+            raise
+        self._execute("COMMIT")
+
     def _update(self, tablename=None, where="1=0", where_values=[], **values):
         tablename = self.escape(tablename or self.__tablename__)
         _key_values = ", ".join([
@@ -71,6 +71,14 @@ class SplitTableMixin(object):
         return res['docs']
 
 
+    def get_docs_by_ids(self, db_name, doc_ids):
+        url = self.base_url + db_name + "/_all_docs?include_docs=true"
+        res = self.session.post(url, json={"keys": doc_ids}).json()
+        if 'error' in res and res['error'] == 'not_found':
+            return []
+        return [row['doc'] for row in res.get('rows', []) if row.get('doc')]
+
+
     def get_all_docs(self, db_name):
         return self.get_docs(db_name, {"selector": {}})
 
@@ -90,6 +98,11 @@ class SplitTableMixin(object):
         return self.session.put(url, json=doc).json()
 
 
+    def bulk_docs(self, db_name, docs):
+        url = self.base_url + db_name + "/_bulk_docs"
+        return self.session.post(url, json={"docs": docs}).json()
+
+
     def delete(self, url):
         return self.session.delete(url).json()
 
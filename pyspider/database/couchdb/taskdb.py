@@ -64,6 +64,21 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             return None
         return ret[0]
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        taskids = list(taskids)
+        if not taskids:
+            return
+        collection_name = self._get_collection_name(project)
+        # tasks are saved with taskid as doc id
+        for doc in self.get_docs_by_ids(collection_name, taskids):
+            if fields:
+                doc = dict((k, doc[k]) for k in fields if k in doc)
+            yield doc
+
     def status_count(self, project):
         if project not in self.projects:
             self._list_project()
@@ -101,6 +116,25 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
         collection_name = self._get_collection_name(project)
         return self.update_doc(collection_name, taskid, obj)
 
+    def insert_many(self, project, objs):
+        if project not in self.projects:
+            self._create_project(project)
+        objs = [dict(obj, project=project) for obj in objs]
+        return self.update_many(project, objs)
+
+    def update_many(self, project, objs):
+        if not objs:
+            return
+        now = time.time()
+        collection_name = self._get_collection_name(project)
+        docs = dict((doc['_id'], doc) for doc in self.get_docs_by_ids(
+            collection_name, [obj['taskid'] for obj in objs]))
+        for obj in objs:
+            doc = docs.setdefault(obj['taskid'], {'_id': obj['taskid']})
+            doc.update(obj)
+            doc['updatetime'] = now
+        return self.bulk_docs(collection_name, list(docs.values()))
+
     def drop_database(self):
         return self.delete(self.url)
 
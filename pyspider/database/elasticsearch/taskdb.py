@@ -79,6 +79,18 @@ class TaskDB(BaseTaskDB):
                           _source_include=fields or [], ignore=404)
         return self._parse(ret.get('_source', None))
 
+    def get_tasks(self, project, taskids, fields=None):
+        ids = ['%s:%s' % (project, taskid) for taskid in taskids]
+        if not ids:
+            return
+        if self._changed:
+            self.refresh()
+        ret = self.es.mget(index=self.index, doc_type=self.__type__, body={'ids': ids},
+                           _source_include=fields or [])
+        for each in ret.get('docs', []):
+            if each.get('found'):
+                yield self._parse(each['_source'])
+
     def status_count(self, project):
         self.refresh()
         ret = self.es.search(index=self.index, doc_type=self.__type__,
@@ -108,6 +120,40 @@ class TaskDB(BaseTaskDB):
         return self.es.update(index=self.index, doc_type=self.__type__, id='%s:%s' % (project, taskid),
                               body={"doc": self._stringify(obj)}, ignore=404)
 
+    def insert_many(self, project, objs):
+        self._changed = True
+        now = time.time()
+        actions = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['project'] = project
+            obj['updatetime'] = now
+            actions.append({
+                '_op_type': 'index',
+                '_index': self.index,
+                '_type': self.__type__,
+                '_id': '%s:%s' % (project, obj['taskid']),
+                '_source': self._stringify(obj),
+            })
+        return elasticsearch.helpers.bulk(self.es, actions)
+
+    def update_many(self, project, objs):
+        self._changed = True
+        now = time.time()
+        actions = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            actions.append({
+                '_op_type': 'update',
+                '_index': self.index,
+                '_type': self.__type__,
+                '_id': '%s:%s' % (project, obj['taskid']),
+                'doc': self._stringify(obj),
+            })
+        # ignore missing documents like update(ignore=404)
+        return elasticsearch.helpers.bulk(self.es, actions, raise_on_error=False)
+
     def drop(self, project):
         self.refresh()
         for record in elasticsearch.helpers.scan(self.es, index=self.index, doc_type=self.__type__,
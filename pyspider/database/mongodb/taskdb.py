@@ -8,7 +8,7 @@
 import json
 import time
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 from pyspider.database.base.taskdb import TaskDB as BaseTaskDB
 from .mongodbbase import SplitTableMixin
@@ -70,6 +70,37 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             for task in self.database[collection_name].find({'status': status}, fields):
                 yield self._parse(task)
 
+    def load_tasks_pages(self, status, project, fields=None, page_size=1000):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        if fields and 'taskid' not in fields:
+            fields = list(fields) + ['taskid']
+        collection_name = self._collection_name(project)
+        last = ''
+        while True:
+            page = [self._parse(task) for task in self.database[collection_name].find(
+                {'status': status, 'taskid': {'$gt': last}}, fields
+            ).sort('taskid', 1).limit(page_size)]
+            if not page:
+                break
+            yield page
+            if len(page) < page_size:
+                break
+            last = page[-1]['taskid']
+
+    def load_tasks_since(self, project, updatetime, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        if fields and 'status' not in fields:
+            fields = list(fields) + ['status']
+        collection_name = self._collection_name(project)
+        for task in self.database[collection_name].find({'updatetime': {'$gt': updatetime}}, fields):
+            yield self._parse(task)
+
     def get_task(self, project, taskid, fields=None):
         if project not in self.projects:
             self._list_project()
@@ -81,6 +112,18 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             return ret
         return self._parse(ret)
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        taskids = list(taskids)
+        if not taskids:
+            return
+        collection_name = self._collection_name(project)
+        for task in self.database[collection_name].find({'taskid': {'$in': taskids}}, fields):
+            yield self._parse(task)
+
     def status_count(self, project):
         if project not in self.projects:
             self._list_project()
@@ -139,3 +182,23 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
             {"$set": self._stringify(obj)},
             upsert=True
         )
+
+    def insert_many(self, project, objs):
+        if project not in self.projects:
+            self._create_project(project)
+        objs = [dict(obj, project=project) for obj in objs]
+        return self.update_many(project, objs)
+
+    def update_many(self, project, objs):
+        now = time.time()
+        requests = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            requests.append(UpdateOne({'taskid': obj['taskid']},
+                                      {"$set": self._stringify(obj)},
+                                      upsert=True))
+        if not requests:
+            return
+        collection_name = self._collection_name(project)
+        return self.database[collection_name].bulk_write(requests, ordered=False)
@@ -85,6 +85,36 @@ class TaskDB(MySQLMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             ):
                 yield self._parse(each)
 
+    def load_tasks_pages(self, status, project, fields=None, page_size=1000):
+        if project not in self.projects:
+            return
+        if fields and 'taskid' not in fields:
+            fields = list(fields) + ['taskid']
+        tablename = self._tablename(project)
+        where = "`status` = %s AND `taskid` > %s" % (self.placeholder, self.placeholder)
+        last = ''
+        while True:
+            page = [self._parse(each) for each in self._select2dic(
+                tablename, what=fields, where=where, where_values=(status, last),
+                order='`taskid`', limit=page_size)]
+            if not page:
+                break
+            yield page
+            if len(page) < page_size:
+                break
+            last = page[-1]['taskid']
+
+    def load_tasks_since(self, project, updatetime, fields=None):
+        if project not in self.projects:
+            return
+        if fields and 'status' not in fields:
+            fields = list(fields) + ['status']
+        tablename = self._tablename(project)
+        for each in self._select2dic(tablename, what=fields,
+                                     where="`updatetime` > %s" % self.placeholder,
+                                     where_values=(updatetime, )):
+            yield self._parse(each)
+
     def get_task(self, project, taskid, fields=None):
         if project not in self.projects:
             self._list_project()
@@ -96,6 +126,19 @@ class TaskDB(MySQLMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             return self._parse(each)
         return None
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        taskids = list(taskids)
+        if not taskids:
+            return
+        where = "`taskid` IN (%s)" % ', '.join([self.placeholder, ] * len(taskids))
+        tablename = self._tablename(project)
+        for each in self._select2dic(tablename, what=fields, where=where, where_values=taskids):
+            yield self._parse(each)
+
     def status_count(self, project):
         result = dict()
         if project not in self.projects:
@@ -136,3 +179,33 @@ class TaskDB(MySQLMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             where_values=(taskid, ),
             **self._stringify(obj)
         )
+
+    def insert_many(self, project, objs):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            self._create_project(project)
+            self._list_project()
+        now = time.time()
+        rows = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['project'] = project
+            obj['updatetime'] = now
+            rows.append(self._stringify(obj))
+        if rows:
+            self._insert_many(self._tablename(project), rows)
+
+    def update_many(self, project, objs):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            raise LookupError
+        now = time.time()
+        rows = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            rows.append(self._stringify(obj))
+        if rows:
+            self._update_many(self._tablename(project), 'taskid', rows)
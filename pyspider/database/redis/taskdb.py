@@ -115,6 +115,23 @@ class TaskDB(BaseTaskDB):
             return None
         return self._parse(obj)
 
+    def get_tasks(self, project, taskids, fields=None):
+        pipe = self.redis.pipeline(transaction=False)
+        for taskid in taskids:
+            if fields:
+                pipe.hmget(self._gen_key(project, taskid), fields)
+            else:
+                pipe.hgetall(self._gen_key(project, taskid))
+
+        for obj in pipe.execute():
+            if fields:
+                if all(x is None for x in obj):
+                    continue
+                obj = dict(zip(fields, obj))
+            if not obj:
+                continue
+            yield self._parse(obj)
+
     def status_count(self, project):
         '''
         return a dict
@@ -161,6 +178,36 @@ class TaskDB(BaseTaskDB):
                     pipe.srem(self._gen_status_key(project, status), taskid)
         pipe.execute()
 
+    def insert_many(self, project, objs):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        if project not in self.projects:
+            pipe.sadd(self.__prefix__ + 'projects', project)
+        for obj in objs:
+            obj = dict(obj)
+            obj['project'] = project
+            obj['updatetime'] = now
+            obj.setdefault('status', self.ACTIVE)
+            pipe.hmset(self._gen_key(project, obj['taskid']), self._stringify(obj))
+            pipe.sadd(self._gen_status_key(project, obj['status']), obj['taskid'])
+        pipe.execute()
+
+    def update_many(self, project, objs):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for obj in objs:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            taskid = obj['taskid']
+            pipe.hmset(self._gen_key(project, taskid), self._stringify(obj))
+            if 'status' in obj:
+                for status in range(1, 5):
+                    if status == obj['status']:
+                        pipe.sadd(self._gen_status_key(project, status), taskid)
+                    else:
+                        pipe.srem(self._gen_status_key(project, status), taskid)
+        pipe.execute()
+
     def drop(self, project):
         self.redis.srem(self.__prefix__ + 'projects', project)
 
@@ -12,7 +12,7 @@ import json
 import sqlalchemy.exc
 
 from sqlalchemy import (create_engine, MetaData, Table, Column, Index,
-                        Integer, String, Float, Text, func)
+                        Integer, String, Float, Text, func, bindparam)
 from sqlalchemy.engine.url import make_url
 from pyspider.libs import utils
 from pyspider.database.base.taskdb import TaskDB as BaseTaskDB
@@ -104,6 +104,41 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
                                             .where(self.table.c.status == status)):
                 yield self._parse(result2dict(columns, task))
 
+    def load_tasks_pages(self, status, project, fields=None, page_size=1000):
+        if project not in self.projects:
+            return
+        if fields and 'taskid' not in fields:
+            fields = list(fields) + ['taskid']
+        columns = [getattr(self.table.c, f, f) for f in fields] if fields else self.table.c
+        last = ''
+        while True:
+            self.table.name = self._tablename(project)
+            page = [self._parse(result2dict(columns, task)) for task in self.engine.execute(
+                self.table.select()
+                .with_only_columns(columns)
+                .where(self.table.c.status == status)
+                .where(self.table.c.taskid > last)
+                .order_by(self.table.c.taskid)
+                .limit(page_size))]
+            if not page:
+                break
+            yield page
+            if len(page) < page_size:
+                break
+            last = page[-1]['taskid']
+
+    def load_tasks_since(self, project, updatetime, fields=None):
+        if project not in self.projects:
+            return
+        if fields and 'status' not in fields:
+            fields = list(fields) + ['status']
+        columns = [getattr(self.table.c, f, f) for f in fields] if fields else self.table.c
+        self.table.name = self._tablename(project)
+        for task in self.engine.execute(self.table.select()
+                                        .with_only_columns(columns)
+                                        .where(self.table.c.updatetime > updatetime)):
+            yield self._parse(result2dict(columns, task))
+
     def get_task(self, project, taskid, fields=None):
         if project not in self.projects:
             self._list_project()
@@ -118,6 +153,22 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
                                         .where(self.table.c.taskid == taskid)):
             return self._parse(result2dict(columns, each))
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        taskids = list(taskids)
+        if not taskids:
+            return
+
+        self.table.name = self._tablename(project)
+        columns = [getattr(self.table.c, f, f) for f in fields] if fields else self.table.c
+        for each in self.engine.execute(self.table.select()
+                                        .with_only_columns(columns)
+                                        .where(self.table.c.taskid.in_(taskids))):
+            yield self._parse(result2dict(columns, each))
+
     def status_count(self, project):
         result = dict()
         if project not in self.projects:
@@ -159,3 +210,46 @@ class TaskDB(SplitTableMixin, BaseTaskDB):
         return self.engine.execute(self.table.update()
                                    .where(self.table.c.taskid == taskid)
                                    .values(**self._stringify(obj)))
+
+    def insert_many(self, project, objs):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            self._create_project(project)
+            self._list_project()
+        now = time.time()
+        rows = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['project'] = project
+            obj['updatetime'] = now
+            rows.append(self._stringify(obj))
+        if not rows:
+            return
+        self.table.name = self._tablename(project)
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), rows)
+
+    def update_many(self, project, objs):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            raise LookupError
+        now = time.time()
+        groups = {}
+        for obj in objs:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            obj = self._stringify(obj)
+            # taskid is bound as _taskid, as it can't be used both in SET and WHERE
+            obj['_taskid'] = obj.pop('taskid')
+            groups.setdefault(tuple(sorted(obj)), []).append(obj)
+        if not groups:
+            return
+        self.table.name = self._tablename(project)
+        with self.engine.begin() as conn:
+            for keys, rows in groups.items():
+                conn.execute(self.table.update()
+                             .where(self.table.c.taskid == bindparam('_taskid'))
+                             .values(**dict((k, bindparam(k)) for k in keys if k != '_taskid')),
+                             rows)
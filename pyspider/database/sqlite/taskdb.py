@@ -69,6 +69,36 @@ class TaskDB(SQLiteMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             for each in self._select2dic(tablename, what=fields, where=where):
                 yield self._parse(each)
 
+    def load_tasks_pages(self, status, project, fields=None, page_size=1000):
+        if project not in self.projects:
+            return
+        if fields and 'taskid' not in fields:
+            fields = list(fields) + ['taskid']
+        tablename = self._tablename(project)
+        last = ''
+        while True:
+            page = [self._parse(each) for each in self._select2dic(
+                tablename, what=fields, where="status = %d AND `taskid` > %s" % (
+                    status, self.placeholder),
+                where_values=(last, ), order='`taskid`', limit=page_size)]
+            if not page:
+                break
+            yield page
+            if len(page) < page_size:
+                break
+            last = page[-1]['taskid']
+
+    def load_tasks_since(self, project, updatetime, fields=None):
+        if project not in self.projects:
+            return
+        if fields and 'status' not in fields:
+            fields = list(fields) + ['status']
+        tablename = self._tablename(project)
+        for each in self._select2dic(tablename, what=fields,
+                                     where="`updatetime` > %s" % self.placeholder,
+                                     where_values=(updatetime, )):
+            yield self._parse(each)
+
     def get_task(self, project, taskid, fields=None):
         if project not in self.projects:
             self._list_project()
@@ -82,6 +112,21 @@ class TaskDB(SQLiteMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             return self._parse(each)
         return None
 
+    def get_tasks(self, project, taskids, fields=None):
+        if project not in self.projects:
+            self._list_project()
+        if project not in self.projects:
+            return
+        tablename = self._tablename(project)
+        taskids = list(taskids)
+        # keep under SQLITE_MAX_VARIABLE_NUMBER of old sqlite versions
+        for i in range(0, len(taskids), 500):
+            chunk = taskids[i:i + 500]
+            where = "`taskid` IN (%s)" % ', '.join([self.placeholder, ] * len(chunk))
+            for each in self._select2dic(tablename, what=fields, where=where,
+                                         where_values=chunk):
+                yield self._parse(each)
+
     def status_count(self, project):
         '''
         return a dict
@@ -119,3 +164,29 @@ class TaskDB(SQLiteMixin, SplitTableMixin, BaseTaskDB, BaseDB):
             tablename, where="`taskid` = %s" % self.placeholder, where_values=(taskid, ),
             **self._stringify(obj)
         )
+
+    def insert_many(self, project, objs):
+        if project not in self.projects:
+            self._create_project(project)
+            self._list_project()
+        now = time.time()
+        rows = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['project'] = project
+            obj['updatetime'] = now
+            rows.append(self._stringify(obj))
+        if rows:
+            self._insert_many(self._tablename(project), rows)
+
+    def update_many(self, project, objs):
+        if project not in self.projects:
+            raise LookupError
+        now = time.time()
+        rows = []
+        for obj in objs:
+            obj = dict(obj)
+            obj['updatetime'] = now
+            rows.append(self._stringify(obj))
+        if rows:
+            self._update_many(self._tablename(project), 'taskid', rows)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Shared HTTP cache of fetcher, following RFC 7234
+
+Responses are indexed in a SQLite database, bodies are stored as files named by
+sha1 of the content, so the same content of different urls is stored once.
+Least recently used responses are evicted when size of the bodies exceeds
+max_size.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+logger = logging.getLogger('fetcher')
+
+# status codes cacheable by default, RFC 7231 section 6.1
+CACHEABLE_CODES = (200, 203, 204, 300, 301, 404, 405, 410, 414, 501)
+# headers of a 304 response not updating the stored response
+NOT_UPDATED_HEADERS = ('content-length', 'content-encoding', 'transfer-encoding', 'content-range')
+# headers not stored
+NOT_STORED_HEADERS = ('set-cookie', 'connection', 'keep-alive', 'transfer-encoding')
+# heuristic freshness is a fraction of the time since Last-Modified, RFC 7234 section 4.2.2
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX_AGE = 24 * 60 * 60
+
+
+def parse_cache_control(value):
+    '''Return directives of Cache-Control header as a dict, None for directives without value'''
+    directives = {}
+    for each in (value or '').split(','):
+        name, _, arg = each.strip().partition('=')
+        name = name.strip().lower()
+        if name:
+            directives[name] = arg.strip().strip('"') if _ else None
+    return directives
+
+
+def parse_http_date(value):
+    '''Return timestamp of a HTTP date, None if invalid'''
+    try:
+        return mktime_tz(parsedate_tz(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _seconds(directives, name):
+    try:
+        return max(0, int(directives[name]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _header_items(headers):
+    '''Return (name, value) pairs of a dict, HTTPHeaders or list of pairs'''
+    if headers is None:
+        return []
+    if isinstance(headers, list):
+        return headers
+    if hasattr(headers, 'get_all'):
+        return list(headers.get_all())
+    return list(headers.items())
+
+
+def _lower_headers(headers):
+    result = {}
+    for name, value in _header_items(headers):
+        name = name.lower()
+        result[name] = '%s, %s' % (result[name], value) if name in result else value
+    return result
+
+
+def _variant(vary, request_headers):
+    '''Key of the values of request headers selected by Vary'''
+    values = '\n'.join('%s:%s' % (name, ' '.join(request_headers.get(name, '').split()))
+                       for name in vary)
+    return hashlib.sha1(values.encode('utf8')).hexdigest()
+
+
+def _etags(value):
+    '''entity tags of a header, compared weakly'''
+    result = set()
+    for each in (value or '').split(','):
+        each = each.strip()
+        if each:
+            result.add(each[2:] if each.startswith('W/') else each)
+    return result
+
+
+class CacheEntry(object):
+    '''A stored response'''
+
+    def __init__(self, key, variant, url, vary, status, headers, digest, size,
+                 request_time, response_time):
+        self.key = key
+        self.variant = variant
+        self.url = url
+        self.vary = vary
+        self.status = status
+        # list of (name, value)
+        self.headers = headers
+        self.digest = digest
+        self.size = size
+        self.request_time = request_time
+        self.response_time = response_time
+        self._headers = _lower_headers(headers)
+
+    def header(self, name, default=None):
+        return self._headers.get(name.lower(), default)
+
+    def age(self, now=None):
+        '''current age, RFC 7234 section 4.2.3'''
+        now = now or time.time()
+        date = parse_http_date(self.header('date')) or self.response_time
+        try:
+            age_value = max(0, int(self.header('age', 0)))
+        except ValueError:
+            age_value = 0
+        apparent_age = max(0, self.response_time - date)
+        corrected_age_value = age_value + self.response_time - self.request_time
+        corrected_initial_age = max(apparent_age, corrected_age_value)
+        return corrected_initial_age + now - self.response_time
+
+    def freshness_lifetime(self):
+        '''RFC 7234 section 4.2.1, with heuristic freshness of section 4.2.2'''
+        directives = parse_cache_control(self.header('cache-control'))
+        if 'no-cache' in directives:
+            return 0
+        for name in ('s-maxage', 'max-age'):
+            seconds = _seconds(directives, name)
+            if seconds is not None:
+                return seconds
+        date = parse_http_date(self.header('date')) or self.response_time
+        if self.header('expires') is not None:
+            expires = parse_http_date(self.header('expires'))
+            return max(0, expires - date) if expires else 0
+        last_modified = parse_http_date(self.header('last-modified'))
+        if self.status in CACHEABLE_CODES and last_modified:
+            return min(max(0, date - last_modified) * HEURISTIC_FRACTION, HEURISTIC_MAX_AGE)
+        return 0
+
+    def is_fresh(self, request_headers=None, now=None):
+        '''If entry can be served without validation for request'''
+        request_headers = _lower_headers(request_headers)
+        request_directives = parse_cache_control(request_headers.get('cache-control'))
+        if 'no-cache' in request_directives or (
+                'cache-control' not in request_headers
+                and 'no-cache' in request_headers.get('pragma', '').lower()):
+            return False
+        age = self.age(now)
+        lifetime = self.freshness_lifetime()
+        max_age = _seconds(request_directives, 'max-age')
+        if max_age is not None and age > max_age:
+            return False
+        min_fresh = _seconds(request_directives, 'min-fresh')
+        if min_fresh is not None:
+            age += min_fresh
+        if age < lifetime:
+            return True
+        directives = parse_cache_control(self.header('cache-control'))
+        if 'max-stale' in request_directives and not (
+                'must-revalidate' in directives or 'proxy-revalidate' in directives):
+            max_stale = _seconds(request_directives, 'max-stale')
+            return max_stale is None or age < lifetime + max_stale
+        return False
+
+    def conditional_headers(self):
+        '''Headers validating entry with origin'''
+        headers = {}
+        if self.header('etag'):
+            headers['If-None-Match'] = self.header('etag')
+        if self.header('last-modified'):
+            headers['If-Modified-Since'] = self.header('last-modified')
+        return headers
+
+    def not_modified(self, request_headers):
+        '''If a conditional request is answered by 304 with entry, RFC 7232 section 6'''
+        if self.status != 200:
+            return False
+        request_headers = _lower_headers(request_headers)
+        if 'if-none-match' in request_headers:
+            etags = _etags(request_headers['if-none-match'])
+            return '*' in etags or bool(etags & _etags(self.header('etag')))
+        since = parse_http_date(request_headers.get('if-modified-since'))
+        if since:
+            modified = parse_http_date(self.header('last-modified') or self.header('date'))
+            return modified is not None and modified <= since
+        return False
+
+
+class HTTPCache(object):
+    '''
+    On-disk HTTP cache shared by projects
+
+    It's a shared cache of RFC 7234, responses of `private` or requests with
+    Authorization are not stored unless allowed.
+    '''
+
+    # cache is evicted to low_water of max_size
+    low_water = 0.9
+
+    def __init__(self, path, max_size=1024 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._size = self._db_size()
+
+    @property
+    def db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(
+                os.path.join(self.path, 'index.db'), isolation_level=None, timeout=30)
+            conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                key TEXT, variant TEXT, url TEXT, vary TEXT, status INTEGER, headers TEXT,
+                digest TEXT, size INTEGER, request_time REAL, response_time REAL, atime REAL,
+                PRIMARY KEY (key, variant))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_atime ON responses (atime)')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_digest ON responses (digest)')
+        return conn
+
+    def _db_size(self):
+        return self.db.execute('SELECT SUM(size) FROM (SELECT DISTINCT digest, size FROM responses)'
+                               ).fetchone()[0] or 0
+
+    @property
+    def size(self):
+        '''size of stored bodies'''
+        return self._size
+
+    def _key(self, method, url):
+        return hashlib.sha1(('%s %s' % (method.upper(), url)).encode('utf8')).hexdigest()
+
+    def _body_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def lookup(self, method, url, request_headers):
+        '''Return stored response of request, None if not found'''
+        if method.upper() != 'GET':
+            return None
+        request_headers = _lower_headers(request_headers)
+        key = self._key(method, url)
+        for row in self.db.execute('SELECT key, variant, url, vary, status, headers, digest, size, '
+                                   'request_time, response_time FROM responses WHERE key = ?',
+                                   (key, )):
+            vary = json.loads(row[3])
+            if _variant(vary, request_headers) != row[1]:
+                continue
+            self.db.execute('UPDATE responses SET atime = ? WHERE key = ? AND variant = ?',
+                            (time.time(), row[0], row[1]))
+            return CacheEntry(row[0], row[1], row[2], vary, row[4],
+                              [tuple(each) for each in json.loads(row[5])], *row[6:])
+        return None
+
+    def body(self, entry):
+        '''Return body of entry, None if it's lost'''
+        try:
+            with open(self._body_path(entry.digest), 'rb') as fp:
+                return fp.read()
+        except (IOError, OSError):
+            self._delete([(entry.key, entry.variant, entry.digest)])
+            return None
+
+    def storable(self, method, request_headers, status, response_headers):
+        '''If response can be stored, RFC 7234 section 3'''
+        if method.upper() != 'GET':
+            return False
+        request_headers = _lower_headers(request_headers)
+        response_headers = _lower_headers(response_headers)
+        request_directives = parse_cache_control(request_headers.get('cache-control'))
+        directives = parse_cache_control(response_headers.get('cache-control'))
+        if 'no-store' in request_directives or 'no-store' in directives:
+            return False
+        if 'private' in directives:
+            return False
+        if 'authorization' in request_headers and not (
+                'public' in directives or 's-maxage' in directives
+                or 'must-revalidate' in directives):
+            return False
+        if '*' in response_headers.get('vary', ''):
+            return False
+        return (status in CACHEABLE_CODES or 'expires' in response_headers
+                or 'public' in directives or 'max-age' in directives
+                or 's-maxage' in directives)
+
+    def store(self, method, url, request_headers, status, response_headers, body,
+              request_time, response_time):
+        '''Store a response, return the entry, None if not storable'''
+        if not self.storable(method, request_headers, status, response_headers):
+            return None
+        body = body or b''
+        digest = hashlib.sha1(body).hexdigest()
+        path = self._body_path(digest)
+        if not os.path.exists(path):
+            if not os.path.exists(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass
+            tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+            with open(tmp_path, 'wb') as fp:
+                fp.write(body)
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, path)
+            else:
+                os.rename(tmp_path, path)
+
+        request_headers = _lower_headers(request_headers)
+        vary = sorted(set(each.strip().lower() for each in
+                          _lower_headers(response_headers).get('vary', '').split(',')
+                          if each.strip()))
+        headers = [(name, value) for name, value in _header_items(response_headers)
+                   if name.lower() not in NOT_STORED_HEADERS]
+        entry = CacheEntry(self._key(method, url), _variant(vary, request_headers), url, vary,
+                           status, headers, digest, len(body), request_time, response_time)
+        with self._lock:
+            new_body = self.db.execute('SELECT 1 FROM responses WHERE digest = ? LIMIT 1',
+                                       (digest, )).fetchone() is None
+            old = self.db.execute('SELECT digest FROM responses WHERE key = ? AND variant = ?',
+                                  (entry.key, entry.variant)).fetchone()
+            self.db.execute('REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                entry.key, entry.variant, url, json.dumps(vary), status, json.dumps(headers),
+                digest, len(body), request_time, response_time, time.time()))
+            if new_body:
+                self._size += len(body)
+            if old and old[0] != digest:
+                self._remove_body(old[0])
+        if self._size > self.max_size:
+            self.evict()
+        return entry
+
+    def update(self, entry, response_headers, request_time, response_time):
+        '''Update entry with headers of a 304 response, RFC 7234 section 4.3.4'''
+        updated = [(name, value) for name, value in _header_items(response_headers)
+                   if name.lower() not in NOT_UPDATED_HEADERS + NOT_STORED_HEADERS]
+        names = set(name.lower() for name, _ in updated)
+        headers = [(name, value) for name, value in entry.headers
+                   if name.lower() not in names] + updated
+        entry = CacheEntry(entry.key, entry.variant, entry.url, entry.vary, entry.status,
+                           headers, entry.digest, entry.size, request_time, response_time)
+        self.db.execute('UPDATE responses SET headers = ?, request_time = ?, response_time = ?, '
+                        'atime = ? WHERE key = ? AND variant = ?',
+                        (json.dumps(headers), request_time, response_time, time.time(),
+                         entry.key, entry.variant))
+        return entry
+
+    def invalidate(self, url):
+        '''Remove stored responses of url, after an unsafe request'''
+        rows = self.db.execute('SELECT key, variant, digest FROM responses WHERE key = ?',
+                               (self._key('GET', url), )).fetchall()
+        self._delete(rows)
+
+    def _remove_body(self, digest):
+        '''remove body file of digest if it's not used'''
+        if self.db.execute('SELECT 1 FROM responses WHERE digest = ? LIMIT 1',
+                           (digest, )).fetchone() is not None:
+            return
+        path = self._body_path(digest)
+        try:
+            self._size -= os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _delete(self, rows):
+        with self._lock:
+            for key, variant, digest in rows:
+                self.db.execute('DELETE FROM responses WHERE key = ? AND variant = ?',
+                                (key, variant))
+                self._remove_body(digest)
+
+    def evict(self):
+        '''Remove least recently used responses until size is under low_water of max_size'''
+        with self._lock:
+            # bodies may be stored by other processes
+            self._size = self._db_size()
+        while self._size > self.max_size * self.low_water:
+            rows = self.db.execute('SELECT key, variant, digest FROM responses '
+                                   'ORDER BY atime LIMIT 100').fetchall()
+            if not rows:
+                break
+            for row in rows:
+                self._delete([row])
+                if self._size <= self.max_size * self.low_water:
+                    break
+        logger.info('http cache evicted to %d bytes', self._size)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Cache of parsed robots.txt of hosts
+
+Parsed robots.txt are kept in a LRU of max_size hosts, each with its expire
+time. With a path, robots.txt are also stored in a SQLite file, so fetchers in
+other processes share them instead of fetching again. It's thread safe, so
+the SQLite queries can run in threads other than the ioloop of fetcher.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from six.moves.urllib.robotparser import RobotFileParser
+
+logger = logging.getLogger('fetcher')
+
+
+class RobotsTxtCache(object):
+    '''LRU of RobotFileParser by host, with expire time of each host'''
+
+    def __init__(self, max_size=10000, path=None):
+        self.max_size = max_size
+        self.path = path
+        # host -> (expire time, RobotFileParser)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path and os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+    @property
+    def db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute('CREATE TABLE IF NOT EXISTS robots_txt ('
+                         'host TEXT PRIMARY KEY, content TEXT, expire REAL)')
+        return conn
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def parse(content):
+        robot_txt = RobotFileParser()
+        robot_txt.parse(content.splitlines())
+        robot_txt.modified()
+        return robot_txt
+
+    def _put(self, host, expire, robot_txt):
+        with self._lock:
+            self._cache.pop(host, None)
+            self._cache[host] = (expire, robot_txt)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def cached(self, host, now=None):
+        '''Return RobotFileParser of host in memory, None if not cached or expired'''
+        now = now or time.time()
+        with self._lock:
+            if host in self._cache:
+                expire, robot_txt = self._cache.pop(host)
+                if expire > now:
+                    self._cache[host] = (expire, robot_txt)
+                    return robot_txt
+        return None
+
+    def get(self, host, now=None):
+        '''Return RobotFileParser of host, None if not cached or expired'''
+        now = now or time.time()
+        robot_txt = self.cached(host, now)
+        if robot_txt is not None or not self.path:
+            return robot_txt
+        try:
+            row = self.db.execute('SELECT content, expire FROM robots_txt WHERE host = ?',
+                                  (host, )).fetchone()
+        except sqlite3.Error as e:
+            logger.error('load robots.txt of %s error: %r', host, e)
+            return None
+        if row is None or row[1] <= now:
+            return None
+        robot_txt = self.parse(row[0])
+        self._put(host, row[1], robot_txt)
+        return robot_txt
+
+    def set(self, host, content, age, now=None):
+        '''Cache robots.txt content of host for age seconds, return the RobotFileParser'''
+        expire = (now or time.time()) + age
+        robot_txt = self.parse(content)
+        self._put(host, expire, robot_txt)
+        if self.path:
+            try:
+                self.db.execute('REPLACE INTO robots_txt VALUES (?, ?, ?)', (host, content, expire))
+            except sqlite3.Error as e:
+                logger.error('save robots.txt of %s error: %r', host, e)
+        return robot_txt
+
+    def expire(self, now=None):
+        '''Remove expired hosts'''
+        now = now or time.time()
+        with self._lock:
+            for host in [host for host, (expire, _) in self._cache.items() if expire <= now]:
+                del self._cache[host]
+        if self.path:
+            try:
+                self.db.execute('DELETE FROM robots_txt WHERE expire <= ?', (now, ))
+            except sqlite3.Error as e:
+                logger.error('expire robots.txt error: %r', e)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
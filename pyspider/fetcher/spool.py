@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Response body streamed by chunks, spooled to a file when it's large
+"""
+
+import io
+import os
+import time
+import logging
+import tempfile
+
+logger = logging.getLogger('fetcher')
+
+SUFFIX = '.body'
+
+
+class BodyTooLarge(Exception):
+    '''body of response exceeded max_size'''
+
+
+class SpooledBody(object):
+    '''
+    Body of a response written by chunks
+
+    It's kept in memory until threshold bytes, then written to a file in path.
+    BodyTooLarge is raised when it exceeds max_size.
+    '''
+
+    def __init__(self, path=None, threshold=0, max_size=None):
+        self.path = path
+        self.threshold = threshold
+        self.max_size = max_size
+        self.size = 0
+        self.too_large = False
+        self.filename = None
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    @property
+    def spooled(self):
+        return self.filename is not None
+
+    def write(self, chunk):
+        if self.max_size and self.size + len(chunk) > self.max_size:
+            self.too_large = True
+            raise BodyTooLarge('body exceeded max_body_size of %d bytes' % self.max_size)
+        self.size += len(chunk)
+        if self._file is None and self.path and self.threshold and self.size > self.threshold:
+            self._spool()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer.write(chunk)
+
+    def curl_write(self, chunk):
+        '''WRITEFUNCTION of curl, the transfer is aborted by returning 0'''
+        try:
+            self.write(chunk)
+        except Exception as e:
+            if not self.too_large:
+                logger.error('write body error: %r', e)
+            return 0
+        return len(chunk)
+
+    def _spool(self):
+        if not os.path.exists(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                pass
+        fd, self.filename = tempfile.mkstemp(suffix=SUFFIX, dir=self.path)
+        self._file = os.fdopen(fd, 'wb')
+        self._file.write(self._buffer.getvalue())
+        self._buffer = None
+
+    def detach(self):
+        '''Return buffer of body in memory without copying it, None if it's spooled'''
+        buffer = self._buffer
+        if buffer is not None:
+            self._buffer = io.BytesIO()
+            buffer.seek(0)
+        return buffer
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        '''Drop the body, spool file is removed'''
+        self.close()
+        if self.filename:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+            self.filename = None
+        self._buffer = io.BytesIO()
+
+
+def load_spooled(result):
+    '''Read content of a spooled result into memory, the spool file is removed'''
+    filename = result.pop('content_file', None)
+    if filename:
+        with open(filename, 'rb') as fp:
+            result['content'] = fp.read()
+        os.remove(filename)
+    return result
+
+
+def clear_spool(path, age):
+    '''Remove spool files older than age seconds, which are not processed'''
+    if not path or not os.path.isdir(path):
+        return
+    expire = time.time() - age
+    for name in os.listdir(path):
+        filename = os.path.join(path, name)
+        try:
+            if name.endswith(SUFFIX) and os.path.getmtime(filename) < expire:
+                os.remove(filename)
+                logger.warning('spool file %s expired', filename)
+        except OSError:
+            pass
@@ -7,6 +7,7 @@
 
 from __future__ import unicode_literals
 
+import io
 import os
 import sys
 import six
@@ -17,6 +18,9 @@ import logging
 import traceback
 import functools
 import threading
+import collections
+import concurrent.futures
+import pycurl
 import tornado.ioloop
 import tornado.httputil
 import tornado.httpclient
@@ -31,7 +35,6 @@ import requests
 inject_into_urllib3()
 
 from six.moves import queue, http_cookies
-from six.moves.urllib.robotparser import RobotFileParser
 from requests import cookies
 from six.moves.urllib.parse import urljoin, urlsplit
 from tornado import gen
@@ -41,6 +44,9 @@ from tornado.simple_httpclient import SimpleAsyncHTTPClient
 from pyspider.libs import utils, dataurl, counter
 from pyspider.libs.url import quote_chinese
 from .cookie_utils import extract_cookies_to_jar
+from .http_cache import HTTPCache
+from .robots_txt import RobotsTxtCache
+from .spool import SpooledBody, load_spooled, clear_spool
 logger = logging.getLogger('fetcher')
 
 
@@ -101,6 +107,32 @@ class Fetcher(object):
     splash_endpoint = None
     splash_lua_source = open(os.path.join(os.path.dirname(__file__), "splash_fetcher.lua")).read()
     robot_txt_age = 60*60  # 1h
+    # robots.txt failed with 5xx or timeout is retried sooner
+    robot_txt_error_age = 10*60
+    robot_txt_cache_size = 10000
+    # sqlite file sharing robots.txt between fetchers
+    robot_txt_cache_path = None
+    # take tasks from inqueue as soon as a fetch is done, instead of polling it every 100ms
+    event_driven = True
+    # directory and max size of HTTP cache, used by projects with http_cache of crawl_config
+    http_cache_path = None
+    http_cache_size = 1024 * 1024 * 1024
+    # threads doing sqlite and file I/O of HTTP cache and robots.txt cache, off the ioloop
+    io_workers = 4
+    # max size of response body, 0 for unlimited, can been overridden by max_body_size
+    # of task['fetch']
+    max_body_size = 0
+    # bodies larger than spool_threshold are written to files in spool_path, and sent to
+    # processor as content_file, 0 to disable. spool files not processed are removed after spool_age
+    spool_path = None
+    spool_threshold = 0
+    spool_age = 24 * 60 * 60
+    # max simultaneous fetches of a host / project, 0 for unlimited, can been
+    # overridden by host_concurrency / project_concurrency of task['fetch']
+    host_concurrency = 0
+    project_concurrency = 0
+    # tasks are not taken from inqueue when too many tasks are waiting for slots
+    max_waiting_tasks = 1000
 
     def __init__(self, inqueue, outqueue, poolsize=100, proxy=None, async_mode=True):
         self.inqueue = inqueue
@@ -113,7 +145,18 @@ class Fetcher(object):
         self.async_mode = async_mode
         self.ioloop = tornado.ioloop.IOLoop.current()
 
-        self.robots_txt_cache = {}
+        self._robots_txt_cache = None
+        # host -> future of robots.txt being fetched
+        self._robots_txt_loading = {}
+        self._robots_txt_expiring = None
+        # (type, host or project) -> [active fetches, deque of (limit, future) waiting]
+        self._slots = {}
+        self._waiting = 0
+        self._queue_loop_scheduled = False
+        self._wait_inqueue = threading.Event()
+        self._http_cache = None
+        self._http_cache_lock = threading.Lock()
+        self._io_executor = None
 
         # binding io_loop to http_client here
         # In Python 3.13, we need to use AsyncHTTPClient directly to avoid event loop issues
@@ -188,6 +231,15 @@ class Fetcher(object):
                 # Start timer
                 start_time = time.time()
 
+                http_cache = self.http_cache if task.get('fetch', {}).get('http_cache') else None
+                if http_cache is not None:
+                    headers = dict(headers)
+                    entry, conditional, cached = self._http_cache_prepare(
+                        http_cache, method, url, headers, task)
+                    if cached is not None:
+                        self._http_cache_hit(task)
+                        return self._http_cache_result(cached, url, task, start_time)
+
                 try:
                     # Perform request
                     response = requests.request(
@@ -200,6 +252,13 @@ class Fetcher(object):
                         verify=False  # Disable SSL verification for simplicity
                     )
 
+                    if http_cache is not None and not response.history:
+                        cached = self._http_cache_done(
+                            http_cache, method, url, headers, entry, conditional,
+                            response.status_code, response.headers, response.content, start_time)
+                        if cached is not None:
+                            return self._http_cache_result(cached, url, task, start_time)
+
                     # Create result
                     result = {
                         'status_code': response.status_code,
@@ -273,7 +332,11 @@ class Fetcher(object):
 
         fetch_type = 'None'
         start_time = time.time()
+        slots = None
         try:
+            if not url.startswith('data:'):
+                # tasks over limit wait here, without blocking tasks of other hosts
+                slots = yield self.acquire_slots(url, task)
             if url.startswith('data:'):
                 fetch_type = 'data'
                 result = yield gen.maybe_future(self.data_fetch(url, task))
@@ -315,15 +378,20 @@ class Fetcher(object):
         except Exception as e:
             logger.exception(e)
             result = self.handle_error(fetch_type, url, task, start_time, e)
+        finally:
+            if slots:
+                self.release_slots(slots)
 
         callback(fetch_type, task, result)
         self.on_result(fetch_type, task, result)
+        self._wake_queue_loop()
         raise gen.Return(result)
 
     def sync_fetch(self, task):
         '''Synchronization fetch, usually used in xmlrpc thread'''
         if not self._running:
-            return self.ioloop.run_sync(functools.partial(self.async_fetch, task, lambda type_arg, _, result_arg: True))
+            return load_spooled(self.ioloop.run_sync(
+                functools.partial(self.async_fetch, task, lambda type_arg, _, result_arg: True)))
 
         wait_result = threading.Condition()
         _result = {}
@@ -341,7 +409,64 @@ class Fetcher(object):
         while 'result' not in _result:
             wait_result.wait()
         wait_result.release()
-        return _result['result']
+        return load_spooled(_result['result'])
+
+    def _acquire_slot(self, key, limit):
+        '''Return a future resolved when a slot of key is acquired'''
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = [0, collections.deque()]
+        future = tornado.concurrent.Future()
+        if slot[0] < limit and not slot[1]:
+            slot[0] += 1
+            future.set_result(key)
+        else:
+            slot[1].append((limit, future))
+            self._waiting += 1
+        return future
+
+    def _release_slot(self, key):
+        slot = self._slots[key]
+        slot[0] -= 1
+        while slot[1] and slot[0] < slot[1][0][0]:
+            _, future = slot[1].popleft()
+            self._waiting -= 1
+            slot[0] += 1
+            future.set_result(key)
+        if not slot[0] and not slot[1]:
+            del self._slots[key]
+
+    @gen.coroutine
+    def acquire_slots(self, url, task):
+        '''
+        Wait for concurrency slots of project and host of task
+
+        Keys of acquired slots are returned, which should be released by release_slots
+        '''
+        task_fetch = task.get('fetch', {})
+        # host slot is acquired first, a task waiting for its host holds no
+        # project slot, which could block tasks of other hosts in the project
+        limits = (
+            (('host', urlsplit(url).netloc.lower()),
+             task_fetch.get('host_concurrency', self.host_concurrency)),
+            (('project', task.get('project')),
+             task_fetch.get('project_concurrency', self.project_concurrency)),
+        )
+        keys = []
+        start_time = time.time()
+        for key, limit in limits:
+            if limit and limit > 0:
+                keys.append((yield self._acquire_slot(key, int(limit))))
+        if keys:
+            wait_time = time.time() - start_time
+            self._cnt['5m'].event((task.get('project'), 'wait_time'), wait_time)
+            self._cnt['1h'].event((task.get('project'), 'wait_time'), wait_time)
+        raise gen.Return(keys)
+
+    def release_slots(self, keys):
+        '''Release slots acquired by acquire_slots, waiting tasks are waked up'''
+        for key in keys:
+            self._release_slot(key)
 
     def data_fetch(self, url, task):
         '''A fake fetcher for dataurl'''
@@ -454,42 +579,194 @@ class Fetcher(object):
 
         return fetch
 
+    @property
+    def robots_txt_cache(self):
+        '''RobotsTxtCache of hosts'''
+        if self._robots_txt_cache is None:
+            self._robots_txt_cache = RobotsTxtCache(self.robot_txt_cache_size,
+                                                    self.robot_txt_cache_path)
+        return self._robots_txt_cache
+
     @gen.coroutine
     def can_fetch(self, user_agent, url):
         parsed = urlsplit(url)
         domain = parsed.netloc
-        if domain in self.robots_txt_cache:
-            robot_txt = self.robots_txt_cache[domain]
-            if time.time() - robot_txt.mtime() > self.robot_txt_age:
-                robot_txt = None
+        robot_txt = self.robots_txt_cache.cached(domain)
+        if robot_txt is None:
+            if domain in self._robots_txt_loading:
+                # robots.txt of the host is being fetched for another task
+                robot_txt = yield self._robots_txt_loading[domain]
+            else:
+                future = self._robots_txt_loading[domain] = tornado.concurrent.Future()
+                try:
+                    robot_txt = yield self.load_robot_txt(domain, url)
+                    future.set_result(robot_txt)
+                except Exception as e:
+                    future.set_exception(e)
+                    raise
+                finally:
+                    del self._robots_txt_loading[domain]
+
+        raise gen.Return(robot_txt.can_fetch(user_agent, url))
+
+    @gen.coroutine
+    def load_robot_txt(self, domain, url):
+        '''Fetch robots.txt of domain, failures are cached as empty robots.txt'''
+        robots_txt_cache = self.robots_txt_cache
+        if robots_txt_cache.path:
+            # shared by other fetchers
+            robot_txt = yield self._run_on_executor(robots_txt_cache.get, domain)
+            if robot_txt is not None:
+                raise gen.Return(robot_txt)
+
+        age = self.robot_txt_age
+        try:
+            response = yield gen.maybe_future(self.http_client.fetch(
+                urljoin(url, '/robots.txt'), connect_timeout=10, request_timeout=30))
+            content = response.body
+        except Exception as e:
+            logger.error('load robots.txt from %s error: %r', domain, e)
+            content = ''
+            if getattr(e, 'code', 599) >= 500:
+                age = self.robot_txt_error_age
+
+        if isinstance(content, bytes):
+            content = content.decode('utf8', 'ignore')
+        if robots_txt_cache.path:
+            robot_txt = yield self._run_on_executor(robots_txt_cache.set, domain, content or '', age)
         else:
-            robot_txt = None
+            robot_txt = robots_txt_cache.set(domain, content or '', age)
+        raise gen.Return(robot_txt)
 
-        if robot_txt is None:
-            robot_txt = RobotFileParser()
-            try:
-                response = yield gen.maybe_future(self.http_client.fetch(
-                    urljoin(url, '/robots.txt'), connect_timeout=10, request_timeout=30))
-                content = response.body
-            except tornado.httpclient.HTTPError as e:
-                logger.error('load robots.txt from %s error: %r', domain, e)
-                content = ''
+    def clear_robot_txt_cache(self):
+        if not self.robots_txt_cache.path:
+            self.robots_txt_cache.expire()
+        elif self._robots_txt_expiring is None or self._robots_txt_expiring.done():
+            self._robots_txt_expiring = self.io_executor.submit(self.robots_txt_cache.expire)
+
+    def clear_spool(self):
+        clear_spool(self.spool_path, self.spool_age)
+
+    @property
+    def http_cache(self):
+        '''HTTP cache shared by projects, None if http_cache_path is not set'''
+        if self._http_cache is None and self.http_cache_path:
+            with self._http_cache_lock:
+                if self._http_cache is None:
+                    self._http_cache = HTTPCache(self.http_cache_path, self.http_cache_size)
+        return self._http_cache
+
+    @property
+    def io_executor(self):
+        '''executor running disk I/O of caches'''
+        if self._io_executor is None:
+            self._io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.io_workers)
+        return self._io_executor
+
+    def _run_on_executor(self, func, *args):
+        '''Run func in io_executor, return a future of the result'''
+        return tornado.ioloop.IOLoop.current().run_in_executor(self.io_executor, func, *args)
+
+    def _http_cache_run(self, method, *args):
+        '''Run method with http_cache in io_executor, return a future of the result'''
+        return self._run_on_executor(lambda: method(self.http_cache, *args))
+
+    def _http_cache_hit(self, task):
+        self._cnt['5m'].event((task.get('project'), 'cache_hit'), +1)
+        self._cnt['1h'].event((task.get('project'), 'cache_hit'), +1)
+
+    def _http_cache_prepare(self, http_cache, method, url, headers, task):
+        '''
+        Look up the stored response of a request
 
-            try:
-                content = content.decode('utf8', 'ignore')
-            except UnicodeDecodeError:
-                content = ''
+        Return the entry, conditional headers of the request and (code, headers, body)
+        when it can be served from cache. Otherwise validators of the entry are
+        added to headers, and the response is passed to _http_cache_done.
+        '''
+        conditional = dict((name, headers[name]) for name in ('If-None-Match', 'If-Modified-Since')
+                           if name in headers)
+        try:
+            entry = http_cache.lookup(method, url, headers)
+            if entry is None:
+                return None, conditional, None
+            if entry.is_fresh(headers):
+                cached = self._http_cache_response(http_cache, entry, conditional)
+                if cached is not None:
+                    return entry, conditional, cached
+            for name, value in entry.conditional_headers().items():
+                headers[name] = value
+            return entry, conditional, None
+        except Exception as e:
+            logger.exception('http cache lookup of %s error: %r', url, e)
+            return None, conditional, None
 
-            robot_txt.parse(content.splitlines())
-            self.robots_txt_cache[domain] = robot_txt
+    def _http_cache_done(self, http_cache, method, url, headers, entry, conditional,
+                         code, response_headers, body, request_time):
+        '''
+        Store a response from origin, return (code, headers, body) from cache when
+        the entry is validated by 304, None for the response itself
+        '''
+        try:
+            response_time = time.time()
+            if code == 304 and entry is not None:
+                entry = http_cache.update(entry, response_headers, request_time, response_time)
+                return self._http_cache_response(http_cache, entry, conditional)
+            if method.upper() not in ('GET', 'HEAD'):
+                if code < 400:
+                    http_cache.invalidate(url)
+            elif code < 599:
+                http_cache.store(method, url, headers, code, response_headers, body,
+                                 request_time, response_time)
+        except Exception as e:
+            logger.exception('http cache store of %s error: %r', url, e)
+        return None
 
-        raise gen.Return(robot_txt.can_fetch(user_agent, url))
+    def _http_cache_response(self, http_cache, entry, conditional):
+        if entry.not_modified(conditional):
+            code, body = 304, b''
+        else:
+            code, body = entry.status, http_cache.body(entry)
+            if body is None:
+                return None
+        headers = tornado.httputil.HTTPHeaders()
+        for name, value in entry.headers:
+            headers.add(name, value)
+        headers['Age'] = str(int(entry.age()))
+        return code, headers, body
+
+    def _http_cache_result(self, cached, url, task, start_time):
+        code, headers, body = cached
+        result = {
+            'status_code': code,
+            'url': url,
+            'orig_url': url,
+            'headers': dict(headers),
+            'cookies': {},
+            'content': body,
+            'time': time.time() - start_time,
+            'save': task.get('fetch', {}).get('save'),
+        }
+        try:
+            result['content'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+        logger.info("[%d] %s:%s %s (cache) %.2fs", code, task.get('project'),
+                    task.get('taskid'), url, result['time'])
+        return result
 
-    def clear_robot_txt_cache(self):
-        now = time.time()
-        for domain, robot_txt in self.robots_txt_cache.items():
-            if now - robot_txt.mtime() > self.robot_txt_age:
-                del self.robots_txt_cache[domain]
+    def _http_cache_tornado_response(self, request, cached):
+        code, headers, body = cached
+        return tornado.httpclient.HTTPResponse(request, code, headers=headers,
+                                               buffer=io.BytesIO(body),
+                                               effective_url=request.url, request_time=0)
+
+    def _body_response(self, response, buffer):
+        '''response with body buffer streamed by streaming_callback'''
+        return tornado.httpclient.HTTPResponse(
+            response.request, response.code, headers=response.headers,
+            buffer=buffer, effective_url=response.effective_url,
+            error=response.error, request_time=response.request_time,
+            time_info=response.time_info, reason=response.reason)
 
     @gen.coroutine
     def http_fetch(self, url, task):
@@ -520,6 +797,7 @@ class Fetcher(object):
         max_redirects = task_fetch.get('max_redirects', 5)
         # we will handle redirects by hand to capture cookies
         fetch['follow_redirects'] = False
+        use_http_cache = bool(task_fetch.get('http_cache') and self.http_cache_path)
 
         # making requests
         while True:
@@ -545,34 +823,70 @@ class Fetcher(object):
                 logger.exception(fetch)
                 raise gen.Return(handle_error(e))
 
-            try:
-                # In Tornado 6.0+ with Python 3.13, we need to use a different approach
-                # to avoid "Cannot run the event loop while another loop is running" error
-                if not self.async_mode:
-                    # For non-async mode, we need to create a Future and set its result
-                    future = tornado.concurrent.Future()
-                    try:
-                        # Use AsyncHTTPClient directly without run_sync
-                        response_future = self.http_client.fetch(request, raise_error=False)
-                        # Wait for the response using a callback
-                        def on_response(f):
-                            try:
-                                future.set_result(f.result())
-                            except Exception as e:
-                                future.set_exception(e)
-                        response_future.add_done_callback(on_response)
-                        response = yield future
-                    except Exception as e:
-                        future.set_exception(e)
-                        raise
-                else:
-                    # For async mode, we can use the future directly
-                    response = yield self.http_client.fetch(request, raise_error=False)
-            except tornado.httpclient.HTTPError as e:
-                if e.response:
-                    response = e.response
-                else:
-                    raise gen.Return(handle_error(e))
+            # body is streamed, curl transfer is aborted as soon as it's too large
+            body = SpooledBody(self.spool_path, self.spool_threshold,
+                               task_fetch.get('max_body_size', self.max_body_size))
+            request.streaming_callback = body.write
+            request.prepare_curl_callback = lambda curl: curl.setopt(
+                pycurl.WRITEFUNCTION, body.curl_write)
+
+            response = None
+            if use_http_cache:
+                request_time = time.time()
+                entry, conditional, cached = yield self._http_cache_run(
+                    self._http_cache_prepare, request.method, request.url, request.headers, task)
+                if cached is not None:
+                    self._http_cache_hit(task)
+                    response = self._http_cache_tornado_response(request, cached)
+
+            if response is None:
+                try:
+                    # In Tornado 6.0+ with Python 3.13, we need to use a different approach
+                    # to avoid "Cannot run the event loop while another loop is running" error
+                    if not self.async_mode:
+                        # For non-async mode, we need to create a Future and set its result
+                        future = tornado.concurrent.Future()
+                        try:
+                            # Use AsyncHTTPClient directly without run_sync
+                            response_future = self.http_client.fetch(request, raise_error=False)
+                            # Wait for the response using a callback
+                            def on_response(f):
+                                try:
+                                    future.set_result(f.result())
+                                except Exception as e:
+                                    future.set_exception(e)
+                            response_future.add_done_callback(on_response)
+                            response = yield future
+                        except Exception as e:
+                            future.set_exception(e)
+                            raise
+                    else:
+                        # For async mode, we can use the future directly
+                        response = yield self.http_client.fetch(request, raise_error=False)
+                except tornado.httpclient.HTTPError as e:
+                    if e.response:
+                        response = e.response
+                    elif not body.too_large:
+                        body.discard()
+                        raise gen.Return(handle_error(e))
+
+                body.close()
+                if body.too_large:
+                    body.discard()
+                    error = tornado.httpclient.HTTPError(
+                        599, 'Body exceeded max_body_size of %d bytes' % body.max_size)
+                    raise gen.Return(handle_error(error))
+                if response.code == 599:
+                    body.discard()
+                if not body.spooled:
+                    response = self._body_response(response, body.detach())
+
+                if use_http_cache and not body.spooled:
+                    cached = yield self._http_cache_run(
+                        self._http_cache_done, request.method, request.url, request.headers, entry,
+                        conditional, response.code, response.headers, response.body, request_time)
+                    if cached is not None:
+                        response = self._http_cache_tornado_response(request, cached)
 
             extract_cookies_to_jar(session, response.request, response.headers)
             if (response.code in (301, 302, 303, 307)
@@ -592,11 +906,15 @@ class Fetcher(object):
                 if fetch['request_timeout'] < 0:
                     fetch['request_timeout'] = 0.1
                 max_redirects -= 1
+                body.discard()
                 continue
 
             result = {}
             result['orig_url'] = url
             result['content'] = response.body or ''
+            if body.spooled:
+                result['content_file'] = body.filename
+                result['content_size'] = body.size
             result['headers'] = dict(response.headers)
             result['status_code'] = response.code
             result['url'] = response.effective_url or url
@@ -1058,34 +1376,80 @@ class Fetcher(object):
 
         raise gen.Return(result)
 
-    def run(self):
-        '''Run loop'''
-        logger.info("fetcher starting...")
-
-        def queue_loop():
-            if not self.outqueue or not self.inqueue:
-                return
-            while not self._quit:
-                try:
-                    if self.outqueue.full():
-                        break
-                    if self.http_client.free_size() <= 0:
-                        break
-                    task = self.inqueue.get_nowait()
-                    # FIXME: decode unicode_obj should used after data selete from
-                    # database, it's used here for performance
-                    task = utils.decode_unicode_obj(task)
-                    self.fetch(task)
-                except queue.Empty:
+    def queue_loop(self):
+        '''Take tasks from inqueue until the pool is full'''
+        self._queue_loop_scheduled = False
+        if not self.outqueue or not self.inqueue:
+            return
+        if self._wait_inqueue.is_set():
+            # inqueue is empty, it's waited by the bridge thread
+            return
+        while not self._quit:
+            try:
+                if self.outqueue.full():
                     break
-                except KeyboardInterrupt:
+                if self.http_client.free_size() <= 0:
                     break
-                except Exception as e:
-                    logger.exception(e)
+                if self._waiting >= self.max_waiting_tasks:
                     break
+                task = self.inqueue.get_nowait()
+                # FIXME: decode unicode_obj should used after data selete from
+                # database, it's used here for performance
+                task = utils.decode_unicode_obj(task)
+                self.fetch(task)
+            except queue.Empty:
+                if self.event_driven:
+                    self._wait_inqueue.set()
+                break
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                logger.exception(e)
+                break
+
+    def _wake_queue_loop(self):
+        '''Run queue_loop in ioloop soon, a slot of pool may be free'''
+        if self._running and self.event_driven and not self._queue_loop_scheduled:
+            self._queue_loop_scheduled = True
+            self.ioloop.add_callback(self.queue_loop)
 
-        tornado.ioloop.PeriodicCallback(queue_loop, 100).start()
+    def _inqueue_bridge(self):
+        '''
+        Wait for tasks with blocking get of inqueue in a thread
+
+        as message queues can't be waited by ioloop, the task is sent to ioloop,
+        and followed tasks are taken by queue_loop.
+        '''
+        while not self._quit:
+            if not self._wait_inqueue.wait(1):
+                continue
+            try:
+                task = self.inqueue.get(timeout=1)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                logger.exception(e)
+                time.sleep(1)
+                continue
+            self._wait_inqueue.clear()
+            self.ioloop.add_callback(self._on_inqueue_task, task)
+
+    def _on_inqueue_task(self, task):
+        self.fetch(utils.decode_unicode_obj(task))
+        self.queue_loop()
+
+    def run(self):
+        '''Run loop'''
+        logger.info("fetcher starting...")
+
+        bridge = None
+        if self.event_driven and self.outqueue and self.inqueue:
+            # queue_loop is waked when a fetch is done, the periodic callback is
+            # for outqueue being full
+            bridge = utils.run_in_thread(self._inqueue_bridge)
+        tornado.ioloop.PeriodicCallback(self.queue_loop, 100).start()
         tornado.ioloop.PeriodicCallback(self.clear_robot_txt_cache, 10000).start()
+        tornado.ioloop.PeriodicCallback(self.clear_spool, 60000).start()
         self._running = True
 
         try:
@@ -1093,6 +1457,11 @@ class Fetcher(object):
         except KeyboardInterrupt:
             pass
 
+        if bridge is not None:
+            self._quit = True
+            bridge.join()
+        if self._io_executor is not None:
+            self._io_executor.shutdown()
         logger.info("fetcher exiting...")
 
     def quit(self):
@@ -1108,15 +1477,15 @@ class Fetcher(object):
         return self.http_client.size()
 
     def xmlrpc_run(self, port=24444, bind='127.0.0.1', log_requests=False):
-        '''Run xmlrpc server'''
+        '''Run xmlrpc server, msgpack rpc is served on the same port'''
         import umsgpack
-        from pyspider.libs.wsgi_xmlrpc import WSGIXMLRPCApplication
+        from pyspider.libs.msgpack_rpc import WSGIRPCApplication
         try:
             from xmlrpc.client import Binary
         except ImportError:
             from xmlrpclib import Binary
 
-        application = WSGIXMLRPCApplication()
+        application = WSGIRPCApplication()
 
         application.register_function(self.quit, '_quit')
         application.register_function(self.size)
@@ -1155,7 +1524,10 @@ class Fetcher(object):
         self._cnt['1h'].event((task.get('project'), status_code), +1)
 
         if fetch_type in ('http', 'phantomjs') and result.get('time'):
-            content_len = len(result.get('content', ''))
+            if result.get('content_file'):
+                content_len = result['content_size']
+            else:
+                content_len = len(result.get('content', ''))
             self._cnt['5m'].event((task.get('project'), 'speed'),
                                   float(content_len) / result.get('time'))
             self._cnt['1h'].event((task.get('project'), 'speed'),
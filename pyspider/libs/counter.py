@@ -7,8 +7,13 @@
 
 from __future__ import unicode_literals, division, absolute_import
 
+import os
+import sys
 import time
+import zlib
+import struct
 import logging
+from array import array
 from collections import deque
 try:
     from UserDict import DictMixin
@@ -22,6 +27,11 @@ import six
 from six import iteritems
 from six.moves import cPickle
 
+from pyspider.libs import utils
+
+# typecode of arrays of window counters, str for python2 with unicode_literals
+_TYPECODE = str('d')
+
 
 class BaseCounter(object):
 
@@ -50,6 +60,14 @@ class BaseCounter(object):
         """Clear counter"""
         raise NotImplementedError
 
+    def _expire(self, now):
+        """Trim counter to time now, return True if it's empty"""
+        return self.empty()
+
+    def _peek(self, name):
+        """Get value of counter trimmed by _expire"""
+        return getattr(self, name)
+
 
 class TotalCounter(BaseCounter):
     """Total counter"""
@@ -104,44 +122,95 @@ class AverageWindowCounter(BaseCounter):
             return True
 
 
-class TimebaseAverageEventCounter(BaseCounter):
+class _TimebaseWindowCounter(BaseCounter):
     """
-    Record last window_size * window_interval seconds event.
+    Base of time based window counters.
 
-    records will trim ever window_interval seconds
+    Values of an open window are cached, closed windows are kept in a ring buffer
+    of arrays with running sums updated when windows are appended or dropped, so
+    reading sum or avg is O(1). The arrays grow to window_size at most.
     """
 
     def __init__(self, window_size=30, window_interval=10):
-        super(TimebaseAverageEventCounter, self).__init__()
+        super(_TimebaseWindowCounter, self).__init__()
         self.max_window_size = window_size
         self.window_size = 0
         self.window_interval = window_interval
-        self.values = deque(maxlen=window_size)
-        self.events = deque(maxlen=window_size)
-        self.times = deque(maxlen=window_size)
+        self._times = array(_TYPECODE)
+        self._values = array(_TYPECODE)
+        self._head = 0
+        self._count = 0
+        self._sum = 0
+        # number of windows ever closed, to find the windows closed since a time
+        self._closed = 0
 
         self.cache_value = 0
         self.cache_event = 0
         self.cache_start = None
         self._first_data_time = None
 
+    def __setstate__(self, state):
+        times = state.pop('times', None)
+        values = state.pop('values', None)
+        self.__dict__.update(state)
+        if times is not None:
+            # dumped by older versions, with closed windows in deques
+            self._times = array(_TYPECODE, times)
+            self._values = array(_TYPECODE, values)
+            self._head = 0
+            self._count = len(times)
+            self._sum = sum(values)
+            self._closed = len(times)
+            self.__dict__.setdefault('cache_event', 0)
+
+    def _open_window(self, value=0, start=None):
+        self.cache_value = value
+        self.cache_event = 0 if start is None else 1
+        self.cache_start = start
+
+    def _push(self, start, value, event):
+        """Append a closed window to the ring, return its slot"""
+        if self._count == self.max_window_size:
+            self._drop_window()
+        i = (self._head + self._count) % self.max_window_size
+        if i == len(self._times):
+            self._times.append(start)
+            self._values.append(value)
+        else:
+            self._times[i] = start
+            self._values[i] = value
+        self._count += 1
+        self._closed += 1
+        self._sum += value
+        return i
+
+    def _close_window(self):
+        """Move the open window into the ring"""
+        self._push(self.cache_start, self.cache_value, self.cache_event)
+        self.on_append(self.cache_value, self.cache_start)
+
+    def _drop_window(self):
+        """Drop the oldest window in the ring, return its slot"""
+        i = self._head
+        self._head = (i + 1) % self.max_window_size
+        self._count -= 1
+        if self._count:
+            self._sum -= self._values[i]
+        else:
+            # don't carry rounding errors of floats forever
+            self._sum = 0
+        return i
+
     def event(self, value=1):
         now = time.time()
         if self._first_data_time is None:
             self._first_data_time = now
 
         if self.cache_start is None:
-            self.cache_value = value
-            self.cache_event = 1
-            self.cache_start = now
+            self._open_window(value, now)
         elif now - self.cache_start > self.window_interval:
-            self.values.append(self.cache_value)
-            self.events.append(self.cache_event)
-            self.times.append(self.cache_start)
-            self.on_append(self.cache_value, self.cache_start)
-            self.cache_value = value
-            self.cache_event = 1
-            self.cache_start = now
+            self._close_window()
+            self._open_window(value, now)
         else:
             self.cache_value += value
             self.cache_event += 1
@@ -150,122 +219,111 @@ class TimebaseAverageEventCounter(BaseCounter):
     def value(self, value):
         self.cache_value = value
 
-    def _trim_window(self):
-        now = time.time()
+    def _trim_window(self, now=None):
+        now = now or time.time()
         if self.cache_start and now - self.cache_start > self.window_interval:
-            self.values.append(self.cache_value)
-            self.events.append(self.cache_event)
-            self.times.append(self.cache_start)
-            self.on_append(self.cache_value, self.cache_start)
-            self.cache_value = 0
-            self.cache_start = None
+            self._close_window()
+            self._open_window()
 
         if self.window_size != self.max_window_size and self._first_data_time is not None:
             time_passed = now - self._first_data_time
             self.window_size = min(self.max_window_size, time_passed / self.window_interval)
         window_limit = now - self.window_size * self.window_interval
-        while self.times and self.times[0] < window_limit:
-            self.times.popleft()
-            self.events.popleft()
-            self.values.popleft()
+        while self._count and self._times[self._head] < window_limit:
+            self._drop_window()
+
+    def _expire(self, now):
+        self._trim_window(now)
+        return not self._count and not self.cache_start
+
+    def _peek(self, name):
+        return getattr(self, '_get_' + name)()
+
+    def _get_sum(self):
+        return self._sum + self.cache_value
 
     @property
     def avg(self):
-        events = (sum(self.events) + self.cache_event)
-        if not events:
-            return 0
-        return float(self.sum) / events
+        self._trim_window()
+        return self._get_avg()
 
     @property
     def sum(self):
         self._trim_window()
-        return sum(self.values) + self.cache_value
+        return self._get_sum()
 
     def empty(self):
-        self._trim_window()
-        if not self.values and not self.cache_start:
-            return True
+        return self._expire(time.time())
 
     def on_append(self, value, time):
         pass
 
 
-class TimebaseAverageWindowCounter(BaseCounter):
+class TimebaseAverageEventCounter(_TimebaseWindowCounter):
     """
-    Record last window_size * window_interval seconds values.
+    Record last window_size * window_interval seconds event.
 
     records will trim ever window_interval seconds
     """
 
     def __init__(self, window_size=30, window_interval=10):
-        super(TimebaseAverageWindowCounter, self).__init__()
-        self.max_window_size = window_size
-        self.window_size = 0
-        self.window_interval = window_interval
-        self.values = deque(maxlen=window_size)
-        self.times = deque(maxlen=window_size)
-
-        self.cache_value = 0
-        self.cache_start = None
-        self._first_data_time = None
-
-    def event(self, value=1):
-        now = time.time()
-        if self._first_data_time is None:
-            self._first_data_time = now
-
-        if self.cache_start is None:
-            self.cache_value = value
-            self.cache_start = now
-        elif now - self.cache_start > self.window_interval:
-            self.values.append(self.cache_value)
-            self.times.append(self.cache_start)
-            self.on_append(self.cache_value, self.cache_start)
-            self.cache_value = value
-            self.cache_start = now
+        super(TimebaseAverageEventCounter, self).__init__(window_size, window_interval)
+        self._events = array(_TYPECODE)
+        self._event_sum = 0
+
+    def __setstate__(self, state):
+        events = state.pop('events', None)
+        super(TimebaseAverageEventCounter, self).__setstate__(state)
+        if events is not None:
+            self._events = array(_TYPECODE, events)
+            self._event_sum = sum(events)
+
+    def _push(self, start, value, event):
+        i = super(TimebaseAverageEventCounter, self)._push(start, value, event)
+        if i == len(self._events):
+            self._events.append(event)
         else:
-            self.cache_value += value
-        return self
+            self._events[i] = event
+        self._event_sum += event
+        return i
+
+    def _drop_window(self):
+        i = super(TimebaseAverageEventCounter, self)._drop_window()
+        if self._count:
+            self._event_sum -= self._events[i]
+        else:
+            self._event_sum = 0
+        return i
 
-    def value(self, value):
-        self.cache_value = value
+    def _get_avg(self):
+        events = self._event_sum + self.cache_event
+        if not events:
+            return 0
+        return float(self._get_sum()) / events
 
-    def _trim_window(self):
-        now = time.time()
-        if self.cache_start and now - self.cache_start > self.window_interval:
-            self.values.append(self.cache_value)
-            self.times.append(self.cache_start)
-            self.on_append(self.cache_value, self.cache_start)
-            self.cache_value = 0
-            self.cache_start = None
 
-        if self.window_size != self.max_window_size and self._first_data_time is not None:
-            time_passed = now - self._first_data_time
-            self.window_size = min(self.max_window_size, time_passed / self.window_interval)
-        window_limit = now - self.window_size * self.window_interval
-        while self.times and self.times[0] < window_limit:
-            self.times.popleft()
-            self.values.popleft()
+class TimebaseAverageWindowCounter(_TimebaseWindowCounter):
+    """
+    Record last window_size * window_interval seconds values.
 
-    @property
-    def avg(self):
-        sum = float(self.sum)
+    records will trim ever window_interval seconds
+    """
+
+    def _get_avg(self):
         if not self.window_size:
             return 0
-        return sum / self.window_size / self.window_interval
+        return float(self._get_sum()) / self.window_size / self.window_interval
 
-    @property
-    def sum(self):
-        self._trim_window()
-        return sum(self.values) + self.cache_value
 
-    def empty(self):
-        self._trim_window()
-        if not self.values and not self.cache_start:
-            return True
+class _Node(dict):
+    """
+    Node of the prefix index of CounterManager, children by next element of key.
+    """
+    __slots__ = ('counter', )
 
-    def on_append(self, value, time):
-        pass
+    def __init__(self):
+        super(_Node, self).__init__()
+        self.counter = None
 
 
 class CounterValue(DictMixin):
@@ -283,21 +341,7 @@ class CounterValue(DictMixin):
             return self.manager.counters[key]
         else:
             key = self._keys + (key, )
-
-        available_keys = []
-        for _key in list(self.manager.counters.keys()):
-            if _key[:len(key)] == key:
-                available_keys.append(_key)
-
-        if len(available_keys) == 0:
-            raise KeyError
-        elif len(available_keys) == 1:
-            if available_keys[0] == key:
-                return self.manager.counters.get(key)
-            else:
-                return CounterValue(self.manager, key)
-        else:
-            return CounterValue(self.manager, key)
+        return self.manager._get(key)
 
     def __len__(self):
         return len(self.keys())
@@ -309,11 +353,12 @@ class CounterValue(DictMixin):
         return key in self.keys()
 
     def keys(self):
-        result = set()
-        for key in list(self.manager.counters.keys()):
-            if key[:len(self._keys)] == self._keys:
-                key = key[len(self._keys):]
-                result.add(key[0] if key else '__value__')
+        node = self.manager._node(self._keys)
+        if node is None:
+            return set()
+        result = set(node)
+        if node.counter is not None:
+            result.add('__value__')
         return result
 
     def to_dict(self, get_value=None):
@@ -337,66 +382,126 @@ class CounterManager(DictMixin):
     with manager['foo']['bar'].  Or get all counters which first element is 'foo'
     by manager['foo'].
 
-    It's useful for a group of counters.
+    It's useful for a group of counters. Counters are indexed by a tree of key
+    elements, visiting a prefix takes O(length of key).
     """
 
     def __init__(self, cls=TimebaseAverageWindowCounter):
         """init manager with Counter cls"""
         self.cls = cls
         self.counters = {}
-
-    def event(self, key, value=1):
-        """Fire a event of a counter by counter key"""
+        self._index = _Node()
+        # called when counters are removed, to invalidate caches of CounterGroup
+        self._on_remove = []
+        # keys of counters changed since last write of CounterJournal
+        self._changed = None
+
+    def _node(self, key):
+        node = self._index
+        for _key in key:
+            node = node.get(_key)
+            if node is None:
+                return None
+        return node
+
+    def _counter(self, key):
+        """Get or create counter of key"""
         if isinstance(key, six.string_types):
             key = (key, )
         assert isinstance(key, tuple), "event key type error"
-        if key not in self.counters:
-            self.counters[key] = self.cls()
-        self.counters[key].event(value)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self._insert(key, self.cls())
+        if self._changed is not None:
+            self._changed.add(key)
+        return counter
+
+    def _insert(self, key, counter):
+        """Set counter of key"""
+        self.counters[key] = counter
+        node = self._index
+        for _key in key:
+            node = node.setdefault(_key, _Node())
+        node.counter = counter
+        return counter
+
+    def _get(self, key):
+        node = self._node(key)
+        if node is None:
+            raise KeyError(key)
+        if not node and node.counter is not None:
+            return node.counter
+        return CounterValue(self, key)
+
+    def _remove(self, key):
+        """Remove counter of key, and the nodes with no counter left"""
+        self.counters.pop(key, None)
+        if self._changed is not None:
+            self._changed.add(key)
+        path = [self._index]
+        for _key in key:
+            node = path[-1].get(_key)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].counter = None
+        for i in range(len(key), 0, -1):
+            if path[i] or path[i].counter is not None:
+                break
+            del path[i - 1][key[i - 1]]
+
+    def _removed(self):
+        for callback in self._on_remove:
+            callback()
+
+    def _rebuild_index(self):
+        self._index = _Node()
+        for key, counter in iteritems(self.counters):
+            node = self._index
+            for _key in key:
+                node = node.setdefault(_key, _Node())
+            node.counter = counter
+
+    def event(self, key, value=1):
+        """Fire a event of a counter by counter key"""
+        self._counter(key).event(value)
         return self
 
     def value(self, key, value=1):
         """Set value of a counter by counter key"""
-        if isinstance(key, six.string_types):
-            key = (key, )
-        # assert all(isinstance(k, six.string_types) for k in key)
-        assert isinstance(key, tuple), "event key type error"
-        if key not in self.counters:
-            self.counters[key] = self.cls()
-        self.counters[key].value(value)
+        self._counter(key).value(value)
         return self
 
     def trim(self):
         """Clear not used counters"""
+        now = time.time()
+        removed = False
         for key, value in list(iteritems(self.counters)):
-            if value.empty():
-                del self.counters[key]
+            if value._expire(now):
+                self._remove(key)
+                removed = True
+        if removed:
+            self._removed()
 
     def __getitem__(self, key):
-        key = (key, )
-        available_keys = []
-        for _key in list(self.counters.keys()):
-            if _key[:len(key)] == key:
-                available_keys.append(_key)
-
-        if len(available_keys) == 0:
-            raise KeyError
-        elif len(available_keys) == 1:
-            if available_keys[0] == key:
-                return self.counters.get(key)
-            else:
-                return CounterValue(self, key)
-        else:
-            return CounterValue(self, key)
+        return self._get((key, ))
 
     def __delitem__(self, key):
-        key = (key, )
-        available_keys = []
-        for _key in list(self.counters.keys()):
-            if _key[:len(key)] == key:
-                available_keys.append(_key)
-        for _key in available_keys:
-            del self.counters[_key]
+        node = self._index.pop(key, None)
+        if node is None:
+            return
+        stack = [((key, ), node)]
+        while stack:
+            _key, node = stack.pop()
+            if node.counter is not None:
+                self.counters.pop(_key, None)
+                if self._changed is not None:
+                    self._changed.add(_key)
+            stack.extend((_key + (k, ), child) for k, child in iteritems(node))
+        self._removed()
+
+    def __contains__(self, key):
+        return key in self._index
 
     def __iter__(self):
         return iter(self.keys())
@@ -405,22 +510,34 @@ class CounterManager(DictMixin):
         return len(self.keys())
 
     def keys(self):
-        result = set()
-        for key in self.counters.keys():
-            result.add(key[0] if key else ())
+        result = set(self._index)
+        if self._index.counter is not None:
+            result.add(())
         return result
 
     def to_dict(self, get_value=None):
-        """Dump counters as a dict"""
-        self.trim()
+        """
+        Dump counters as a dict
+
+        All counters are trimmed to the same time and read in one pass, not used
+        counters are cleared on the way.
+        """
+        now = time.time()
+        removed = False
         result = {}
-        for key, value in iteritems(self.counters):
+        for key, value in list(iteritems(self.counters)):
+            if value._expire(now):
+                self._remove(key)
+                removed = True
+                continue
             if get_value is not None:
-                value = getattr(value, get_value)
+                value = value._peek(get_value)
             r = result
             for _key in key[:-1]:
                 r = r.setdefault(_key, {})
             r[key[-1]] = value
+        if removed:
+            self._removed()
         return result
 
     def dump(self, filename):
@@ -441,4 +558,348 @@ class CounterManager(DictMixin):
         except:
             logging.debug("can't load counter from file: %s", filename)
             return False
+        self._rebuild_index()
+        self._removed()
         return True
+
+
+class CounterGroup(object):
+    """
+    Fire a event to counters of the same key in several CounterManagers.
+
+    e.g. the 5m, 1h and 1d window counters of a project. Counters of a key are
+    looked up once and cached together, the cache is cleared when counters are
+    removed from any of the managers.
+    """
+
+    def __init__(self, *managers):
+        self.managers = managers
+        self._cache = {}
+        for manager in managers:
+            manager._on_remove.append(self._cache.clear)
+
+    def event(self, key, value=1):
+        """Fire a event of counters by counter key"""
+        if isinstance(key, six.string_types):
+            key = (key, )
+        counters = self._cache.get(key)
+        if counters is None:
+            counters = self._cache[key] = tuple(m._counter(key) for m in self.managers)
+        else:
+            for manager in self.managers:
+                if manager._changed is not None:
+                    manager._changed.add(key)
+        for counter in counters:
+            counter.event(value)
+        return self
+
+
+# magic, version
+_JOURNAL_HEADER = struct.Struct('<4sB')
+_JOURNAL_MAGIC = b'PSCJ'
+_JOURNAL_VERSION = 1
+# length and crc32 of records of a batch
+_JOURNAL_BATCH = struct.Struct('<II')
+# kind, number of key elements
+_JOURNAL_RECORD = struct.Struct('<BB')
+# length of a key element
+_JOURNAL_KEY = struct.Struct('<H')
+_JOURNAL_INT = struct.Struct('<q')
+_JOURNAL_FLOAT = struct.Struct('<d')
+# max window size, window interval, window size, first data time, cache start,
+# cache value, cache event, number of windows
+# followed by start times, values (and events) of the windows
+_JOURNAL_WINDOW = struct.Struct('<IddddddI')
+
+_REMOVED = 0
+_TOTAL_INT = 1
+_TOTAL_FLOAT = 2
+_WINDOW = 3
+_EVENT_WINDOW = 4
+# flag of window records, the counter is written as a whole, not new windows only
+_RESET = 0x80
+
+_NAN = float('nan')
+
+
+def _le_bytes(arr):
+    if sys.byteorder == 'big':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes() if hasattr(arr, 'tobytes') else arr.tostring()
+
+
+def _le_array(data):
+    arr = array(_TYPECODE)
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr
+
+
+def _encode_record(key, counter, closed=None):
+    """
+    Encode a journal record of counter of key, None counter for removed.
+
+    Only windows closed after `closed` windows are written for window counters,
+    all of them when closed is None.
+    """
+    key = [utils.utf8(_key) for _key in key]
+    payload = []
+    if counter is None:
+        kind = _REMOVED
+    elif isinstance(counter, TotalCounter):
+        cnt = counter.cnt
+        if isinstance(cnt, six.integer_types) and -2 ** 63 <= cnt < 2 ** 63:
+            kind = _TOTAL_INT
+            payload.append(_JOURNAL_INT.pack(cnt))
+        else:
+            kind = _TOTAL_FLOAT
+            payload.append(_JOURNAL_FLOAT.pack(cnt))
+    elif isinstance(counter, _TimebaseWindowCounter):
+        events = isinstance(counter, TimebaseAverageEventCounter)
+        kind = _EVENT_WINDOW if events else _WINDOW
+        count = counter._count
+        if closed is None or closed > counter._closed:
+            kind |= _RESET
+            n = count
+        else:
+            n = min(counter._closed - closed, count)
+        payload.append(_JOURNAL_WINDOW.pack(
+            counter.max_window_size, counter.window_interval, counter.window_size,
+            _NAN if counter._first_data_time is None else counter._first_data_time,
+            _NAN if counter.cache_start is None else counter.cache_start,
+            counter.cache_value, counter.cache_event, n))
+        arrays = [counter._times, counter._values]
+        if events:
+            arrays.append(counter._events)
+        start = (counter._head + count - n) % counter.max_window_size
+        for arr in arrays:
+            if start + n <= len(arr):
+                payload.append(_le_bytes(arr[start:start + n]))
+            else:
+                payload.append(_le_bytes(arr[start:] + arr[:start + n - len(arr)]))
+    else:
+        raise TypeError('%s can not be journaled' % type(counter).__name__)
+
+    result = [_JOURNAL_RECORD.pack(kind, len(key))]
+    for _key in key:
+        result.append(_JOURNAL_KEY.pack(len(_key)))
+        result.append(_key)
+    return b''.join(result + payload)
+
+
+def _decode_record(manager, data, offset):
+    """Apply the journal record at offset of data to manager, return offset of next one"""
+    kind, nkeys = _JOURNAL_RECORD.unpack_from(data, offset)
+    offset += _JOURNAL_RECORD.size
+    key = []
+    for _ in range(nkeys):
+        length, = _JOURNAL_KEY.unpack_from(data, offset)
+        offset += _JOURNAL_KEY.size
+        key.append(utils.text(data[offset:offset + length]))
+        offset += length
+    key = tuple(key)
+
+    if kind == _REMOVED:
+        manager._remove(key)
+    elif kind in (_TOTAL_INT, _TOTAL_FLOAT):
+        struct_ = _JOURNAL_INT if kind == _TOTAL_INT else _JOURNAL_FLOAT
+        counter = manager.counters.get(key)
+        if not isinstance(counter, TotalCounter):
+            counter = manager._insert(key, TotalCounter())
+        counter.cnt, = struct_.unpack_from(data, offset)
+        offset += struct_.size
+    elif kind & ~_RESET in (_WINDOW, _EVENT_WINDOW):
+        cls = TimebaseAverageEventCounter if kind & ~_RESET == _EVENT_WINDOW \
+            else TimebaseAverageWindowCounter
+        (max_window_size, window_interval, window_size, first_data_time, cache_start,
+         cache_value, cache_event, n) = _JOURNAL_WINDOW.unpack_from(data, offset)
+        offset += _JOURNAL_WINDOW.size
+        windows = []
+        for _ in range(3 if cls is TimebaseAverageEventCounter else 2):
+            if offset + n * 8 > len(data):
+                raise ValueError('counter journal record truncated')
+            windows.append(_le_array(data[offset:offset + n * 8]))
+            offset += n * 8
+
+        counter = manager.counters.get(key)
+        if kind & _RESET or type(counter) is not cls \
+                or counter.max_window_size != max_window_size:
+            counter = manager._insert(key, cls(max_window_size, window_interval))
+            if n:
+                counter._times, counter._values = windows[0], windows[1]
+                counter._count = counter._closed = n
+                counter._sum = sum(counter._values)
+                if cls is TimebaseAverageEventCounter:
+                    counter._events = windows[2]
+                    counter._event_sum = sum(counter._events)
+        else:
+            events = windows[2] if len(windows) == 3 else None
+            for i in range(n):
+                counter._push(windows[0][i], windows[1][i], events[i] if events is not None else 0)
+        counter.window_interval = window_interval
+        counter.window_size = window_size
+        counter._first_data_time = None if first_data_time != first_data_time else first_data_time
+        counter.cache_start = None if cache_start != cache_start else cache_start
+        counter.cache_value = cache_value
+        counter.cache_event = cache_event
+    else:
+        raise ValueError('unknown counter journal record %d' % kind)
+    return offset
+
+
+class CounterJournal(object):
+    """
+    Append-only journal of the counters of a CounterManager.
+
+    Counters changed since last `write` are appended as a batch of binary records,
+    with only the windows closed since last write for window counters, so cost of
+    a write depends on the number of changed counters. When the journal is
+    `compact_ratio` times larger than after last compaction, all counters are
+    written to a temporary file renamed over it. A batch broken by a crash is
+    dropped when replayed by `load`.
+    """
+
+    compact_ratio = 2
+    compact_min_size = 1024 * 1024
+    # size of records in a batch of compaction
+    batch_size = 1024 * 1024
+
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.path = path
+        self._fp = None
+        self._size = 0
+        self._compacted_size = 0
+        # counter and number of its closed windows at last write, by key
+        self._written = {}
+        manager._changed = set()
+
+    def _mark_written(self, key, counter):
+        self._written[key] = (counter, getattr(counter, '_closed', None))
+
+    def load(self):
+        """Replay journal to counters of manager, return False if not loaded"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as fp:
+                data = fp.read()
+            magic, version = _JOURNAL_HEADER.unpack_from(data, 0)
+            if magic != _JOURNAL_MAGIC or version != _JOURNAL_VERSION:
+                raise ValueError('unknown counter journal format')
+        except Exception as e:
+            logging.error("can't load counter journal %s: %r", self.path, e)
+            return False
+
+        offset = _JOURNAL_HEADER.size
+        while offset < len(data):
+            try:
+                length, crc = _JOURNAL_BATCH.unpack_from(data, offset)
+                start, end = offset + _JOURNAL_BATCH.size, offset + _JOURNAL_BATCH.size + length
+                records = data[start:end]
+                if len(records) != length or zlib.crc32(records) & 0xffffffff != crc:
+                    raise ValueError('broken batch')
+                while start < end:
+                    start = _decode_record(self.manager, data, start)
+            except Exception as e:
+                logging.warning("counter journal %s is broken at %d, dropped: %r",
+                                self.path, offset, e)
+                break
+            offset = end
+
+        try:
+            if offset < len(data):
+                with open(self.path, 'r+b') as fp:
+                    fp.truncate(offset)
+            self._fp = open(self.path, 'ab')
+        except Exception as e:
+            logging.warning("can't open counter journal %s: %s", self.path, e)
+        self._size = self._compacted_size = offset
+        self._written = {}
+        for key, counter in iteritems(self.manager.counters):
+            self._mark_written(key, counter)
+        self.manager._changed = set()
+        self.manager._removed()
+        return True
+
+    def write(self):
+        """Append counters changed since last write to journal"""
+        if self._fp is None or self._size > max(self.compact_min_size,
+                                                self._compacted_size * self.compact_ratio):
+            return self.compact()
+        changed, self.manager._changed = self.manager._changed, set()
+        if not changed:
+            return True
+        records = []
+        for key in changed:
+            counter = self.manager.counters.get(key)
+            if counter is None:
+                self._written.pop(key, None)
+                records.append(_encode_record(key, None))
+                continue
+            written = self._written.get(key)
+            closed = written[1] if written and written[0] is counter else None
+            records.append(_encode_record(key, counter, closed))
+            self._mark_written(key, counter)
+        records = b''.join(records)
+        batch = _JOURNAL_BATCH.pack(len(records), zlib.crc32(records) & 0xffffffff) + records
+        try:
+            self._fp.write(batch)
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+        except Exception as e:
+            logging.warning("can't write counter journal %s: %s", self.path, e)
+            # the batch may be written partly, all counters are written in next write
+            self.close()
+            return False
+        self._size += len(batch)
+        return True
+
+    def compact(self):
+        """Write all counters to a new journal"""
+        self.manager._changed = set()
+        written = {}
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as fp:
+                fp.write(_JOURNAL_HEADER.pack(_JOURNAL_MAGIC, _JOURNAL_VERSION))
+                size = _JOURNAL_HEADER.size
+                records, records_size = [], 0
+                items = list(iteritems(self.manager.counters))
+                for i, (key, counter) in enumerate(items):
+                    record = _encode_record(key, counter)
+                    written[key] = (counter, getattr(counter, '_closed', None))
+                    records.append(record)
+                    records_size += len(record)
+                    if records_size < self.batch_size and i + 1 < len(items):
+                        continue
+                    records = b''.join(records)
+                    fp.write(_JOURNAL_BATCH.pack(len(records), zlib.crc32(records) & 0xffffffff))
+                    fp.write(records)
+                    size += _JOURNAL_BATCH.size + len(records)
+                    records, records_size = [], 0
+                fp.flush()
+                os.fsync(fp.fileno())
+            self.close()
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, self.path)
+            else:
+                os.rename(tmp_path, self.path)
+            self._fp = open(self.path, 'ab')
+        except Exception as e:
+            logging.warning("can't compact counter journal %s: %s", self.path, e)
+            self.close()
+            return False
+        self._size = self._compacted_size = size
+        self._written = written
+        return True
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+msgpack RPC over HTTP
+
+A call is POSTed with Content-Type application/x-msgpack, the body is msgpack of
+[method, params], the response is msgpack of [error, result]. It's served on the
+same port as XML-RPC by WSGIRPCApplication, clients are connected with a
+msgpack:// url, e.g. msgpack://127.0.0.1:23333/
+"""
+
+import socket
+import logging
+import functools
+import threading
+
+import umsgpack
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
+try:
+    from xmlrpc.client import Binary
+except ImportError:
+    from xmlrpclib import Binary
+
+from pyspider.libs.wsgi_xmlrpc import WSGIXMLRPCApplication
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/x-msgpack'
+SCHEME = 'msgpack://'
+
+
+class RPCError(Exception):
+    '''error raised by the remote method'''
+
+
+class WSGIRPCApplication(WSGIXMLRPCApplication):
+    """Application serving registered functions in both XML-RPC and msgpack RPC"""
+
+    def handle_POST(self, environ, start_response):
+        content_type = environ.get('CONTENT_TYPE', '').split(';')[0].strip()
+        if content_type != CONTENT_TYPE:
+            return super(WSGIRPCApplication, self).handle_POST(environ, start_response)
+
+        try:
+            length = int(environ['CONTENT_LENGTH'])
+            method, params = umsgpack.unpackb(environ['wsgi.input'].read(length))
+        except Exception as e:
+            logger.error('bad msgpack rpc request: %r', e)
+            start_response("400 Bad request", [('Content-Type', 'text/plain')])
+            return [b'']
+
+        try:
+            result = self.dispatcher._dispatch(method, params)
+            # binary of XML-RPC is sent as bytes
+            if isinstance(result, Binary):
+                result = result.data
+            response = umsgpack.packb([None, result])
+        except Exception as e:
+            response = umsgpack.packb(['%s:%s' % (type(e).__name__, e), None])
+        start_response("200 OK", [('Content-Type', CONTENT_TYPE),
+                                  ('Content-Length', str(len(response)))])
+        return [response]
+
+
+class MsgpackRPCClient(object):
+    '''
+    client of msgpack RPC, remote methods are called as attributes like ServerProxy
+
+    a HTTP connection is kept alive for each thread and reused by calls.
+    '''
+
+    def __init__(self, url, timeout=None):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http_client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+            return connection, False
+        return connection, True
+
+    def _close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _call(self, method, *params):
+        body = umsgpack.packb([method, list(params)])
+        while True:
+            connection, reused = self._connection()
+            try:
+                connection.request('POST', self.path, body, {'Content-Type': CONTENT_TYPE})
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except socket.timeout:
+                self._close()
+                raise
+            except (http_client.HTTPException, socket.error):
+                self._close()
+                # a kept alive connection may be closed by server, retry with a new one
+                if not reused:
+                    raise
+        if response.status != 200:
+            raise RPCError('%s %s' % (response.status, response.reason))
+        error, result = umsgpack.unpackb(data)
+        if error is not None:
+            raise RPCError(error)
+        return result
+
+    def __getattr__(self, name):
+        # methods starting with _ like _quit are remote methods, but not __dunder__
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return functools.partial(self._call, name)
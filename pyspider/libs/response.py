@@ -33,14 +33,18 @@ from pyspider.libs.selector_error_handler import SelectorErrorHandler
 class Response(object):
 
     def __init__(self, status_code=None, url=None, orig_url=None, headers=CaseInsensitiveDict(),
-                 content='', cookies=None, error=None, traceback=None, save=None, js_script_result=None, time=0):
+                 content='', cookies=None, error=None, traceback=None, save=None, js_script_result=None, time=0,
+                 content_file=None, content_size=None):
         if cookies is None:
             cookies = {}
         self.status_code = status_code
         self.url = url
         self.orig_url = orig_url
         self.headers = headers
-        self.content = content
+        # large body is spooled to content_file by fetcher, read when content is used
+        self.content_file = content_file
+        self.content_size = content_size
+        self.content = None if content_file and not content else content
         self.cookies = cookies
         self.error = error
         self.traceback = traceback
@@ -62,6 +66,20 @@ class Response(object):
     def __repr__(self):
         return u'<Response [%d]>' % self.status_code
 
+    @property
+    def content(self):
+        """Content of the response, in bytes or unicode"""
+        if self._content is None:
+            self._content = b''
+            if self.content_file and os.path.exists(self.content_file):
+                with open(self.content_file, 'rb') as fp:
+                    self._content = fp.read()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
     def __bool__(self):
         """Returns true if `status_code` is 200 and no error"""
         return self.ok
@@ -421,6 +439,8 @@ def rebuild_response(r):
         orig_url=r.get('orig_url', r.get('url', '')),
         js_script_result=r.get('js_script_result'),
         save=r.get('save'),
+        content_file=r.get('content_file'),
+        content_size=r.get('content_size'),
     )
     return response
 
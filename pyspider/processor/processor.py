@@ -5,6 +5,7 @@
 #         http://binux.me
 # Created on 2014-02-16 22:59:56
 
+import os
 import sys
 import six
 import time
@@ -196,10 +197,21 @@ class Processor(object):
             logger_func = logger.error
         else:
             logger_func = logger.info
+        # size of spooled body is recorded by fetcher, without reading the file
+        content_size = response.content_size
+        if content_size is None:
+            content_size = len(response.content)
         logger_func('process %s:%s %s -> [%d] len:%d -> result:%.10r fol:%d msg:%d err:%r' % (
             task['project'], task['taskid'],
-            task.get('url'), response.status_code, len(response.content),
+            task.get('url'), response.status_code, content_size,
             ret.result, len(ret.follows), len(ret.messages), ret.exception))
+
+        # body spooled by fetcher is processed
+        if response.content_file:
+            try:
+                os.remove(response.content_file)
+            except OSError:
+                pass
         return True
 
     def quit(self):
@@ -52,6 +52,9 @@ def load_cls(ctx, param, value):
 def connect_rpc(ctx, param, value):
     if not value:
         return
+    if value.startswith('msgpack://'):
+        from pyspider.libs.msgpack_rpc import MsgpackRPCClient
+        return MsgpackRPCClient(value)
     try:
         from six.moves import xmlrpc_client
     except ImportError:
@@ -194,12 +197,38 @@ def cli(ctx, **kwargs):
 @click.option('--scheduler-cls', default='pyspider.scheduler.ThreadBaseScheduler', callback=load_cls,
               help='scheduler class to be used.')
 @click.option('--threads', default=None, help='thread number for ThreadBaseScheduler, default: 4')
+@click.option('--update-buffer-size', default=0,
+              help='buffer task status updates and write them in batch, '
+              'flush when buffered tasks reach this size, 0 to disable')
+@click.option('--update-buffer-interval', default=1.0,
+              help='flush buffered task status updates every seconds')
+@click.option('--task-queue-cls', default='pyspider.scheduler.task_queue.TaskQueue',
+              callback=load_cls, help='task queue class to be used, '
+              'pyspider.scheduler.compact_task_queue.CompactTaskQueue uses less memory')
+@click.option('--select-policy-cls', default='pyspider.scheduler.select_policy.DeficitRoundRobinPolicy',
+              callback=load_cls, help='policy of selecting tasks from projects, '
+              'pyspider.scheduler.select_policy.QueueSizePolicy for the policy weighted by queue size')
+@click.option('--event-driven', is_flag=True, default=False,
+              help='wait for new tasks and deadlines instead of polling every loop interval')
+@click.option('--snapshot-interval', default=0,
+              help='dump task queues to data_path every seconds for fast restart, 0 to disable')
+@click.option('--shard', default=None,
+              help='run as shard INDEX/COUNT of sharded schedulers, e.g. 0/3, '
+              'projects are assigned to shards by consistent hash')
+@click.option('--known-filter', is_flag=True, default=False,
+              help='skip taskdb lookups of requests of known tasks with a bloom filter, '
+              'a small part of new tasks may be ignored by false positives')
+@click.option('--adaptive-rate', is_flag=True, default=False,
+              help='adjust rate of projects by fetch results, '
+              'rate and burst of projects are used as the max')
 @click.pass_context
 def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
               inqueue_limit, delete_time, active_tasks, loop_limit, fail_pause_num,
-              scheduler_cls, threads, get_object=False):
+              scheduler_cls, threads, update_buffer_size, update_buffer_interval,
+              task_queue_cls, select_policy_cls, event_driven, snapshot_interval,
+              shard, known_filter, adaptive_rate, get_object=False):
     """
-    Run Scheduler, only one scheduler is allowed.
+    Run Scheduler, only one scheduler is allowed unless sharded with --shard.
     """
     g = ctx.obj
     Scheduler = load_cls(None, None, scheduler_cls)
@@ -207,6 +236,19 @@ def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
     kwargs = dict(taskdb=g.taskdb, projectdb=g.projectdb, resultdb=g.resultdb,
                   newtask_queue=g.newtask_queue, status_queue=g.status_queue,
                   out_queue=g.scheduler2fetcher, data_path=g.get('data_path', 'data'))
+    if shard:
+        from pyspider.scheduler.shard import Shard, ShardQueue
+        shard = Shard.parse(shard)
+        for name in ('newtask_queue', 'status_queue'):
+            shard_queues = []
+            for i in range(shard.count):
+                queue_name = Shard.queue_name(name, i)
+                if g.get(queue_name) is None:
+                    # not limited, shards forwarding to each other would block forever
+                    g[queue_name] = connect_message_queue(queue_name, g.get('message_queue'))
+                shard_queues.append(g[queue_name])
+            kwargs[name] = ShardQueue(kwargs[name], shard, shard_queues)
+        kwargs['shard'] = shard
     if threads:
         kwargs['threads'] = int(threads)
 
@@ -216,6 +258,14 @@ def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
     scheduler.ACTIVE_TASKS = active_tasks
     scheduler.LOOP_LIMIT = loop_limit
     scheduler.FAIL_PAUSE_NUM = fail_pause_num
+    scheduler.UPDATE_BUFFER_SIZE = update_buffer_size
+    scheduler.UPDATE_BUFFER_INTERVAL = update_buffer_interval
+    scheduler.TASK_QUEUE_CLS = load_cls(None, None, task_queue_cls)
+    scheduler.SELECT_POLICY_CLS = load_cls(None, None, select_policy_cls)
+    scheduler.EVENT_DRIVEN = event_driven
+    scheduler.SNAPSHOT_INTERVAL = snapshot_interval
+    scheduler.KNOWN_FILTER = known_filter
+    scheduler.ADAPTIVE_RATE = adaptive_rate
 
     g.instances.append(scheduler)
     if g.get('testing_mode') or get_object:
@@ -233,7 +283,17 @@ def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
 @click.option('--xmlrpc-host', default='0.0.0.0')
 @click.option('--xmlrpc-port', envvar='FETCHER_XMLRPC_PORT', default=24444)
 @click.option('--poolsize', default=100, help="max simultaneous fetches")
+@click.option('--host-concurrency', default=0, help="max simultaneous fetches of a host, 0 for unlimited")
+@click.option('--project-concurrency', default=0,
+              help="max simultaneous fetches of a project, 0 for unlimited")
 @click.option('--proxy', help="proxy host:port")
+@click.option('--http-cache-path', help="directory of http cache, default: data_path/http_cache")
+@click.option('--http-cache-size', default=1024, help="max size of http cache in MB")
+@click.option('--robots-txt-cache', help="sqlite file of robots.txt shared by fetchers")
+@click.option('--max-body-size', default=0, help="max size of response body in MB, 0 for unlimited")
+@click.option('--spool-threshold', default=0,
+              help="response body larger than it (in MB) is written to data_path/spool for processor, "
+              "0 to disable")
 @click.option('--user-agent', help='user agent')
 @click.option('--timeout', help='default fetch timeout')
 @click.option('--phantomjs-endpoint', help="endpoint of phantomjs, start via pyspider phantomjs")
@@ -242,8 +302,10 @@ def scheduler(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port,
 @click.option('--fetcher-cls', default='pyspider.fetcher.Fetcher', callback=load_cls,
               help='Fetcher class to be used.')
 @click.pass_context
-def fetcher(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port, poolsize, proxy, user_agent,
-            timeout, phantomjs_endpoint, puppeteer_endpoint, splash_endpoint, fetcher_cls,
+def fetcher(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port, poolsize, host_concurrency,
+            project_concurrency, proxy, http_cache_path, http_cache_size, robots_txt_cache,
+            max_body_size, spool_threshold, user_agent, timeout,
+            phantomjs_endpoint, puppeteer_endpoint, splash_endpoint, fetcher_cls,
             async_mode=True, get_object=False, no_input=False):
     """
     Run Fetcher.
@@ -262,6 +324,14 @@ def fetcher(ctx, xmlrpc, no_xmlrpc, xmlrpc_host, xmlrpc_port, poolsize, proxy, u
     fetcher.phantomjs_proxy = phantomjs_endpoint or g.phantomjs_proxy
     fetcher.puppeteer_proxy = puppeteer_endpoint or g.puppeteer_proxy
     fetcher.splash_endpoint = splash_endpoint
+    fetcher.host_concurrency = host_concurrency
+    fetcher.project_concurrency = project_concurrency
+    fetcher.http_cache_path = http_cache_path or os.path.join(g.get('data_path', 'data'), 'http_cache')
+    fetcher.http_cache_size = http_cache_size * 1024 * 1024
+    fetcher.robot_txt_cache_path = robots_txt_cache
+    fetcher.max_body_size = max_body_size * 1024 * 1024
+    fetcher.spool_path = os.path.join(g.get('data_path', 'data'), 'spool')
+    fetcher.spool_threshold = spool_threshold * 1024 * 1024
     if user_agent:
         fetcher.user_agent = user_agent
     if timeout:
@@ -330,8 +400,9 @@ def result_worker(ctx, result_cls, get_object=False):
               help='webui bind to host')
 @click.option('--cdn', default='//cdnjs.cloudflare.com/ajax/libs/',
               help='js/css cdn server')
-@click.option('--scheduler-rpc', help='xmlrpc path of scheduler')
-@click.option('--fetcher-rpc', help='xmlrpc path of fetcher')
+@click.option('--scheduler-rpc', help='xmlrpc path of scheduler, msgpack:// for msgpack rpc, '
+              'comma separated paths of sharded schedulers in the order of shards')
+@click.option('--fetcher-rpc', help='xmlrpc path of fetcher, msgpack:// for msgpack rpc')
 @click.option('--max-rate', type=float, help='max rate for each project')
 @click.option('--max-burst', type=float, help='max burst for each project')
 @click.option('--username', envvar='WEBUI_USERNAME',
@@ -376,7 +447,12 @@ def webui(ctx, host, port, cdn, scheduler_rpc, fetcher_rpc, max_rate, max_burst,
     if isinstance(fetcher_rpc, six.string_types):
         import umsgpack
         fetcher_rpc = connect_rpc(ctx, None, fetcher_rpc)
-        app.config['fetch'] = lambda x: umsgpack.unpackb(fetcher_rpc.fetch(x).data)
+
+        def rpc_fetch(task):
+            # result is a xmlrpc Binary, or bytes by msgpack rpc
+            result = fetcher_rpc.fetch(task)
+            return umsgpack.unpackb(getattr(result, 'data', result))
+        app.config['fetch'] = rpc_fetch
     else:
         # get fetcher instance for webui
         fetcher_config = g.config.get('fetcher', {})
@@ -393,7 +469,11 @@ def webui(ctx, host, port, cdn, scheduler_rpc, fetcher_rpc, max_rate, max_burst,
         app.config['fetch'] = safe_fetch
 
     # scheduler rpc
-    if isinstance(scheduler_rpc, six.string_types):
+    if isinstance(scheduler_rpc, six.string_types) and ',' in scheduler_rpc:
+        from pyspider.scheduler.shard import ShardedSchedulerRPC
+        scheduler_rpc = ShardedSchedulerRPC(connect_rpc(ctx, None, url.strip())
+                                            for url in scheduler_rpc.split(','))
+    elif isinstance(scheduler_rpc, six.string_types):
         scheduler_rpc = connect_rpc(ctx, None, scheduler_rpc)
     if scheduler_rpc is None and os.environ.get('SCHEDULER_PORT_23333_TCP_ADDR'):
         app.config['scheduler_rpc'] = connect_rpc(ctx, None,
@@ -511,11 +591,13 @@ def puppeteer(ctx, port, auto_restart, args):
 @click.option('--processor-num', default=1, help='instance num of processor')
 @click.option('--result-worker-num', default=1,
               help='instance num of result worker')
+@click.option('--scheduler-num', default=1,
+              help='instance num of scheduler, projects are sharded to schedulers')
 @click.option('--run-in', default='subprocess', type=click.Choice(['subprocess', 'thread']),
               help='run each components in thread or subprocess. '
               'always using thread for windows.')
 @click.pass_context
-def all(ctx, fetcher_num, processor_num, result_worker_num, run_in):
+def all(ctx, fetcher_num, processor_num, result_worker_num, scheduler_num, run_in):
     """
     Run all the components in subprocess or thread
     """
@@ -569,12 +651,25 @@ def all(ctx, fetcher_num, processor_num, result_worker_num, run_in):
         # scheduler
         scheduler_config = g.config.get('scheduler', {})
         scheduler_config.setdefault('xmlrpc_host', '127.0.0.1')
-        threads.append(run_in(ctx.invoke, scheduler, **scheduler_config))
+        scheduler_port = scheduler_config.get('xmlrpc_port', 23333)
+        if scheduler_num > 1:
+            from pyspider.scheduler.shard import Shard
+            # queues of shards should be created before forked
+            for name in ('newtask_queue', 'status_queue'):
+                for i in range(scheduler_num):
+                    queue_name = Shard.queue_name(name, i)
+                    g[queue_name] = connect_message_queue(queue_name, g.get('message_queue'))
+            for i in range(scheduler_num):
+                config = dict(scheduler_config, xmlrpc_port=scheduler_port + i,
+                              shard='%d/%d' % (i, scheduler_num))
+                threads.append(run_in(ctx.invoke, scheduler, **config))
+        else:
+            threads.append(run_in(ctx.invoke, scheduler, **scheduler_config))
 
         # running webui in main thread to make it exitable
         webui_config = g.config.get('webui', {})
-        webui_config.setdefault('scheduler_rpc', 'http://127.0.0.1:%s/'
-                                % g.config.get('scheduler', {}).get('xmlrpc_port', 23333))
+        webui_config.setdefault('scheduler_rpc', ','.join(
+            'http://127.0.0.1:%s/' % (scheduler_port + i) for i in range(scheduler_num)))
         ctx.invoke(webui, **webui_config)
     finally:
         # exit components run in threading
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import array
+import binascii
+import hashlib
+import logging
+import struct
+import threading
+import time
+
+from pyspider.libs import utils
+from .task_queue import AtomInt
+from .token_bucket import Bucket
+
+logger = logging.getLogger('scheduler')
+
+# slots of hash table
+EMPTY = -1
+DELETED = -2
+
+# state of records, 0 for free record
+READY = 1
+DELAYED = 2
+PROCESSING = 3
+
+
+class CompactTaskQueue(object):
+    '''
+    compact task queue for projects with a huge number of tasks
+
+    It has the same interface as TaskQueue but no object per task. Taskids are
+    stored as 16 bytes digests in an open addressing hash table pointing to records,
+    priority, exetime and sequence of records are kept in parallel typed arrays, and
+    ready / delayed / processing queues are indexed heaps of record numbers.
+
+    32 chars hex taskids (md5 of url by default) are stored in binary form, digests
+    of other taskids are md5 of them and the taskids are kept in a dict.
+    '''
+    processing_timeout = 10 * 60
+
+    def __init__(self, rate=0, burst=0):
+        self.mutex = threading.RLock()
+        self.bucket = Bucket(rate=rate, burst=burst)
+
+        # hash table, record number of each slot
+        self.table = array.array('i', [EMPTY]) * 8
+        self.filled = 0
+        self.names = dict()
+
+        # records
+        self.digests = bytearray()
+        self.state = bytearray()
+        # double, priorities can be float or larger than int32 as in TaskQueue
+        self.priority = array.array('d')
+        self.exetime = array.array('d')
+        self.sequence = array.array('d')
+        self.heap_pos = array.array('i')
+        self.free = array.array('i')
+
+        self.heaps = {
+            READY: array.array('i'),
+            DELAYED: array.array('i'),
+            PROCESSING: array.array('i'),
+        }
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    @rate.setter
+    def rate(self, value):
+        self.bucket.rate = value
+
+    @property
+    def burst(self):
+        return self.bucket.burst
+
+    @burst.setter
+    def burst(self, value):
+        self.bucket.burst = value
+
+    def _digest(self, taskid):
+        '''return digest of taskid and if taskid should be kept in names'''
+        if len(taskid) == 32 and taskid == taskid.lower():
+            try:
+                return binascii.unhexlify(taskid), False
+            except (TypeError, ValueError):
+                pass
+        return hashlib.md5(utils.utf8(taskid)).digest(), True
+
+    def _taskid(self, rec):
+        digest = bytes(self.digests[rec * 16:rec * 16 + 16])
+        if digest in self.names:
+            return self.names[digest]
+        return binascii.hexlify(digest).decode('ascii')
+
+    def _lookup(self, digest):
+        '''return (slot for digest, record number or -1)'''
+        table, digests = self.table, self.digests
+        mask = len(table) - 1
+        slot = struct.unpack_from('<Q', digest)[0] & mask
+        deleted = -1
+        while True:
+            rec = table[slot]
+            if rec == EMPTY:
+                return (deleted if deleted >= 0 else slot), -1
+            if rec == DELETED:
+                if deleted < 0:
+                    deleted = slot
+            elif digests[rec * 16:rec * 16 + 16] == digest:
+                return slot, rec
+            slot = (slot + 1) & mask
+
+    def _resize(self):
+        live = len(self.state) - len(self.free)
+        size = 8
+        while size < live * 3:
+            size *= 2
+        self.table = table = array.array('i', [EMPTY]) * size
+        mask = size - 1
+        digests = self.digests
+        for rec, state in enumerate(self.state):
+            if not state:
+                continue
+            slot = struct.unpack_from('<Q', digests, rec * 16)[0] & mask
+            while table[slot] != EMPTY:
+                slot = (slot + 1) & mask
+            table[slot] = rec
+        self.filled = live
+
+    def _find(self, taskid):
+        return self._lookup(self._digest(taskid)[0])[1]
+
+    def _new_record(self, slot, digest):
+        if self.free:
+            rec = self.free.pop()
+            self.digests[rec * 16:rec * 16 + 16] = digest
+        else:
+            rec = len(self.state)
+            self.digests.extend(digest)
+            self.state.append(0)
+            self.priority.append(0)
+            self.exetime.append(0)
+            self.sequence.append(0)
+            self.heap_pos.append(-1)
+
+        if self.table[slot] == EMPTY:
+            self.filled += 1
+        self.table[slot] = rec
+        return rec
+
+    def _free_record(self, rec):
+        digest = bytes(self.digests[rec * 16:rec * 16 + 16])
+        slot, _ = self._lookup(digest)
+        self.table[slot] = DELETED
+        self.names.pop(digest, None)
+        self.state[rec] = 0
+        self.free.append(rec)
+
+    # indexed heaps of records
+    def _less(self, state, a, b):
+        if state == READY:
+            if self.priority[a] != self.priority[b]:
+                return self.priority[a] > self.priority[b]
+        elif self.exetime[a] != self.exetime[b]:
+            return self.exetime[a] < self.exetime[b]
+        return self.sequence[a] < self.sequence[b]
+
+    def _sift_up(self, state, pos):
+        heap, heap_pos = self.heaps[state], self.heap_pos
+        rec = heap[pos]
+        while pos > 0:
+            parent_pos = (pos - 1) >> 1
+            parent = heap[parent_pos]
+            if not self._less(state, rec, parent):
+                break
+            heap[pos] = parent
+            heap_pos[parent] = pos
+            pos = parent_pos
+        heap[pos] = rec
+        heap_pos[rec] = pos
+        return pos
+
+    def _sift_down(self, state, pos):
+        heap, heap_pos = self.heaps[state], self.heap_pos
+        end = len(heap)
+        rec = heap[pos]
+        while True:
+            child_pos = 2 * pos + 1
+            if child_pos >= end:
+                break
+            right_pos = child_pos + 1
+            if right_pos < end and self._less(state, heap[right_pos], heap[child_pos]):
+                child_pos = right_pos
+            child = heap[child_pos]
+            if not self._less(state, child, rec):
+                break
+            heap[pos] = child
+            heap_pos[child] = pos
+            pos = child_pos
+        heap[pos] = rec
+        heap_pos[rec] = pos
+
+    def _heap_push(self, state, rec):
+        self.state[rec] = state
+        self.heaps[state].append(rec)
+        self._sift_up(state, len(self.heaps[state]) - 1)
+
+    def _heap_fix(self, state, rec):
+        pos = self.heap_pos[rec]
+        if self._sift_up(state, pos) == pos:
+            self._sift_down(state, pos)
+
+    def _heap_remove(self, state, rec):
+        heap = self.heaps[state]
+        pos = self.heap_pos[rec]
+        last = heap.pop()
+        if last != rec:
+            heap[pos] = last
+            self.heap_pos[last] = pos
+            self._heap_fix(state, last)
+        self.heap_pos[rec] = -1
+
+    def check_update(self):
+        '''
+        Check time queue and processing queue
+
+        put tasks to priority queue when execute time arrived or process timeout
+        '''
+        self._check_time_queue()
+        self._check_processing()
+
+    def _check_time_queue(self):
+        now = time.time()
+        self.mutex.acquire()
+        heap = self.heaps[DELAYED]
+        while heap and self.exetime[heap[0]] < now:
+            rec = heap[0]
+            self._heap_remove(DELAYED, rec)
+            self.exetime[rec] = 0
+            self._heap_push(READY, rec)
+        self.mutex.release()
+
+    def _check_processing(self):
+        now = time.time()
+        self.mutex.acquire()
+        heap = self.heaps[PROCESSING]
+        while heap and self.exetime[heap[0]] < now:
+            rec = heap[0]
+            self._heap_remove(PROCESSING, rec)
+            self.exetime[rec] = 0
+            self._heap_push(READY, rec)
+            logger.info("processing: retry %s", self._taskid(rec))
+        self.mutex.release()
+
+    def set_host_limits(self, rate=0, burst=0, concurrency=0):
+        '''per-host limits are not supported, tasks are not queued by host'''
+        if rate or concurrency:
+            logger.warning('per-host limits are not supported by CompactTaskQueue')
+
+    def next_time(self):
+        '''time when a task may be got from queue next time, same as TaskQueue.next_time'''
+        times = []
+        with self.mutex:
+            for state in (DELAYED, PROCESSING):
+                if self.heaps[state]:
+                    times.append(self.exetime[self.heaps[state][0]])
+            if self.heaps[READY]:
+                ready_time = self.bucket.next_time()
+                if ready_time is not None:
+                    times.append(ready_time)
+        return min(times) if times else None
+
+    def put(self, taskid, priority=0, exetime=0, host=None):
+        '''Put a task into task queue, same as TaskQueue.put, host is ignored'''
+        now = time.time()
+
+        self.mutex.acquire()
+        # keep load factor of hash table (including deleted slots) under 2/3
+        if (self.filled + 1) * 3 >= len(self.table) * 2:
+            self._resize()
+        digest, named = self._digest(taskid)
+        slot, rec = self._lookup(digest)
+        if rec >= 0:
+            state = self.state[rec]
+            # force update a processing task is not allowed
+            if state != PROCESSING:
+                self.priority[rec] = max(priority, self.priority[rec])
+                self.exetime[rec] = min(exetime, self.exetime[rec])
+                self._heap_fix(state, rec)
+        else:
+            rec = self._new_record(slot, digest)
+            if named:
+                self.names[digest] = taskid
+            self.priority[rec] = priority
+            self.sequence[rec] = AtomInt.get_value()
+            if exetime and exetime > now:
+                self.exetime[rec] = exetime
+                self._heap_push(DELAYED, rec)
+            else:
+                self.exetime[rec] = 0
+                self._heap_push(READY, rec)
+        self.mutex.release()
+
+    def get(self):
+        '''Get a task from queue when bucket available'''
+        if self.bucket.get() < 1:
+            return None
+        now = time.time()
+        self.mutex.acquire()
+        heap = self.heaps[READY]
+        if not heap:
+            self.mutex.release()
+            return None
+        rec = heap[0]
+        self._heap_remove(READY, rec)
+        self.bucket.desc()
+        self.exetime[rec] = now + self.processing_timeout
+        self._heap_push(PROCESSING, rec)
+        taskid = self._taskid(rec)
+        self.mutex.release()
+        return taskid
+
+    def done(self, taskid):
+        '''Mark task done'''
+        self.mutex.acquire()
+        try:
+            rec = self._find(taskid)
+            if rec < 0 or self.state[rec] != PROCESSING:
+                return False
+            self._heap_remove(PROCESSING, rec)
+            self._free_record(rec)
+            return True
+        finally:
+            self.mutex.release()
+
+    def delete(self, taskid):
+        self.mutex.acquire()
+        try:
+            rec = self._find(taskid)
+            if rec < 0:
+                return False
+            self._heap_remove(self.state[rec], rec)
+            self._free_record(rec)
+            return True
+        finally:
+            self.mutex.release()
+
+    def dump(self):
+        '''list (taskid, priority, exetime, processing, host) of tasks in queue, same as TaskQueue.dump'''
+        with self.mutex:
+            recs = sorted((rec for rec, state in enumerate(self.state) if state),
+                          key=self.sequence.__getitem__)
+            return [(self._taskid(rec), self._priority(rec), self.exetime[rec],
+                     self.state[rec] == PROCESSING, None) for rec in recs]
+
+    def _priority(self, rec):
+        priority = self.priority[rec]
+        return int(priority) if priority.is_integer() else priority
+
+    def load(self, taskid, priority=0, exetime=0, processing=False, host=None):
+        '''put a task listed by `dump` back into queue'''
+        if not processing:
+            return self.put(taskid, priority, exetime)
+        with self.mutex:
+            if (self.filled + 1) * 3 >= len(self.table) * 2:
+                self._resize()
+            digest, named = self._digest(taskid)
+            slot, rec = self._lookup(digest)
+            if rec >= 0:
+                return
+            rec = self._new_record(slot, digest)
+            if named:
+                self.names[digest] = taskid
+            self.priority[rec] = priority
+            self.sequence[rec] = AtomInt.get_value()
+            self.exetime[rec] = exetime
+            self._heap_push(PROCESSING, rec)
+
+    def size(self):
+        return len(self.state) - len(self.free)
+
+    def is_processing(self, taskid):
+        '''
+        return True if taskid is in processing
+        '''
+        with self.mutex:
+            rec = self._find(taskid)
+            return rec >= 0 and self.state[rec] == PROCESSING
+
+    def __len__(self):
+        return self.size()
+
+    def __contains__(self, taskid):
+        with self.mutex:
+            return self._find(taskid) >= 0
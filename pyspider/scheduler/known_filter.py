@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import math
+import struct
+import hashlib
+import logging
+import threading
+
+from six import iteritems
+
+from pyspider.libs import utils
+
+logger = logging.getLogger('scheduler')
+
+MAGIC = b'PSKF'
+VERSION = 1
+
+# magic, version, watermark, number of projects
+HEADER = struct.Struct('<4sBdI')
+# length of name, number of filters
+PROJECT = struct.Struct('<HI')
+# capacity, error rate, count, number of hashes, length of bits in bytes
+FILTER = struct.Struct('<QdQBQ')
+
+
+def _hashes(key):
+    digest = hashlib.md5(utils.utf8(key)).digest()
+    return struct.unpack('<QQ', digest)
+
+
+class BloomFilter(object):
+    '''
+    bloom filter of capacity keys with false positive rate error_rate
+    '''
+
+    def __init__(self, capacity, error_rate, count=0, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = count
+        nbits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.k = max(1, int(round(1.0 * nbits / capacity * math.log(2))))
+        self.nbits = (nbits + 7) // 8 * 8
+        self.bits = bits if bits is not None else bytearray(self.nbits // 8)
+
+    def _positions(self, h1, h2):
+        for i in range(self.k):
+            yield (h1 + i * h2) % self.nbits
+
+    def add(self, hashes):
+        bits = self.bits
+        for x in self._positions(*hashes):
+            bits[x >> 3] |= 1 << (x & 7)
+        self.count += 1
+
+    def contains(self, hashes):
+        bits = self.bits
+        for x in self._positions(*hashes):
+            if not bits[x >> 3] & (1 << (x & 7)):
+                return False
+        return True
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter(object):
+    '''
+    scalable bloom filter of known taskids of a project
+
+    a new filter of `growth` times capacity and `tightening` times error rate is
+    added when the last one is full, so the overall false positive rate stays
+    under error_rate for any number of keys.
+    '''
+
+    growth = 2
+    tightening = 0.5
+
+    def __init__(self, capacity=100000, error_rate=1e-4):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = []
+        self.mutex = threading.Lock()
+
+    def __contains__(self, key):
+        hashes = _hashes(key)
+        return any(f.contains(hashes) for f in self.filters)
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def add(self, key):
+        '''add key, return False if it's possibly added before'''
+        hashes = _hashes(key)
+        with self.mutex:
+            if any(f.contains(hashes) for f in self.filters):
+                return False
+            if not self.filters or self.filters[-1].full:
+                n = len(self.filters)
+                self.filters.append(BloomFilter(
+                    self.capacity * self.growth ** n,
+                    self.error_rate * (1 - self.tightening) * self.tightening ** n))
+            self.filters[-1].add(hashes)
+        return True
+
+
+def dump(path, watermark, filters):
+    '''
+    write known filters of projects to file
+
+    filters is a dict of project name to ScalableBloomFilter, taskids inserted into
+    taskdb before watermark should be in the filters. the file is written to a
+    temporary file first and renamed to path.
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, watermark, len(filters)))
+        for name, known in iteritems(filters):
+            name = utils.utf8(name)
+            with known.mutex:
+                stages = list(known.filters)
+            fp.write(PROJECT.pack(len(name), len(stages)))
+            fp.write(name)
+            for f in stages:
+                fp.write(FILTER.pack(f.capacity, f.error_rate, f.count, f.k, len(f.bits)))
+                fp.write(f.bits)
+        fp.flush()
+        os.fsync(fp.fileno())
+    if hasattr(os, 'replace'):
+        os.replace(tmp_path, path)
+    else:
+        os.rename(tmp_path, path)
+
+
+def load(path, capacity=100000, error_rate=1e-4):
+    '''load known filters written by `dump`, return (watermark, filters) or None'''
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as fp:
+            magic, version, watermark, count = HEADER.unpack(fp.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('unknown known filter format')
+            filters = dict()
+            for _ in range(count):
+                name_len, stages = PROJECT.unpack(fp.read(PROJECT.size))
+                name = utils.text(fp.read(name_len))
+                known = ScalableBloomFilter(capacity, error_rate)
+                for _ in range(stages):
+                    f_capacity, f_error_rate, f_count, k, size = FILTER.unpack(
+                        fp.read(FILTER.size))
+                    bits = bytearray(fp.read(size))
+                    f = BloomFilter(f_capacity, f_error_rate, f_count, bits)
+                    if len(bits) != size or f.k != k or len(bits) * 8 != f.nbits:
+                        raise ValueError('known filter truncated')
+                    known.filters.append(f)
+                filters[name] = known
+        return watermark, filters
+    except Exception as e:
+        logger.error('known filter %s is broken: %r', path, e)
+        return None
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger('scheduler')
+
+
+class AIMDRateControl(object):
+    '''
+    additive increase / multiplicative decrease of rate of a project
+
+    fetch results of the project are fed with `feed`. the rate is cut by
+    `decrease` at once when the site throttles (429, 503 or timeout), at most
+    once an interval. every `interval` seconds, it's raised by `increase` of
+    max_rate when the tasks are limited by the rate, and error ratio and
+    latency stay healthy. rate is kept in [min_ratio * max_rate, max_rate], burst
+    is scaled with the rate.
+    '''
+
+    interval = 10
+    increase = 0.05
+    decrease = 0.5
+    start_ratio = 0.5
+    min_ratio = 0.05
+    error_ratio = 0.1
+    # latency is unhealthy when it's latency_factor times of the lowest seen
+    latency_factor = 2.0
+    throttle_codes = (429, 503, 599)
+
+    def __init__(self, max_rate, max_burst):
+        self.mutex = threading.Lock()
+        self.max_rate = max_rate
+        self.max_burst = max_burst
+        self.rate = max_rate * self.start_ratio
+        self.base_latency = None
+        self.last_decrease = 0
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self.window_start = now
+        self.fetched = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.throttled = False
+
+    @property
+    def burst(self):
+        if self.max_rate <= 0:
+            return self.max_burst
+        return max(1, self.max_burst * self.rate / self.max_rate)
+
+    def set_max(self, max_rate, max_burst):
+        '''configured rate and burst of project is updated'''
+        with self.mutex:
+            if self.max_rate > 0:
+                ratio = self.rate / self.max_rate
+            else:
+                ratio = self.start_ratio
+            self.max_rate = max_rate
+            self.max_burst = max_burst
+            self.rate = max_rate * ratio
+
+    def feed(self, status_code, fetch_time, now=None):
+        '''
+        feed a fetch result, return True if rate is changed
+        '''
+        now = now or time.time()
+        with self.mutex:
+            self.fetched += 1
+            if fetch_time:
+                self.total_time += fetch_time
+            if status_code in self.throttle_codes:
+                self.throttled = True
+                self.errors += 1
+                if now - self.last_decrease >= self.interval:
+                    self.last_decrease = now
+                    self.rate = max(self.rate * self.decrease, self.max_rate * self.min_ratio)
+                    return True
+                return False
+            if not status_code or status_code >= 500:
+                self.errors += 1
+
+            if now - self.window_start < self.interval:
+                return False
+            return self._adjust(now)
+
+    def _adjust(self, now):
+        elapsed = now - self.window_start
+        changed = False
+        latency = self.total_time / self.fetched if self.fetched else 0
+        healthy = (
+            not self.throttled
+            and self.errors <= self.fetched * self.error_ratio
+            and (self.base_latency is None or latency <= self.base_latency * self.latency_factor)
+        )
+        # raise the rate only when tasks are sent as fast as the rate allows
+        limited = self.fetched >= self.rate * elapsed * 0.5
+        if healthy and limited and self.rate < self.max_rate:
+            self.rate = min(self.rate + self.max_rate * self.increase, self.max_rate)
+            changed = True
+        if latency and not self.throttled:
+            if self.base_latency is None:
+                self.base_latency = latency
+            else:
+                # forget the lowest latency slowly
+                self.base_latency = min(latency, self.base_latency * 1.1)
+        self._reset(now)
+        return changed
@@ -6,19 +6,32 @@
 # Created on 2014-02-07 17:05:11
 
 
+import heapq
 import itertools
 import json
 import logging
+import multiprocessing
 import os
+import threading
 import time
 from collections import deque
 
 from six import iteritems, itervalues
 from six.moves import queue as Queue
+from six.moves.urllib.parse import urlsplit
 
 from pyspider.libs import counter, utils
 from pyspider.libs.base_handler import BaseHandler
+from . import known_filter, snapshot
+from .rate_control import AIMDRateControl
+from .select_policy import DeficitRoundRobinPolicy
 from .task_queue import TaskQueue
+from .write_buffer import WriteBuffer
+
+try:
+    from multiprocessing.connection import wait as connection_wait
+except ImportError:
+    connection_wait = None
 
 logger = logging.getLogger('scheduler')
 
@@ -33,8 +46,19 @@ class Project(object):
         self.scheduler = scheduler
 
         self.active_tasks = deque(maxlen=scheduler.ACTIVE_TASKS)
-        self.task_queue = TaskQueue()
+        self.task_queue = scheduler.TASK_QUEUE_CLS()
         self.task_loaded = False
+        self.task_loading = False
+        # not selectable until changes after the snapshot are replayed
+        self.task_restoring = False
+        self.loaded_tasks = 0
+        # filter of taskids in taskdb, see Scheduler.KNOWN_FILTER
+        self.known_tasks = None
+        self.known_tasks_seeded = False
+        # rate of task queue when Scheduler.ADAPTIVE_RATE
+        self.rate_control = None
+        # next cronjob tick in Scheduler._cron_heap
+        self._cron_tick = None
         self._selected_tasks = False  # selected tasks after recent pause
         self._send_finished_event_wait = 0  # wait for scheduler.FAIL_PAUSE_NUM loop steps before sending the event
 
@@ -116,9 +140,19 @@ class Project(object):
         if self.waiting_get_info and self.active:
             self._send_on_get_info = True
 
-        if self.active:
+        if self.active and self.scheduler.ADAPTIVE_RATE:
+            # rate and burst of project are the max of the controlled rate
+            if self.rate_control is None:
+                self.rate_control = AIMDRateControl(project_info['rate'], project_info['burst'])
+            else:
+                self.rate_control.set_max(project_info['rate'], project_info['burst'])
+            self.task_queue.rate = self.rate_control.rate
+            self.task_queue.burst = self.rate_control.burst
+            self._update_host_limits()
+        elif self.active:
             self.task_queue.rate = project_info['rate']
             self.task_queue.burst = project_info['burst']
+            self._update_host_limits()
         else:
             self.task_queue.rate = 0
             self.task_queue.burst = 0
@@ -131,6 +165,26 @@ class Project(object):
         self.min_tick = info.get('min_tick', 0)
         self.retry_delay = info.get('retry_delay', {})
         self.crawl_config = info.get('crawl_config', {})
+        self._update_host_limits()
+
+    def on_fetched(self, status_code, fetch_time):
+        '''feed fetch result to the rate control'''
+        if self.rate_control is None or not self.active:
+            return
+        if self.rate_control.feed(status_code, fetch_time):
+            self.task_queue.rate = self.rate_control.rate
+            self.task_queue.burst = self.rate_control.burst
+            logger.info('project %s rate adjusted to %.2f/%.2f', self.name,
+                        self.task_queue.rate, self.task_queue.burst)
+
+    def _update_host_limits(self):
+        '''per-host limits of task queue from crawl_config'''
+        crawl_config = getattr(self, 'crawl_config', None) or {}
+        self.task_queue.set_host_limits(
+            rate=crawl_config.get('host_rate', 0),
+            burst=crawl_config.get('host_burst', 0),
+            concurrency=crawl_config.get('host_concurrency', 0),
+        )
 
     @property
     def active(self):
@@ -162,13 +216,29 @@ class Scheduler(object):
     FAIL_PAUSE_NUM = 10
     PAUSE_TIME = 5*60
     UNPAUSE_CHECK_NUM = 3
+    UPDATE_BUFFER_SIZE = 0  # max buffered task updates before flush, 0 for write through
+    UPDATE_BUFFER_INTERVAL = 1.0
+    UPDATE_BUFFER_LIMIT = 100000  # task updates block when buffer reached it, e.g. taskdb is down
+    UPDATE_BUFFER_QUIT_TIMEOUT = 60  # seconds retrying failed flush of update buffer on exit
+    TASK_QUEUE_CLS = TaskQueue  # or CompactTaskQueue for projects with a huge number of tasks
+    LOAD_TASKS_PAGE_SIZE = 1000
+    SNAPSHOT_INTERVAL = 0  # seconds between task queue snapshots, 0 for disabled
+    SNAPSHOT_REPLAY_MARGIN = 60
+    SELECT_POLICY_CLS = DeficitRoundRobinPolicy  # or QueueSizePolicy
+    EVENT_DRIVEN = False  # wait for new items and deadlines instead of sleeping LOOP_INTERVAL
+    EVENT_MAX_WAIT = 10
+    KNOWN_FILTER = False  # skip taskdb lookups of requests of known tasks, lossy by false positives
+    KNOWN_FILTER_CAPACITY = 100000
+    KNOWN_FILTER_ERROR_RATE = 1e-4
+    KNOWN_FILTER_DUMP_INTERVAL = 10 * 60
+    ADAPTIVE_RATE = False  # adjust rate of projects by fetch results, up to the rate of project
 
     TASK_PACK = 1
     STATUS_PACK = 2  # current not used
     REQUEST_PACK = 3  # current not used
 
     def __init__(self, taskdb, projectdb, newtask_queue, status_queue,
-                 out_queue, data_path='./data', resultdb=None):
+                 out_queue, data_path='./data', resultdb=None, shard=None):
         self.taskdb = taskdb
         self.projectdb = projectdb
         self.resultdb = resultdb
@@ -176,15 +246,27 @@ class Scheduler(object):
         self.status_queue = status_queue
         self.out_queue = out_queue
         self.data_path = data_path
+        # projects owned by this scheduler when sharded, see scheduler/shard.py
+        self.shard = shard
 
         self._send_buffer = deque()
         self._quit = False
         self._exceptions = 0
         self.projects = dict()
+        self._active_projects = dict()
+        self._select_policy = None
+        self._wakeup = None
+        self._wakeup_sent = threading.Event()
+        self._backoff = 0
         self._force_update_project = False
         self._last_update_project = 0
         self._last_tick = int(time.time())
+        # (tick, project name) of next cronjob ticks, see _schedule_cronjob
+        self._cron_heap = []
         self._postpone_request = []
+        self._update_buffer = WriteBuffer()
+        # (project, task_queue, kind, rows) read by loading threads, see _load_rows
+        self._loaded_queue = Queue.Queue(100)
 
         self._cnt = {
             "5m_time": counter.CounterManager(
@@ -198,10 +280,26 @@ class Scheduler(object):
             "all": counter.CounterManager(
                 lambda: counter.TotalCounter()),
         }
-        self._cnt['1h'].load(os.path.join(self.data_path, 'scheduler.1h'))
-        self._cnt['1d'].load(os.path.join(self.data_path, 'scheduler.1d'))
-        self._cnt['all'].load(os.path.join(self.data_path, 'scheduler.all'))
+        self._cnt_journals = {}
+        for name in ('1h', '1d', 'all'):
+            journal = self._cnt_journals[name] = counter.CounterJournal(
+                self._cnt[name], self._data_file(name + '.journal'))
+            # counters dumped by older versions are moved to journal
+            if not journal.load() and self._cnt[name].load(self._data_file(name)):
+                journal.compact()
+        # 5m, 1h and 1d counters are fired with the same events
+        self._cnt_windows = counter.CounterGroup(self._cnt['5m'], self._cnt['1h'], self._cnt['1d'])
         self._last_dump_cnt = 0
+        self._snapshot = None
+        self._last_snapshot = time.time()
+        self._known_restored = None
+        self._last_dump_known = time.time()
+
+    def _data_file(self, name):
+        '''path of scheduler file in data_path, one set of files for each shard'''
+        if self.shard:
+            return os.path.join(self.data_path, 'scheduler.shard%d.%s' % (self.shard.index, name))
+        return os.path.join(self.data_path, 'scheduler.%s' % name)
 
     def _update_projects(self):
         '''Check project update'''
@@ -212,6 +310,8 @@ class Scheduler(object):
         ):
             return
         for project in self.projectdb.check_update(self._last_update_project):
+            if self.shard and not self.shard.owns(project['name']):
+                continue
             self._update_project(project)
             logger.debug("project: %s updated.", project['name'])
         self._force_update_project = False
@@ -227,6 +327,11 @@ class Scheduler(object):
             self.projects[project['name']].update(project)
 
         project = self.projects[project['name']]
+        if project.active:
+            self._active_projects[project.name] = project
+            self._schedule_cronjob(project)
+        elif self._active_projects.pop(project.name, None):
+            self.select_policy.remove(project.name)
 
         if project._send_on_get_info:
             # update project runtime info from processor by sending a _on_get_info
@@ -249,38 +354,254 @@ class Scheduler(object):
         if project.active:
             if not project.task_loaded:
                 self._load_tasks(project)
-                project.task_loaded = True
         else:
             if project.task_loaded:
-                project.task_queue = TaskQueue()
+                project.task_queue = self.TASK_QUEUE_CLS()
                 project.task_loaded = False
+                project.task_loading = False
+                project.task_restoring = False
 
-            if project not in self._cnt['all']:
+            if project.name not in self._cnt['all']:
                 self._update_project_cnt(project.name)
 
-    scheduler_task_fields = ['taskid', 'project', 'schedule', ]
+    scheduler_task_fields = ['taskid', 'project', 'url', 'schedule', ]
 
     def _load_tasks(self, project):
-        '''load tasks from database'''
-        task_queue = project.task_queue
+        '''
+        load tasks from database, in background thread when taskdb can be copied
 
-        for task in self.taskdb.load_tasks(
-                self.taskdb.ACTIVE, project.name, self.scheduler_task_fields
-        ):
-            taskid = task['taskid']
-            _schedule = task.get('schedule', self.default_schedule)
-            priority = _schedule.get('priority', self.default_schedule['priority'])
-            exetime = _schedule.get('exetime', self.default_schedule['exetime'])
-            task_queue.put(taskid, priority, exetime)
+        the loading thread only reads taskdb, rows are put into _loaded_queue and
+        applied to task queue, counters and known filter in scheduler thread by
+        _check_loaded.
+        '''
+        # status of tasks is changed by buffered updates
+        self._flush_update_buffer()
         project.task_loaded = True
-        logger.debug('project: %s loaded %d tasks.', project.name, len(task_queue))
+        project.task_loading = True
+        project.loaded_tasks = 0
+
+        restore = None
+        if self._snapshot and project.name in self._snapshot:
+            restore = (self._snapshot.watermark, self._snapshot.tasks(project.name))
+            self._snapshot.discard(project.name)
+            if not self._snapshot.projects:
+                self._snapshot = None
+        project.task_restoring = restore is not None
+        count = project.name not in self._cnt['all']
+        known_since = self._start_known_tasks(project)
+        args = (project, project.task_queue, restore, count, known_since)
+
+        taskdb = self._background_taskdb()
+        if taskdb is None:
+            for item in self._load_rows(self.taskdb, *args):
+                self._on_loaded(*item)
+        else:
+            utils.run_in_thread(self._load_in_background, taskdb, *args)
+
+    def _background_taskdb(self, taskdb=None):
+        '''a new taskdb connection for background threads, None if not available'''
+        try:
+            taskdb = (taskdb or self.taskdb).copy()
+        except NotImplementedError:
+            return None
+        # a new connection of in-memory sqlite is an other database
+        if getattr(taskdb, 'path', None) == ':memory:':
+            return None
+        return taskdb
+
+    def _load_in_background(self, taskdb, *args):
+        for item in self._load_rows(taskdb, *args):
+            self._loaded_queue.put(item)
+            self.wakeup()
+
+    def _pages(self, iterable):
+        '''split iterable into lists of LOAD_TASKS_PAGE_SIZE'''
+        page = []
+        for each in iterable:
+            page.append(each)
+            if len(page) >= self.LOAD_TASKS_PAGE_SIZE:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def _load_rows(self, taskdb, project, task_queue, restore, count, known_since):
+        '''
+        read rows of project from taskdb, yield (project, task_queue, kind, rows)
+
+        with restore, (watermark, tasks) of snapshot, 'snapshot' rows are yield and
+        then 'replay' rows changed in taskdb after the snapshot, otherwise 'tasks'
+        page by page with keyset pagination. followed by 'count' of status,
+        'loaded', and 'known' taskids when known_since is not False.
+        a failed stage is yield as 'error' with (stage, exception).
+        '''
+        stage = 'restore' if restore else 'tasks'
+        try:
+            if restore:
+                watermark, tasks = restore
+                for rows in self._pages(tasks):
+                    yield project, task_queue, 'snapshot', rows
+                pages = self._pages(taskdb.load_tasks_since(
+                    project.name, watermark - self.SNAPSHOT_REPLAY_MARGIN,
+                    self.scheduler_task_fields + ['status']))
+                kind = 'replay'
+            else:
+                pages = taskdb.load_tasks_pages(taskdb.ACTIVE, project.name,
+                                                self.scheduler_task_fields,
+                                                self.LOAD_TASKS_PAGE_SIZE)
+                kind = 'tasks'
+            for rows in pages:
+                if project.task_queue is not task_queue:
+                    logger.info('project: %s stopped, abort loading tasks.', project.name)
+                    return
+                yield project, task_queue, kind, rows
+            if count:
+                yield project, task_queue, 'count', taskdb.status_count(project.name)
+        except Exception as e:
+            yield project, task_queue, 'error', (stage, e)
+            return
+        yield project, task_queue, 'loaded', None
+
+        if known_since is False:
+            return
+        try:
+            if known_since is None:
+                pages = (page for status in (taskdb.ACTIVE, taskdb.SUCCESS,
+                                             taskdb.FAILED, taskdb.BAD)
+                         for page in taskdb.load_tasks_pages(status, project.name, ['taskid'],
+                                                             self.LOAD_TASKS_PAGE_SIZE))
+            else:
+                pages = self._pages(taskdb.load_tasks_since(project.name, known_since,
+                                                            ['taskid']))
+            for rows in pages:
+                if project.task_queue is not task_queue:
+                    return
+                yield project, task_queue, 'known', [task['taskid'] for task in rows]
+        except Exception as e:
+            yield project, task_queue, 'error', ('known', e)
+            return
+        yield project, task_queue, 'known_seeded', None
 
-        if project not in self._cnt['all']:
-            self._update_project_cnt(project.name)
-        self._cnt['all'].value((project.name, 'pending'), len(project.task_queue))
+    def _check_loaded(self):
+        '''apply rows read by loading threads'''
+        for _ in range(self._loaded_queue.qsize()):
+            try:
+                item = self._loaded_queue.get_nowait()
+            except Queue.Empty:
+                break
+            self._on_loaded(*item)
+
+    def _on_loaded(self, project, task_queue, kind, rows):
+        '''apply rows of project read by _load_rows'''
+        if project.task_queue is not task_queue:
+            # project is stopped, rows of the old queue are dropped
+            return
+        if kind == 'tasks':
+            for task in rows:
+                _schedule = task.get('schedule', self.default_schedule)
+                priority = _schedule.get('priority', self.default_schedule['priority'])
+                exetime = _schedule.get('exetime', self.default_schedule['exetime'])
+                task_queue.put(task['taskid'], priority, exetime, self.task_host(task))
+            project.loaded_tasks += len(rows)
+        elif kind == 'snapshot':
+            for taskid, priority, exetime, processing, host in rows:
+                task_queue.load(taskid, priority, exetime, processing, host)
+            project.loaded_tasks += len(rows)
+        elif kind == 'replay':
+            for task in rows:
+                # processing tasks are done by their status packs or timeout
+                if task_queue.is_processing(task['taskid']):
+                    continue
+                task_queue.delete(task['taskid'])
+                if task['status'] == self.taskdb.ACTIVE:
+                    _schedule = task.get('schedule', self.default_schedule)
+                    priority = _schedule.get('priority', self.default_schedule['priority'])
+                    exetime = _schedule.get('exetime', self.default_schedule['exetime'])
+                    task_queue.put(task['taskid'], priority, exetime, self.task_host(task))
+        elif kind == 'count':
+            self._set_project_cnt(project.name, rows)
+        elif kind == 'loaded':
+            project.task_loading = False
+            project.task_restoring = False
+            self._cnt['all'].value((project.name, 'pending'), len(task_queue))
+            logger.info('project: %s loaded %d tasks.', project.name, project.loaded_tasks)
+        elif kind == 'known':
+            for taskid in rows:
+                project.known_tasks.add(taskid)
+        elif kind == 'known_seeded':
+            project.known_tasks_seeded = True
+            logger.debug('project: %s known filter seeded with %d taskids.',
+                         project.name, len(project.known_tasks))
+        elif kind == 'error':
+            stage, e = rows
+            logger.error('project: %s load %s error: %r', project.name, stage, e)
+            if stage == 'known':
+                project.known_tasks = None
+                return
+            project.task_loading = False
+            project.task_restoring = False
+            # load from taskdb with next project update
+            project.task_loaded = False
+            if stage == 'restore':
+                project.task_queue = self.TASK_QUEUE_CLS()
+                project.task_queue.rate = task_queue.rate
+                project.task_queue.burst = task_queue.burst
+                project._update_host_limits()
+
+    def _start_known_tasks(self, project):
+        '''
+        set up known filter of project before loading it with taskids in taskdb,
+        return the time since when taskids are loaded, None for all taskids, False
+        if filter is not used or already seeded
+
+        the filter of last run is restored with tasks inserted after it's dumped.
+        '''
+        if not self.KNOWN_FILTER or project.known_tasks_seeded:
+            return False
+        restored = None
+        if self._known_restored:
+            watermark, filters = self._known_restored
+            restored = filters.pop(project.name, None)
+        # filter is used and updated by new requests during seeding
+        if restored is not None:
+            project.known_tasks = restored
+            return watermark - self.SNAPSHOT_REPLAY_MARGIN
+        project.known_tasks = known_filter.ScalableBloomFilter(self.KNOWN_FILTER_CAPACITY,
+                                                               self.KNOWN_FILTER_ERROR_RATE)
+        return None
+
+    def _add_known_tasks(self, project, taskids):
+        '''add inserted taskids to known filter of project'''
+        return self._run_in_loop(self._add_known_tasks_in_loop, project, taskids)
+
+    def _add_known_tasks_in_loop(self, project, taskids):
+        known = self.projects[project].known_tasks
+        if known is None:
+            return
+        for taskid in taskids:
+            known.add(taskid)
+
+    def _known_task(self, task):
+        '''
+        True if task is possibly in taskdb and the request can't restart it
+
+        only requests without force_update, itag and age are checked, as the
+        restart of others depends on the task in taskdb.
+        '''
+        known = self.projects[task['project']].known_tasks
+        if known is None:
+            return False
+        _schedule = task.get('schedule', self.default_schedule)
+        if _schedule.get('force_update') or _schedule.get('itag'):
+            return False
+        if _schedule.get('age', self.default_schedule['age']) >= 0:
+            return False
+        return task['taskid'] in known
 
     def _update_project_cnt(self, project_name):
-        status_count = self.taskdb.status_count(project_name)
+        self._set_project_cnt(project_name, self.taskdb.status_count(project_name))
+
+    def _set_project_cnt(self, project_name, status_count):
         self._cnt['all'].value(
             (project_name, 'success'),
             status_count.get(self.taskdb.SUCCESS, 0)
@@ -294,6 +615,31 @@ class Scheduler(object):
             status_count.get(self.taskdb.ACTIVE, 0)
         )
 
+    def _count(self, *events):
+        '''
+        fire counter events of (name, key, value), name is a key of _cnt or 'windows'
+        for 5m, 1h and 1d counters
+        '''
+        return self._run_in_loop(self._count_in_loop, events)
+
+    def _count_in_loop(self, events):
+        for name, key, value in events:
+            if name == 'windows':
+                self._cnt_windows.event(key, value)
+            else:
+                self._cnt[name].event(key, value)
+
+    def _run_in_loop(self, method, *args):
+        '''
+        call method in the scheduler loop thread, which owns counters, known filters
+        and _postpone_request
+        '''
+        return method(*args)
+
+    def _check_loop_calls(self):
+        '''run calls queued by _run_in_loop, nothing is queued in Scheduler'''
+        return 0
+
     def task_verify(self, task):
         '''
         return False if any of 'taskid', 'project', 'url' is not in task dict
@@ -320,15 +666,67 @@ class Scheduler(object):
 
     def update_task(self, task):
         '''update task in database'''
+        if self.UPDATE_BUFFER_SIZE > 0:
+            self._update_buffer.put(task['project'], task['taskid'], task)
+            return self._check_update_buffer()
         return self.taskdb.update(task['project'], task['taskid'], task)
 
+    def insert_tasks(self, project, tasks):
+        '''insert a batch of tasks of project into database'''
+        return self.taskdb.insert_many(project, tasks)
+
+    def update_tasks(self, project, tasks):
+        '''update a batch of tasks of project in database'''
+        if self.UPDATE_BUFFER_SIZE > 0:
+            for task in tasks:
+                self._update_buffer.put(project, task['taskid'], task)
+            return self._check_update_buffer()
+        return self.taskdb.update_many(project, tasks)
+
+    def _check_update_buffer(self):
+        '''Flush update buffer when it's full, block while it reached UPDATE_BUFFER_LIMIT'''
+        if len(self._update_buffer) >= self.UPDATE_BUFFER_SIZE:
+            self._flush_update_buffer()
+        limit = max(self.UPDATE_BUFFER_LIMIT, self.UPDATE_BUFFER_SIZE)
+        while len(self._update_buffer) >= limit and not self._quit:
+            time.sleep(max(self._update_buffer.retry_time - time.time(), 0.1))
+            self._flush_update_buffer()
+
+    def _flush_update_buffer(self, force=False):
+        '''Write buffered task updates to database'''
+        return self._update_buffer.flush(self.taskdb, force)
+
+    def _flush_update_buffer_on_quit(self):
+        '''Flush update buffer before exit, retried until UPDATE_BUFFER_QUIT_TIMEOUT'''
+        deadline = time.time() + self.UPDATE_BUFFER_QUIT_TIMEOUT
+        self._flush_update_buffer(force=True)
+        while len(self._update_buffer) and time.time() < deadline:
+            time.sleep(max(min(self._update_buffer.retry_time, deadline) - time.time(), 0))
+            self._flush_update_buffer(force=True)
+        if len(self._update_buffer):
+            logger.error('%d task updates are lost, failed to flush them on exit',
+                         len(self._update_buffer))
+
+    def _try_flush_update_buffer(self):
+        '''Flush update buffer every UPDATE_BUFFER_INTERVAL seconds'''
+        if not len(self._update_buffer):
+            return
+        if time.time() - self._update_buffer.last_flush >= self.UPDATE_BUFFER_INTERVAL:
+            self._flush_update_buffer()
+
+    @staticmethod
+    def task_host(task):
+        '''host of task url for per-host limits, None for urls without host'''
+        return urlsplit(task.get('url') or '').netloc.lower() or None
+
     def put_task(self, task):
         '''put task to task queue'''
         _schedule = task.get('schedule', self.default_schedule)
         self.projects[task['project']].task_queue.put(
             task['taskid'],
             priority=_schedule.get('priority', self.default_schedule['priority']),
-            exetime=_schedule.get('exetime', self.default_schedule['exetime'])
+            exetime=_schedule.get('exetime', self.default_schedule['exetime']),
+            host=self.task_host(task)
         )
 
     def send_task(self, task, force=True):
@@ -357,6 +755,7 @@ class Scheduler(object):
                         continue
                     project = self.projects[task['project']]
                     project.on_get_info(task['track'].get('save') or {})
+                    self._schedule_cronjob(project)
                     logger.info(
                         '%s on_get_info %r', task['project'], task['track'].get('save', {})
                     )
@@ -409,29 +808,53 @@ class Scheduler(object):
                     if not task.get('schedule', {}).get('force_update', False):
                         continue
 
+                if self._known_task(task):
+                    logger.debug('ignore known newtask %(project)s:%(taskid)s %(url)s', task)
+                    continue
+
                 tasks[task['taskid']] = task
 
-        for task in itervalues(tasks):
-            self.on_request(task)
+        if tasks:
+            self.on_request_batch(list(itervalues(tasks)))
 
         return len(tasks)
 
+    def _schedule_cronjob(self, project):
+        '''
+        Push next cronjob tick of project to the deadline heap
+
+        entries of a project not matching project._cron_tick are outdated, they are
+        dropped when popped.
+        '''
+        if not project.active or project.waiting_get_info or not int(project.min_tick):
+            project._cron_tick = None
+            return
+        min_tick = int(project.min_tick)
+        tick = (int(self._last_tick) // min_tick + 1) * min_tick
+        if project._cron_tick == tick:
+            return
+        project._cron_tick = tick
+        heapq.heappush(self._cron_heap, (tick, project.name))
+
     def _check_cronjob(self):
-        """Check projects cronjob tick, return True when a new tick is sended"""
-        now = time.time()
-        self._last_tick = int(self._last_tick)
-        if now - self._last_tick < 1:
+        """Send cronjob ticks of projects due, return True when a tick is sent"""
+        now = int(time.time())
+        if now <= self._last_tick:
             return False
-        self._last_tick += 1
-        for project in itervalues(self.projects):
-            if not project.active:
+        self._last_tick = now
+        sent = False
+        while self._cron_heap and self._cron_heap[0][0] <= now:
+            tick, name = heapq.heappop(self._cron_heap)
+            project = self.projects.get(name)
+            if project is None or project._cron_tick != tick:
                 continue
-            if project.waiting_get_info:
-                continue
-            if int(project.min_tick) == 0:
-                continue
-            if self._last_tick % int(project.min_tick) != 0:
+            project._cron_tick = None
+            if not project.active or project.waiting_get_info or not int(project.min_tick):
+                # scheduled again when activated or info updated
                 continue
+            # ticks missed after a stall are sent as the last one
+            min_tick = int(project.min_tick)
+            tick = now // min_tick * min_tick
             self.on_select_task({
                 'taskid': '_on_cronjob',
                 'project': project.name,
@@ -439,14 +862,16 @@ class Scheduler(object):
                 'status': self.taskdb.SUCCESS,
                 'fetch': {
                     'save': {
-                        'tick': self._last_tick,
+                        'tick': tick,
                     },
                 },
                 'process': {
                     'callback': '_on_cronjob',
                 },
             })
-        return True
+            sent = True
+            self._schedule_cronjob(project)
+        return sent
 
     request_task_fields = [
         'taskid',
@@ -475,70 +900,45 @@ class Scheduler(object):
             return {}
 
         taskids = []
-        cnt = 0
         cnt_dict = dict()
-        limit = self.LOOP_LIMIT
-
-        # dynamic assign select limit for each project, use qsize as weight
-        project_weights, total_weight = dict(), 0
-        for project in itervalues(self.projects):  # type:Project
-            if not project.active:
-                continue
-            # only check project pause when select new tasks, cronjob and new request still working
-            if project.paused:
-                continue
-            if project.waiting_get_info:
-                continue
-
-            # task queue
-            task_queue = project.task_queue  # type:TaskQueue
-            pro_weight = task_queue.size()
-            total_weight += pro_weight
-            project_weights[project.name] = pro_weight
-            pass
 
-        min_project_limit = int(limit / 10.)  # ensure minimum select limit for each project
-        max_project_limit = int(limit / 3.0)  # ensure maximum select limit for each project
-
-        for pro_name, pro_weight in iteritems(project_weights):
-            if cnt >= limit:
-                break
-
-            project = self.projects[pro_name]  # type:Project
-
-            # task queue
+        def take(project, limit):
             task_queue = project.task_queue
-            task_queue.check_update()
-            project_cnt = 0
-
-            # calculate select limit for project
-            if total_weight < 1 or pro_weight < 1:
-                project_limit = min_project_limit
-            else:
-                project_limit = int((1.0 * pro_weight / total_weight) * limit)
-                if project_limit < min_project_limit:
-                    project_limit = min_project_limit
-                elif project_limit > max_project_limit:
-                    project_limit = max_project_limit
-
-            # check send_buffer here. when not empty, out_queue may blocked. Not sending tasks
-            while cnt < limit and project_cnt < project_limit:
+            cnt = 0
+            while cnt < limit:
                 taskid = task_queue.get()
                 if not taskid:
                     break
-
                 taskids.append((project.name, taskid))
                 if taskid != 'on_finished':
-                    project_cnt += 1
+                    cnt_dict[project.name] = cnt_dict.get(project.name, 0) + 1
                 cnt += 1
+            return cnt
+
+        projects, selectable = [], []
+        for project in list(itervalues(self._active_projects)):  # type:Project
+            # only check project pause when select new tasks, cronjob and new request still working
+            if project.paused:
+                continue
+            if project.waiting_get_info:
+                continue
+            if project.task_restoring:
+                continue
+            projects.append(project)
+            if len(project.task_queue):
+                project.task_queue.check_update()
+                selectable.append(project)
+
+        self.select_policy.select(selectable, self.LOOP_LIMIT, take)
 
-            cnt_dict[project.name] = project_cnt
+        for project in projects:
+            project_cnt = cnt_dict.setdefault(project.name, 0)
             if project_cnt:
                 project._selected_tasks = True
                 project._send_finished_event_wait = 0
 
             # check and send finished event to project
-            if not project_cnt and len(task_queue) == 0 and project._selected_tasks:
+            if not project_cnt and len(project.task_queue) == 0 and project._selected_tasks:
                 # wait for self.FAIL_PAUSE_NUM steps to make sure all tasks in queue have been processed
                 if project._send_finished_event_wait < self.FAIL_PAUSE_NUM:
                     project._send_finished_event_wait += 1
@@ -560,20 +960,36 @@ class Scheduler(object):
                         },
                     })
 
+        # hydrate selected tasks with one taskdb call per project
+        project_taskids = dict()
         for project, taskid in taskids:
-            self._load_put_task(project, taskid)
+            project_taskids.setdefault(project, []).append(taskid)
+        for project, _taskids in iteritems(project_taskids):
+            self._load_put_tasks(project, _taskids)
 
         return cnt_dict
 
-    def _load_put_task(self, project, taskid):
+    @property
+    def select_policy(self):
+        if not isinstance(self._select_policy, self.SELECT_POLICY_CLS):
+            self._select_policy = self.SELECT_POLICY_CLS()
+        return self._select_policy
+
+    def _load_put_tasks(self, project, taskids):
         try:
-            task = self.taskdb.get_task(project, taskid, fields=self.request_task_fields)
+            tasks = dict((task['taskid'], task) for task in self.taskdb.get_tasks(
+                project, taskids, fields=self.request_task_fields))
+            for task in itervalues(tasks):
+                self._update_buffer.merge(project, task, self.request_task_fields)
         except ValueError:
-            logger.error('bad task pack %s:%s', project, taskid)
+            logger.error('bad task pack %s:%s', project, taskids)
             return
-        if not task:
-            return
-        task = self.on_select_task(task)
+        # keep the order of selection
+        for taskid in taskids:
+            task = tasks.get(taskid)
+            if not task:
+                continue
+            self.on_select_task(task)
 
     def _print_counter_log(self):
         # print top 5 active counters
@@ -614,10 +1030,9 @@ class Scheduler(object):
         logger.info(log_str)
 
     def _dump_cnt(self):
-        '''Dump counters to file'''
-        self._cnt['1h'].dump(os.path.join(self.data_path, 'scheduler.1h'))
-        self._cnt['1d'].dump(os.path.join(self.data_path, 'scheduler.1d'))
-        self._cnt['all'].dump(os.path.join(self.data_path, 'scheduler.all'))
+        '''Append changed counters to journals'''
+        for journal in itervalues(self._cnt_journals):
+            journal.write()
 
     def _try_dump_cnt(self):
         '''Dump counters every 60 seconds'''
@@ -627,6 +1042,68 @@ class Scheduler(object):
             self._dump_cnt()
             self._print_counter_log()
 
+    def _open_snapshot(self):
+        '''open task queue snapshot of last run if enabled'''
+        if self.SNAPSHOT_INTERVAL > 0:
+            self._snapshot = snapshot.Snapshot.open(
+                self._data_file('queue'))
+
+    def _dump_snapshot(self):
+        '''Dump task queues of loaded projects to file'''
+        watermark = time.time()
+        # tasks in queues should be written in taskdb before watermark
+        self._flush_update_buffer()
+        if self._update_buffer.failures:
+            logger.warning('task updates not written, snapshot skipped')
+            return
+        projects = dict()
+        for project in list(itervalues(self.projects)):
+            if project.task_loaded and not project.task_loading:
+                projects[project.name] = project.task_queue.dump()
+        snapshot.dump(self._data_file('queue'), watermark, projects)
+        logger.debug('task queues of %d projects dumped', len(projects))
+
+    def _try_dump_snapshot(self):
+        '''Dump task queues every SNAPSHOT_INTERVAL seconds'''
+        if self.SNAPSHOT_INTERVAL <= 0:
+            return
+        now = time.time()
+        if now - self._last_snapshot >= self.SNAPSHOT_INTERVAL:
+            self._last_snapshot = now
+            try:
+                self._dump_snapshot()
+            except Exception as e:
+                logger.exception('dump task queue snapshot error: %s', e)
+
+    def _open_known_filters(self):
+        '''load known filters of last run if enabled'''
+        if self.KNOWN_FILTER:
+            self._known_restored = known_filter.load(
+                self._data_file('known'), self.KNOWN_FILTER_CAPACITY,
+                self.KNOWN_FILTER_ERROR_RATE)
+
+    def _dump_known_filters(self):
+        '''Dump known filters of projects to file'''
+        watermark = time.time()
+        filters = dict(self._known_restored[1]) if self._known_restored else dict()
+        for project in list(itervalues(self.projects)):
+            if project.known_tasks_seeded:
+                filters[project.name] = project.known_tasks
+        known_filter.dump(self._data_file('known'), watermark, filters)
+        logger.debug('known filters of %d projects dumped', len(filters))
+
+    def _try_dump_known_filters(self):
+        '''Dump known filters every KNOWN_FILTER_DUMP_INTERVAL seconds'''
+        if not self.KNOWN_FILTER:
+            return
+        now = time.time()
+        if now - self._last_dump_known >= self.KNOWN_FILTER_DUMP_INTERVAL:
+            self._last_dump_known = now
+            try:
+                self._dump_known_filters()
+            except Exception as e:
+                logger.exception('dump known filters error: %s', e)
+
     def _check_delete(self):
         '''Check project delete'''
         now = time.time()
@@ -640,6 +1117,11 @@ class Scheduler(object):
 
             logger.warning("deleting project: %s!", project.name)
             del self.projects[project.name]
+            self._active_projects.pop(project.name, None)
+            self.select_policy.remove(project.name)
+            self._update_buffer.discard(project.name)
+            if self._known_restored:
+                self._known_restored[1].pop(project.name, None)
             self.taskdb.drop(project.name)
             self.projectdb.drop(project.name)
             if self.resultdb:
@@ -653,6 +1135,7 @@ class Scheduler(object):
     def quit(self):
         '''Set quit signal'''
         self._quit = True
+        self.wakeup()
         # stop xmlrpc server
         if hasattr(self, 'xmlrpc_server'):
             self.xmlrpc_ioloop.add_callback(self.xmlrpc_server.stop)
@@ -662,22 +1145,119 @@ class Scheduler(object):
         '''comsume queues and feed tasks to fetcher, once'''
 
         self._update_projects()
-        self._check_task_done()
-        self._check_request()
-        while self._check_cronjob():
-            pass
-        self._check_select()
+        self._check_loaded()
+        self._check_loop_calls()
+        cnt = self._check_task_done()
+        cnt += self._check_request()
+        self._check_cronjob()
+        cnt += sum(itervalues(self._check_select() or {}))
         self._check_delete()
+        self._try_flush_update_buffer()
         self._try_dump_cnt()
+        self._try_dump_snapshot()
+        self._try_dump_known_filters()
+        return cnt
+
+    def wakeup(self):
+        '''wake up the scheduler loop waiting for events'''
+        if self._wakeup is None or self._wakeup_sent.is_set():
+            return
+        self._wakeup_sent.set()
+        try:
+            self._wakeup[1].send_bytes(b'1')
+        except (IOError, OSError):
+            pass
+
+    def _queue_connections(self):
+        '''connections to wait for new items of queues, None if queues can't be waited'''
+        if connection_wait is None:
+            return None
+        connections = []
+        for queue in (self.newtask_queue, self.status_queue):
+            # multiprocessing.Queue
+            reader = getattr(queue, '_reader', None)
+            if reader is None or not hasattr(reader, 'fileno'):
+                return None
+            connections.append(reader)
+        return connections
+
+    def _next_wakeup(self):
+        '''time of the earliest known work, from timers, cronjobs and task queues'''
+        now = time.time()
+        times = [
+            now + self.EVENT_MAX_WAIT,
+            self._last_update_project + self.UPDATE_PROJECT_INTERVAL,
+            self._last_dump_cnt + 60,
+        ]
+        if len(self._update_buffer):
+            times.append(max(self._update_buffer.last_flush + self.UPDATE_BUFFER_INTERVAL,
+                             self._update_buffer.retry_time))
+        if self.SNAPSHOT_INTERVAL > 0:
+            times.append(self._last_snapshot + self.SNAPSHOT_INTERVAL)
+        if self._send_buffer or self._postpone_request or self._force_update_project:
+            times.append(now + self.LOOP_INTERVAL)
+        if self._cron_heap:
+            times.append(self._cron_heap[0][0])
+
+        for project in list(itervalues(self._active_projects)):
+            if project.waiting_get_info:
+                continue
+            if project.task_loading or project._paused == 'checking':
+                # tasks are put by loading thread, or pause state is checked by loops
+                times.append(now + self.LOOP_INTERVAL)
+            elif project._paused:
+                times.append(project._paused_time + self.PAUSE_TIME)
+                continue
+            if project._selected_tasks and not len(project.task_queue):
+                # counting loops to send on_finished event
+                times.append(now + self.LOOP_INTERVAL)
+            next_time = project.task_queue.next_time()
+            if next_time is not None:
+                times.append(next_time)
+        return min(times)
+
+    def _wait_events(self, busy):
+        '''
+        wait until new items in newtask_queue / status_queue, or the next known work
+
+        waits with adaptive backoff polling when queues can't be waited.
+        '''
+        if busy:
+            # there may be more
+            self._backoff = 0
+            return
+        timeout = max(0, min(self._next_wakeup() - time.time(), self.EVENT_MAX_WAIT))
+        if not timeout:
+            return
+
+        connections = self._queue_connections()
+        if connections is None:
+            self._backoff = min(max(self._backoff * 2, 0.001), self.LOOP_INTERVAL * 10)
+            time.sleep(min(timeout, self._backoff))
+            return
+
+        if self._wakeup is None:
+            self._wakeup = multiprocessing.Pipe(duplex=False)
+        connection_wait(connections + [self._wakeup[0]], timeout)
+        if self._wakeup_sent.is_set():
+            while self._wakeup[0].poll():
+                self._wakeup[0].recv_bytes()
+            self._wakeup_sent.clear()
 
     def run(self):
         '''Start scheduler loop'''
         logger.info("scheduler starting...")
+        self._open_snapshot()
+        self._open_known_filters()
 
+        busy = 0
         while not self._quit:
             try:
-                time.sleep(self.LOOP_INTERVAL)
-                self.run_once()
+                if self.EVENT_DRIVEN:
+                    self._wait_events(busy)
+                else:
+                    time.sleep(self.LOOP_INTERVAL)
+                busy = self.run_once()
                 self._exceptions = 0
             except KeyboardInterrupt:
                 break
@@ -689,7 +1269,18 @@ class Scheduler(object):
                 continue
 
         logger.info("scheduler exiting...")
+        self._wait_thread()
+        self._check_loop_calls()
+        self._flush_update_buffer_on_quit()
         self._dump_cnt()
+        if self.SNAPSHOT_INTERVAL > 0:
+            self._dump_snapshot()
+        if self.KNOWN_FILTER:
+            self._dump_known_filters()
+
+    def _wait_thread(self):
+        '''wait for works in worker threads, nothing to wait in Scheduler'''
+        return True
 
     def trigger_on_start(self, project):
         '''trigger an on_start callback of project'''
@@ -703,10 +1294,10 @@ class Scheduler(object):
         })
 
     def xmlrpc_run(self, port=23333, bind='127.0.0.1', log_requests=False):
-        '''Start xmlrpc interface'''
-        from pyspider.libs.wsgi_xmlrpc import WSGIXMLRPCApplication
+        '''Start xmlrpc interface, msgpack rpc is served on the same port'''
+        from pyspider.libs.msgpack_rpc import WSGIRPCApplication
 
-        application = WSGIXMLRPCApplication()
+        application = WSGIRPCApplication()
 
         application.register_function(self.quit, '_quit')
         application.register_function(self.__len__, 'size')
@@ -725,6 +1316,39 @@ class Scheduler(object):
             return False
         application.register_function(new_task, 'newtask')
 
+        def newtask_batch(tasks):
+            '''put tasks to newtask_queue at once, return list of whether each is accepted'''
+            result = [bool(self.task_verify(task)) for task in tasks]
+            tasks = [task for task, ok in zip(tasks, result) if ok]
+            if tasks:
+                self.newtask_queue.put(tasks)
+            return result
+        application.register_function(newtask_batch, 'newtask_batch')
+
+        # taskdb connection of the rpc thread
+        rpc_taskdb = self._background_taskdb() or self.taskdb
+
+        def get_tasks_batch(keys, fields=None):
+            '''tasks in taskdb of a list of (project, taskid), None if not found'''
+            _fields = list(fields) + ['taskid'] if fields and 'taskid' not in fields else fields
+            project_taskids = dict()
+            for project, taskid in keys:
+                project_taskids.setdefault(project, []).append(taskid)
+            tasks = dict()
+            for project, taskids in iteritems(project_taskids):
+                for task in rpc_taskdb.get_tasks(project, taskids, _fields) or ():
+                    self._update_buffer.merge(project, task, _fields)
+                    tasks[(project, task['taskid'])] = task
+            result = []
+            for project, taskid in keys:
+                task = tasks.get((project, taskid))
+                if task is not None and _fields is not fields:
+                    task = dict(task)
+                    del task['taskid']
+                result.append(task)
+            return result
+        application.register_function(get_tasks_batch, 'get_tasks_batch')
+
         def send_task(task):
             '''dispatch task to fetcher'''
             self.send_task(task)
@@ -733,6 +1357,7 @@ class Scheduler(object):
 
         def update_project():
             self._force_update_project = True
+            self.wakeup()
         application.register_function(update_project, 'update_project')
 
         def get_active_tasks(project=None, limit=100):
@@ -786,9 +1411,15 @@ class Scheduler(object):
             return result
         application.register_function(get_projects_pause_status, 'get_projects_pause_status')
 
+        def get_loading_status():
+            return dict((name, project.loaded_tasks)
+                        for name, project in list(iteritems(self.projects))
+                        if project.task_loading)
+
         def webui_update():
             return {
                 'pause_status': get_projects_pause_status(),
+                'loading': get_loading_status(),
                 'counter': {
                     '5m_time': dump_counter('5m_time', 'avg'),
                     '5m': dump_counter('5m', 'sum'),
@@ -817,6 +1448,7 @@ class Scheduler(object):
 
         oldtask = self.taskdb.get_task(task['project'], task['taskid'],
                                        fields=self.merge_task_fields)
+        oldtask = self._update_buffer.merge(task['project'], oldtask, self.merge_task_fields)
         if oldtask:
             return self.on_old_request(task, oldtask)
         else:
@@ -826,18 +1458,104 @@ class Scheduler(object):
         '''Called when a new request is arrived'''
         task['status'] = self.taskdb.ACTIVE
         self.insert_task(task)
+        self._add_known_tasks(task['project'], (task['taskid'], ))
         self.put_task(task)
 
         project = task['project']
-        self._cnt['5m'].event((project, 'pending'), +1)
-        self._cnt['1h'].event((project, 'pending'), +1)
-        self._cnt['1d'].event((project, 'pending'), +1)
-        self._cnt['all'].event((project, 'pending'), +1)
+        self._count(('windows', (project, 'pending'), +1),
+                    ('all', (project, 'pending'), +1))
         logger.info('new task %(project)s:%(taskid)s %(url)s', task)
         return task
 
-    def on_old_request(self, task, old_task):
-        '''Called when a crawled task is arrived'''
+    def on_request_batch(self, tasks):
+        '''
+        Called when a batch of new requests is arrived, taskids in batch should be unique
+
+        Same as on_request for each task, but taskdb is looked up with one get_tasks
+        and written with one insert_many / update_many per project.
+        '''
+        project_tasks = dict()
+        for task in tasks:
+            project_tasks.setdefault(task['project'], []).append(task)
+        for project, _tasks in iteritems(project_tasks):
+            self._on_project_requests(project, _tasks)
+
+    def _on_project_requests(self, project, tasks):
+        task_queue = self.projects[project].task_queue
+        if self.INQUEUE_LIMIT:
+            limit = max(self.INQUEUE_LIMIT - len(task_queue), 0)
+            for task in tasks[limit:]:
+                logger.debug('overflow task %(project)s:%(taskid)s %(url)s', task)
+            tasks = tasks[:limit]
+        if not tasks:
+            return
+
+        old_tasks = dict((each['taskid'], each) for each in self.taskdb.get_tasks(
+            project, [task['taskid'] for task in tasks], fields=self.merge_task_fields))
+        for old_task in itervalues(old_tasks):
+            self._update_buffer.merge(project, old_task, self.merge_task_fields)
+
+        new_tasks = []
+        restart_tasks = []
+        for task in tasks:
+            old_task = old_tasks.get(task['taskid'])
+            if old_task is None:
+                task['status'] = self.taskdb.ACTIVE
+                new_tasks.append(task)
+            elif self._need_restart(task, old_task):
+                if task.get('schedule', self.default_schedule).get('cancel'):
+                    task['status'] = self.taskdb.BAD
+                else:
+                    task['status'] = self.taskdb.ACTIVE
+                restart_tasks.append((task, old_task))
+
+        if new_tasks:
+            self.insert_tasks(project, new_tasks)
+            self._add_known_tasks(project, [task['taskid'] for task in new_tasks])
+        if restart_tasks:
+            self.update_tasks(project, [task for task, _ in restart_tasks])
+
+        for task in new_tasks:
+            self.put_task(task)
+            logger.info('new task %(project)s:%(taskid)s %(url)s', task)
+
+        # counter events are aggregated for the batch
+        pending, success, failed = len(new_tasks), 0, 0
+        all_pending = len(new_tasks)
+        for task, old_task in restart_tasks:
+            if task['status'] == self.taskdb.BAD:
+                logger.info('cancel task %(project)s:%(taskid)s %(url)s', task)
+                task_queue.delete(task['taskid'])
+                continue
+            self.put_task(task)
+            if old_task['status'] != self.taskdb.ACTIVE:
+                pending += 1
+            if old_task['status'] == self.taskdb.SUCCESS:
+                success += 1
+                all_pending += 1
+            elif old_task['status'] == self.taskdb.FAILED:
+                failed += 1
+                all_pending += 1
+            logger.info('restart task %(project)s:%(taskid)s %(url)s', task)
+
+        events = []
+        if pending:
+            events.append(('windows', (project, 'pending'), pending))
+        if all_pending:
+            events.append(('all', (project, 'pending'), all_pending))
+        if success:
+            events.append(('all', (project, 'success'), -success))
+        if failed:
+            events.append(('all', (project, 'failed'), -failed))
+        if events:
+            self._count(*events)
+
+    def _postpone(self, task):
+        '''request of task is checked again when the task is not processing'''
+        self._postpone_request.append(task)
+
+    def _need_restart(self, task, old_task):
+        '''check if a request of a crawled task should restart it'''
         now = time.time()
 
         _schedule = task.get('schedule', self.default_schedule)
@@ -847,8 +1565,8 @@ class Scheduler(object):
             # when a task is in processing, the modify may conflict with the running task.
             # postpone the modify after task finished.
             logger.info('postpone modify task %(project)s:%(taskid)s %(url)s', task)
-            self._postpone_request.append(task)
-            return
+            self._run_in_loop(self._postpone, task)
+            return False
 
         restart = False
         schedule_age = _schedule.get('age', self.default_schedule['age'])
@@ -861,6 +1579,13 @@ class Scheduler(object):
 
         if not restart:
             logger.debug('ignore newtask %(project)s:%(taskid)s %(url)s', task)
+        return restart
+
+    def on_old_request(self, task, old_task):
+        '''Called when a crawled task is arrived'''
+        _schedule = task.get('schedule', self.default_schedule)
+
+        if not self._need_restart(task, old_task):
             return
 
         if _schedule.get('cancel'):
@@ -876,13 +1601,11 @@ class Scheduler(object):
 
         project = task['project']
         if old_task['status'] != self.taskdb.ACTIVE:
-            self._cnt['5m'].event((project, 'pending'), +1)
-            self._cnt['1h'].event((project, 'pending'), +1)
-            self._cnt['1d'].event((project, 'pending'), +1)
+            self._count(('windows', (project, 'pending'), +1))
         if old_task['status'] == self.taskdb.SUCCESS:
-            self._cnt['all'].event((project, 'success'), -1).event((project, 'pending'), +1)
+            self._count(('all', (project, 'success'), -1), ('all', (project, 'pending'), +1))
         elif old_task['status'] == self.taskdb.FAILED:
-            self._cnt['all'].event((project, 'failed'), -1).event((project, 'pending'), +1)
+            self._count(('all', (project, 'failed'), -1), ('all', (project, 'pending'), +1))
         logger.info('restart task %(project)s:%(taskid)s %(url)s', task)
         return task
 
@@ -903,12 +1626,15 @@ class Scheduler(object):
             ret = self.on_task_failed(task)
 
         if task['track']['fetch'].get('time'):
-            self._cnt['5m_time'].event((task['project'], 'fetch_time'),
-                                       task['track']['fetch']['time'])
+            self._count(('5m_time', (task['project'], 'fetch_time'),
+                         task['track']['fetch']['time']))
         if task['track']['process'].get('time'):
-            self._cnt['5m_time'].event((task['project'], 'process_time'),
-                                       task['track']['process'].get('time'))
-        self.projects[task['project']].active_tasks.appendleft((time.time(), task))
+            self._count(('5m_time', (task['project'], 'process_time'),
+                         task['track']['process'].get('time')))
+        project = self.projects[task['project']]
+        project.on_fetched(task['track']['fetch'].get('status_code'),
+                           task['track']['fetch'].get('time'))
+        project.active_tasks.appendleft((time.time(), task))
         return ret
 
     def on_task_done(self, task):
@@ -927,10 +1653,9 @@ class Scheduler(object):
         self.update_task(task)
 
         project = task['project']
-        self._cnt['5m'].event((project, 'success'), +1)
-        self._cnt['1h'].event((project, 'success'), +1)
-        self._cnt['1d'].event((project, 'success'), +1)
-        self._cnt['all'].event((project, 'success'), +1).event((project, 'pending'), -1)
+        self._count(('windows', (project, 'success'), +1),
+                    ('all', (project, 'success'), +1),
+                    ('all', (project, 'pending'), -1))
         logger.info('task done %(project)s:%(taskid)s %(url)s', task)
         return task
 
@@ -938,7 +1663,9 @@ class Scheduler(object):
         '''Called when a task is failed, called by `on_task_status`'''
 
         if 'schedule' not in task:
-            old_task = self.taskdb.get_task(task['project'], task['taskid'], fields=['schedule'])
+            old_task = self._update_buffer.get(task['project'], task['taskid'])
+            if not old_task or 'schedule' not in old_task:
+                old_task = self.taskdb.get_task(task['project'], task['taskid'], fields=['schedule'])
             if old_task is None:
                 logging.error('unknown status pack: %s' % task)
                 return
@@ -965,10 +1692,9 @@ class Scheduler(object):
             self.update_task(task)
 
             project = task['project']
-            self._cnt['5m'].event((project, 'failed'), +1)
-            self._cnt['1h'].event((project, 'failed'), +1)
-            self._cnt['1d'].event((project, 'failed'), +1)
-            self._cnt['all'].event((project, 'failed'), +1).event((project, 'pending'), -1)
+            self._count(('windows', (project, 'failed'), +1),
+                        ('all', (project, 'failed'), +1),
+                        ('all', (project, 'pending'), -1))
             logger.info('task failed %(project)s:%(taskid)s %(url)s' % task)
             return task
         else:
@@ -979,9 +1705,7 @@ class Scheduler(object):
             self.put_task(task)
 
             project = task['project']
-            self._cnt['5m'].event((project, 'retry'), +1)
-            self._cnt['1h'].event((project, 'retry'), +1)
-            self._cnt['1d'].event((project, 'retry'), +1)
+            self._count(('windows', (project, 'retry'), +1))
             # self._cnt['all'].event((project, 'retry'), +1)
             logger.info('task retry %d/%d %%(project)s:%%(taskid)s %%(url)s' % (
                 retried, retries), task)
@@ -1184,23 +1908,34 @@ class OneScheduler(Scheduler):
     def quit(self):
         self.ioloop.stop()
         logger.info("scheduler exiting...")
+        self._flush_update_buffer_on_quit()
 
 
-import random
 import threading
+from concurrent.futures import Future
 from pyspider.database.sqlite.sqlitebase import SQLiteMixin
 
 
 class ThreadBaseScheduler(Scheduler):
+    '''
+    scheduler with task status and requests processed in worker threads
+
+    works of a task are sharded by hash(taskid) to bounded worker queues, so the
+    works of the same task are processed in order while the scheduler loop goes on
+    without waiting for them. sqlite taskdb is written by a dedicated writer thread.
+    counter events, known taskids and postponed requests of workers are sent back
+    to the loop thread by _run_in_loop.
+    '''
+    THREAD_QUEUE_SIZE = 1000
+
     def __init__(self, threads=4, *args, **kwargs):
         self.local = threading.local()
+        # (method, args) called by worker threads to run in the loop thread
+        self._loop_calls = Queue.Queue()
 
         super(ThreadBaseScheduler, self).__init__(*args, **kwargs)
 
-        if isinstance(self.taskdb, SQLiteMixin):
-            self.threads = 1
-        else:
-            self.threads = threads
+        self.threads = threads
 
         self._taskdb = self.taskdb
         self._projectdb = self.projectdb
@@ -1208,9 +1943,18 @@ class ThreadBaseScheduler(Scheduler):
 
         self.thread_objs = []
         self.thread_queues = []
+        self._pending = 0
+        self._pending_cond = threading.Condition()
+        self._next_queue = itertools.count()
         self._start_threads()
         assert len(self.thread_queues) > 0
 
+        # sqlite allows only one writer at a time
+        self._writer = None
+        self._writer_queue = None
+        if isinstance(self._taskdb, SQLiteMixin):
+            self._start_writer()
+
     @property
     def taskdb(self):
         if not hasattr(self.local, 'taskdb'):
@@ -1243,53 +1987,127 @@ class ThreadBaseScheduler(Scheduler):
 
     def _start_threads(self):
         for i in range(self.threads):
-            queue = Queue.Queue()
+            queue = Queue.Queue(self.THREAD_QUEUE_SIZE)
             thread = threading.Thread(target=self._thread_worker, args=(queue, ))
             thread.daemon = True
             thread.start()
             self.thread_objs.append(thread)
             self.thread_queues.append(queue)
 
+    def _start_writer(self):
+        self._writer_queue = Queue.Queue(self.THREAD_QUEUE_SIZE)
+        self._writer = threading.Thread(target=self._writer_worker)
+        self._writer.daemon = True
+        self._writer.start()
+
+    @staticmethod
+    def _run_job(future, method, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(method(*args, **kwargs))
+        except Exception as e:
+            logger.exception(e)
+            future.set_exception(e)
+
     def _thread_worker(self, queue):
+        self.local.worker = True
         while True:
-            method, args, kwargs = queue.get()
-            try:
-                method(*args, **kwargs)
-            except Exception as e:
-                logger.exception(e)
+            self._run_job(*queue.get())
+            with self._pending_cond:
+                self._pending -= 1
+                if not self._pending:
+                    self._pending_cond.notify_all()
+            # tasks may be put into task queues
+            self.wakeup()
+
+    def _writer_worker(self):
+        self.local.worker = True
+        while True:
+            self._run_job(*self._writer_queue.get())
 
     def _run_in_thread(self, method, *args, **kwargs):
+        '''
+        run method in worker thread i (round robin when not given), return a Future
+
+        blocks when the queue of the worker is full.
+        '''
         i = kwargs.pop('_i', None)
         block = kwargs.pop('_block', False)
 
         if i is None:
-            while True:
-                for queue in self.thread_queues:
-                    if queue.empty():
-                        break
-                else:
-                    if block:
-                        time.sleep(0.1)
-                        continue
-                    else:
-                        queue = self.thread_queues[random.randint(0, len(self.thread_queues)-1)]
-                break
-        else:
-            queue = self.thread_queues[i % len(self.thread_queues)]
+            i = next(self._next_queue)
+        queue = self.thread_queues[i % len(self.thread_queues)]
 
-        queue.put((method, args, kwargs))
+        future = Future()
+        with self._pending_cond:
+            self._pending += 1
+        queue.put((future, method, args, kwargs))
 
         if block:
-            self._wait_thread()
+            future.exception()
+        return future
+
+    def _wait_thread(self, timeout=None):
+        '''wait until works in worker threads are all done'''
+        with self._pending_cond:
+            if timeout is None:
+                while self._pending:
+                    self._pending_cond.wait()
+            else:
+                end = time.time() + timeout
+                while self._pending and time.time() < end:
+                    self._pending_cond.wait(end - time.time())
+            return not self._pending
 
-    def _wait_thread(self):
-        while True:
-            if all(queue.empty() for queue in self.thread_queues):
+    def _run_in_loop(self, method, *args):
+        if not getattr(self.local, 'worker', False):
+            return method(*args)
+        self._loop_calls.put((method, args))
+
+    def _check_loop_calls(self):
+        cnt = 0
+        for _ in range(self._loop_calls.qsize()):
+            try:
+                method, args = self._loop_calls.get_nowait()
+            except Queue.Empty:
                 break
-            time.sleep(0.1)
+            try:
+                method(*args)
+            except Exception as e:
+                logger.exception(e)
+            cnt += 1
+        return cnt
 
-    def _update_project(self, project):
-        self._run_in_thread(Scheduler._update_project, self, project)
+    def _write(self, method, *args):
+        '''call method writing taskdb in writer thread and wait for the result'''
+        if self._writer is None or threading.current_thread() is self._writer:
+            return method(*args)
+        future = Future()
+        self._writer_queue.put((future, method, args, {}))
+        return future.result()
+
+    def insert_task(self, task):
+        return self._write(Scheduler.insert_task, self, task)
+
+    def update_task(self, task):
+        if self.UPDATE_BUFFER_SIZE > 0:
+            return super(ThreadBaseScheduler, self).update_task(task)
+        return self._write(Scheduler.update_task, self, task)
+
+    def insert_tasks(self, project, tasks):
+        return self._write(Scheduler.insert_tasks, self, project, tasks)
+
+    def update_tasks(self, project, tasks):
+        if self.UPDATE_BUFFER_SIZE > 0:
+            return super(ThreadBaseScheduler, self).update_tasks(project, tasks)
+        return self._write(Scheduler.update_tasks, self, project, tasks)
+
+    def _flush_update_buffer(self, force=False):
+        return self._write(Scheduler._flush_update_buffer, self, force)
+
+    def _background_taskdb(self, taskdb=None):
+        return Scheduler._background_taskdb(self, taskdb or self._taskdb)
 
     def on_task_status(self, task):
         i = hash(task['taskid'])
@@ -1299,10 +2117,18 @@ class ThreadBaseScheduler(Scheduler):
         i = hash(task['taskid'])
         self._run_in_thread(Scheduler.on_request, self, task, _i=i)
 
-    def _load_put_task(self, project, taskid):
-        i = hash(taskid)
-        self._run_in_thread(Scheduler._load_put_task, self, project, taskid, _i=i)
-
-    def run_once(self):
-        super(ThreadBaseScheduler, self).run_once()
-        self._wait_thread()
+    def on_request_batch(self, tasks):
+        shards = dict()
+        for task in tasks:
+            shards.setdefault(hash(task['taskid']) % self.threads, []).append(task)
+        for i, _tasks in iteritems(shards):
+            self._run_in_thread(Scheduler.on_request_batch, self, _tasks, _i=i)
+
+    def _load_put_tasks(self, project, taskids):
+        # split the batch by the thread a taskid is bound to, to keep the order
+        # with on_task_status / on_request of the same task
+        shards = dict()
+        for taskid in taskids:
+            shards.setdefault(hash(taskid) % self.threads, []).append(taskid)
+        for i, _taskids in iteritems(shards):
+            self._run_in_thread(Scheduler._load_put_tasks, self, project, _taskids, _i=i)
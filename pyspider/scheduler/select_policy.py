@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+
+class SelectPolicy(object):
+    '''
+    policy of how many tasks are selected from each project in a select loop
+
+    `select(projects, limit, take)` is called with the projects having tasks in queue,
+    `take(project, n)` selects at most n tasks from project and returns the number
+    selected, less than n means no more task of project is available in this loop
+    (queue empty or rate limited).
+    '''
+
+    def select(self, projects, limit, take):
+        '''select at most limit tasks, return number of tasks selected'''
+        raise NotImplementedError
+
+    def remove(self, name):
+        '''project is stopped or deleted'''
+        pass
+
+
+class QueueSizePolicy(SelectPolicy):
+    '''
+    select limit of each project is proportional to its queue size, clamped to
+    [limit / 10, limit / 3]
+    '''
+
+    def select(self, projects, limit, take):
+        weights = dict((project.name, len(project.task_queue)) for project in projects)
+        total_weight = sum(weights.values())
+        min_project_limit = int(limit / 10.)
+        max_project_limit = int(limit / 3.0)
+
+        cnt = 0
+        for project in projects:
+            if cnt >= limit:
+                break
+            weight = weights[project.name]
+            if total_weight < 1 or weight < 1:
+                project_limit = min_project_limit
+            else:
+                project_limit = int((1.0 * weight / total_weight) * limit)
+                project_limit = min(max(project_limit, min_project_limit), max_project_limit)
+            cnt += take(project, min(project_limit, limit - cnt))
+        return cnt
+
+
+class DeficitRoundRobinPolicy(SelectPolicy):
+    '''
+    deficit round robin over projects, weighted by rate of projects
+
+    In each round, a project is credited a quantum of weight / min weight tasks and
+    selects as many tasks as its deficit allows. A project with no more task available
+    is dropped from the loop with its deficit cleared, rounds continue until the loop
+    limit is reached or no project is left. Deficit and the position in round are
+    carried to the next loop when the loop limit is reached, so no project is starved
+    by the order of projects.
+    '''
+
+    def __init__(self):
+        self.deficit = dict()
+        # project to start the next loop with, and if its quantum has been credited
+        self.next_project = None
+        self.credited = False
+
+    def weight(self, project):
+        return max(project.task_queue.rate, 1e-3)
+
+    def remove(self, name):
+        self.deficit.pop(name, None)
+
+    def select(self, projects, limit, take):
+        projects = list(projects)
+        if not projects:
+            return 0
+        names = [project.name for project in projects]
+        if self.next_project in names:
+            start = names.index(self.next_project)
+            projects = projects[start:] + projects[:start]
+        else:
+            self.credited = False
+        weights = [self.weight(project) for project in projects]
+        min_weight = min(weights)
+        quantums = [w / min_weight for w in weights]
+
+        cnt = 0
+        first = True
+        while projects and cnt < limit:
+            remains, remain_quantums = [], []
+            for i, project in enumerate(projects):
+                deficit = self.deficit.get(project.name, 0)
+                if not (first and i == 0 and self.credited):
+                    deficit += quantums[i]
+                n = int(deficit)
+                if n < 1:
+                    self.deficit[project.name] = deficit
+                    remains.append(project)
+                    remain_quantums.append(quantums[i])
+                    continue
+
+                want = min(n, limit - cnt)
+                selected = take(project, want)
+                cnt += selected
+                if selected < want:
+                    # no more task available, drop from this loop
+                    self.deficit.pop(project.name, None)
+                else:
+                    self.deficit[project.name] = deficit - selected
+                    remains.append(project)
+                    remain_quantums.append(quantums[i])
+
+                if cnt >= limit:
+                    # continue with this project in next loop if it has deficit left
+                    if self.deficit.get(project.name, 0) >= 1:
+                        self.next_project, self.credited = project.name, True
+                    else:
+                        self.next_project = names[(names.index(project.name) + 1) % len(names)]
+                        self.credited = False
+                    return cnt
+            projects, quantums = remains, remain_quantums
+            first = False
+        self.next_project = None
+        self.credited = False
+        return cnt
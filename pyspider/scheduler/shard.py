@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import bisect
+import hashlib
+import logging
+
+from six import iteritems
+from six.moves import queue as Queue
+
+from pyspider.libs import utils
+
+logger = logging.getLogger('scheduler')
+
+
+def _hash(key):
+    return int(hashlib.md5(utils.utf8(key)).hexdigest()[:16], 16)
+
+
+class Shard(object):
+    '''
+    a slice of projects owned by one of count schedulers
+
+    projects are mapped to shards with a consistent hash ring, each shard has
+    `replicas` points on the ring.
+    '''
+
+    def __init__(self, index, count, replicas=64):
+        if not 0 <= index < count:
+            raise ValueError('shard index %d out of range of %d shards' % (index, count))
+        self.index = index
+        self.count = count
+        self.ring = sorted((_hash('%d-%d' % (i, r)), i)
+                           for i in range(count) for r in range(replicas))
+        self._keys = [key for key, _ in self.ring]
+
+    @classmethod
+    def parse(cls, value):
+        '''shard from "index/count", e.g. 0/3'''
+        index, count = value.split('/')
+        return cls(int(index), int(count))
+
+    def __repr__(self):
+        return '%d/%d' % (self.index, self.count)
+
+    def owner(self, project):
+        '''index of shard owning the project'''
+        if self.count == 1 or project is None:
+            return self.index
+        i = bisect.bisect(self._keys, _hash(project)) % len(self.ring)
+        return self.ring[i][1]
+
+    def owns(self, project):
+        return self.owner(project) == self.index
+
+    @staticmethod
+    def queue_name(name, index):
+        '''name of message queue of a shard'''
+        return '%s_shard%d' % (name, index)
+
+
+class ShardQueue(object):
+    '''
+    input queue of a shard scheduler
+
+    tasks are got from the queue of the shard first, then from the queue shared
+    by all shards. tasks of projects owned by other shards are forwarded to the
+    queues of their shards.
+    '''
+
+    def __init__(self, queue, shard, shard_queues):
+        self.queue = queue
+        self.shard = shard
+        self.shard_queues = shard_queues
+
+    def get_nowait(self):
+        try:
+            return self.shard_queues[self.shard.index].get_nowait()
+        except Queue.Empty:
+            pass
+        while True:
+            task = self.queue.get_nowait()
+            if not isinstance(task, list):
+                owner = self.shard.owner(task.get('project'))
+                if owner == self.shard.index:
+                    return task
+                self.shard_queues[owner].put(task)
+                continue
+            # a batch of tasks is split by owners
+            batches = {}
+            for each in task:
+                batches.setdefault(self.shard.owner(each.get('project')), []).append(each)
+            mine = batches.pop(self.shard.index, None)
+            for owner, batch in iteritems(batches):
+                self.shard_queues[owner].put(batch)
+            if mine:
+                return mine
+
+    def put(self, obj, block=True, timeout=None):
+        return self.queue.put(obj, block=block, timeout=timeout)
+
+    def qsize(self):
+        return self.queue.qsize() + self.shard_queues[self.shard.index].qsize()
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+def _merge(a, b):
+    '''merge dict b into a, numbers in both are summed'''
+    for key, value in iteritems(b):
+        if key not in a:
+            a[key] = value
+        elif isinstance(a[key], dict) and isinstance(value, dict):
+            _merge(a[key], value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            a[key] += value
+        else:
+            a[key] = value
+    return a
+
+
+class ShardedSchedulerRPC(object):
+    '''
+    scheduler rpc of sharded schedulers for webui
+
+    requests of a project are sent to the shard owning it, others are sent to
+    all shards and results are merged. shards not reachable are skipped with an
+    error logged when merging.
+    '''
+
+    def __init__(self, rpcs):
+        self.rpcs = list(rpcs)
+        self.shard = Shard(0, len(self.rpcs))
+
+    def _rpc(self, project):
+        return self.rpcs[self.shard.owner(project)]
+
+    def _fanout(self, method, *args):
+        results = []
+        for i, rpc in enumerate(self.rpcs):
+            try:
+                results.append(getattr(rpc, method)(*args))
+            except Exception as e:
+                logger.error('scheduler shard %d %s error: %r', i, method, e)
+        return results
+
+    def newtask(self, task):
+        return self._rpc(task.get('project')).newtask(task)
+
+    def send_task(self, task):
+        return self._rpc(task.get('project')).send_task(task)
+
+    def _batch(self, method, items, project_of, *args):
+        '''call method of shards with items of their projects, results in order of items'''
+        batches = {}
+        for i, item in enumerate(items):
+            batches.setdefault(self.shard.owner(project_of(item)), []).append(i)
+        result = [None] * len(items)
+        for owner, indexes in iteritems(batches):
+            for i, each in zip(indexes, getattr(self.rpcs[owner], method)(
+                    [items[i] for i in indexes], *args)):
+                result[i] = each
+        return result
+
+    def newtask_batch(self, tasks):
+        return self._batch('newtask_batch', tasks, lambda x: x.get('project'))
+
+    def get_tasks_batch(self, keys, fields=None):
+        return self._batch('get_tasks_batch', keys, lambda x: x[0], fields)
+
+    def update_project(self):
+        self._fanout('update_project')
+
+    def size(self):
+        return sum(self._fanout('size'))
+
+    def counter(self, _time, _type):
+        result = {}
+        for each in self._fanout('counter', _time, _type):
+            if not each:
+                continue
+            if _type == 'sum':
+                _merge(result, each)
+            else:
+                result.update(each)
+        return result
+
+    def get_active_tasks(self, project=None, limit=100):
+        if project:
+            return self._rpc(project).get_active_tasks(project, limit)
+        result = []
+        for each in self._fanout('get_active_tasks', project, limit):
+            result.extend(each)
+        result.sort(key=lambda x: x[0], reverse=True)
+        return result[:limit]
+
+    def get_projects_pause_status(self):
+        result = {}
+        for each in self._fanout('get_projects_pause_status'):
+            result.update(each)
+        return result
+
+    def webui_update(self):
+        result = {'pause_status': {}, 'loading': {}, 'counter': {}}
+        for each in self._fanout('webui_update'):
+            result['pause_status'].update(each.get('pause_status') or {})
+            result['loading'].update(each.get('loading') or {})
+            for key, value in iteritems(each.get('counter') or {}):
+                counter = result['counter'].setdefault(key, {})
+                if key.endswith('_time'):
+                    counter.update(value or {})
+                else:
+                    _merge(counter, value or {})
+        return result
+
+    def _quit(self):
+        self._fanout('_quit')
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import mmap
+import struct
+import logging
+
+from six import iteritems
+
+from pyspider.libs import utils
+
+logger = logging.getLogger('scheduler')
+
+MAGIC = b'PSTQ'
+VERSION = 1
+
+# magic, version, watermark, number of projects
+HEADER = struct.Struct('<4sBdI')
+# length of name, number of tasks, length of task records in bytes
+PROJECT = struct.Struct('<HIQ')
+# length of taskid, priority, exetime, processing, length of host
+TASK = struct.Struct('<Hid?H')
+
+
+def dump(path, watermark, projects):
+    '''
+    write task queues to a snapshot file
+
+    projects is a dict of project name to the list of TaskQueue.dump. tasks in
+    taskdb updated before watermark should be in the queues. the file is written
+    to a temporary file first and renamed to path.
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, watermark, len(projects)))
+        for name, tasks in iteritems(projects):
+            records = bytearray()
+            for taskid, priority, exetime, processing, host in tasks:
+                taskid = utils.utf8(taskid)
+                host = utils.utf8(host or '')
+                records += TASK.pack(len(taskid), int(priority), exetime or 0, processing,
+                                     len(host))
+                records += taskid
+                records += host
+            name = utils.utf8(name)
+            fp.write(PROJECT.pack(len(name), len(tasks), len(records)))
+            fp.write(name)
+            fp.write(records)
+        fp.flush()
+        os.fsync(fp.fileno())
+    if hasattr(os, 'replace'):
+        os.replace(tmp_path, path)
+    else:
+        os.rename(tmp_path, path)
+
+
+class Snapshot(object):
+    '''
+    memory mapped task queue snapshot written by `dump`
+
+    projects are indexed when opened, tasks of a project are decoded when
+    iterated with `tasks`.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = 0
+        self.projects = dict()
+        self._fp = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index()
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, path):
+        '''open snapshot, None if missing or broken'''
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except Exception as e:
+            logger.error('task queue snapshot %s is broken: %r', path, e)
+            return None
+
+    def _index(self):
+        buf = self._mmap
+        magic, version, self.watermark, count = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('unknown snapshot format')
+        offset = HEADER.size
+        for _ in range(count):
+            name_len, task_count, size = PROJECT.unpack_from(buf, offset)
+            offset += PROJECT.size
+            name = utils.text(buf[offset:offset + name_len])
+            offset += name_len
+            if offset + size > len(buf):
+                raise ValueError('snapshot truncated')
+            self.projects[name] = (offset, task_count)
+            offset += size
+
+    def __contains__(self, project):
+        return project in self.projects
+
+    def discard(self, project):
+        '''drop project from snapshot after restored'''
+        self.projects.pop(project, None)
+
+    def tasks(self, project):
+        '''iterator of (taskid, priority, exetime, processing, host) of project'''
+        offset, count = self.projects[project]
+        return self._tasks(offset, count)
+
+    def _tasks(self, offset, count):
+        buf = self._mmap
+        for _ in range(count):
+            taskid_len, priority, exetime, processing, host_len = TASK.unpack_from(buf, offset)
+            offset += TASK.size
+            taskid = utils.text(buf[offset:offset + taskid_len])
+            offset += taskid_len
+            host = utils.text(buf[offset:offset + host_len]) or None
+            offset += host_len
+            yield taskid, priority, exetime, processing, host
+
+    def close(self):
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._fp.close()
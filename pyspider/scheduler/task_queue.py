@@ -18,6 +18,7 @@ except ImportError:
     except ImportError:
         from collections.abc import Mapping as DictMixin
 from .token_bucket import Bucket
+from six import iteritems, itervalues
 from six.moves import queue as Queue
 
 logger = logging.getLogger('scheduler')
@@ -42,18 +43,19 @@ class AtomInt(object):
 
 
 class InQueueTask(DictMixin):
-    __slots__ = ('taskid', 'priority', 'exetime', 'sequence')
+    __slots__ = ('taskid', 'priority', 'exetime', 'sequence', 'host')
     __getitem__ = lambda *x: getattr(*x)
     __setitem__ = lambda *x: setattr(*x)
     __iter__ = lambda self: iter(self.__slots__)
     __len__ = lambda self: len(self.__slots__)
     keys = lambda self: self.__slots__
 
-    def __init__(self, taskid, priority=0, exetime=0):
+    def __init__(self, taskid, priority=0, exetime=0, host=None):
         self.taskid = taskid
         self.priority = priority
         self.exetime = exetime
         self.sequence = AtomInt.get_value()
+        self.host = host
 
     def __cmp__(self, other):
         if self.exetime == 0 and other.exetime == 0:
@@ -66,7 +68,13 @@ class InQueueTask(DictMixin):
         return diff if diff != 0 else cmp(self.sequence, other.sequence)
 
     def __lt__(self, other):
-        return self.__cmp__(other) < 0
+        # same order as __cmp__, inlined as it's the hot path of heap operations
+        if self.exetime == 0 and other.exetime == 0:
+            if self.priority != other.priority:
+                return self.priority > other.priority
+        elif self.exetime != other.exetime:
+            return self.exetime < other.exetime
+        return self.sequence < other.sequence
 
 
 class PriorityTaskQueue(Queue.Queue):
@@ -74,48 +82,483 @@ class PriorityTaskQueue(Queue.Queue):
     TaskQueue
 
     Same taskid items will been merged
+
+    It's an indexed binary heap, queue_index maps taskid to its position in queue,
+    so a task can be re-prioritized or deleted in O(log n) without a full heapify.
     '''
 
     def _init(self, maxsize):
         self.queue = []
         self.queue_dict = dict()
+        self.queue_index = dict()
 
     def _qsize(self, len=len):
         return len(self.queue_dict)
 
-    def _put(self, item, heappush=heapq.heappush):
+    def _put(self, item):
         if item.taskid in self.queue_dict:
             task = self.queue_dict[item.taskid]
-            changed = False
-            if item < task:
-                changed = True
-            task.priority = max(item.priority, task.priority)
-            task.exetime = min(item.exetime, task.exetime)
-            if changed:
-                self._resort()
+            priority = max(item.priority, task.priority)
+            exetime = min(item.exetime, task.exetime)
+            if priority != task.priority or exetime != task.exetime:
+                task.priority = priority
+                task.exetime = exetime
+                self._resort(self.queue_index[task.taskid])
         else:
-            heappush(self.queue, item)
+            self.queue.append(item)
             self.queue_dict[item.taskid] = item
+            self._sift_up(len(self.queue) - 1)
 
-    def _get(self, heappop=heapq.heappop):
-        while self.queue:
-            item = heappop(self.queue)
-            if item.taskid is None:
-                continue
-            self.queue_dict.pop(item.taskid, None)
-            return item
+    def _get(self):
+        if self.queue:
+            return self._remove(0)
         return None
 
     @property
     def top(self):
-        while self.queue and self.queue[0].taskid is None:
-            heapq.heappop(self.queue)
         if self.queue:
             return self.queue[0]
         return None
 
-    def _resort(self):
-        heapq.heapify(self.queue)
+    def _sift_up(self, pos):
+        '''move item at pos towards the root until heap invariant holds'''
+        queue, queue_index = self.queue, self.queue_index
+        item = queue[pos]
+        while pos > 0:
+            parent_pos = (pos - 1) >> 1
+            parent = queue[parent_pos]
+            if not item < parent:
+                break
+            queue[pos] = parent
+            queue_index[parent.taskid] = pos
+            pos = parent_pos
+        queue[pos] = item
+        queue_index[item.taskid] = pos
+        return pos
+
+    def _sift_down(self, pos):
+        '''move item at pos towards the leaves until heap invariant holds'''
+        # like heapq, walk the smaller child down to a leaf and bubble up from
+        # there, which takes about half the comparisons of a textbook sift down
+        queue, queue_index = self.queue, self.queue_index
+        end = len(queue)
+        start_pos = pos
+        item = queue[pos]
+        child_pos = 2 * pos + 1
+        while child_pos < end:
+            right_pos = child_pos + 1
+            if right_pos < end and not queue[child_pos] < queue[right_pos]:
+                child_pos = right_pos
+            child = queue[child_pos]
+            queue[pos] = child
+            queue_index[child.taskid] = pos
+            pos = child_pos
+            child_pos = 2 * pos + 1
+        while pos > start_pos:
+            parent_pos = (pos - 1) >> 1
+            parent = queue[parent_pos]
+            if not item < parent:
+                break
+            queue[pos] = parent
+            queue_index[parent.taskid] = pos
+            pos = parent_pos
+        queue[pos] = item
+        queue_index[item.taskid] = pos
+        return pos
+
+    def _resort(self, pos):
+        if self._sift_up(pos) == pos:
+            self._sift_down(pos)
+
+    def _remove(self, pos):
+        queue = self.queue
+        item = queue[pos]
+        last = queue.pop()
+        if last is not item:
+            queue[pos] = last
+            self.queue_index[last.taskid] = pos
+            self._resort(pos)
+        del self.queue_index[item.taskid]
+        del self.queue_dict[item.taskid]
+        return item
+
+    def __contains__(self, taskid):
+        return taskid in self.queue_dict
+
+    def __getitem__(self, taskid):
+        return self.queue_dict[taskid]
+
+    def __setitem__(self, taskid, item):
+        assert item.taskid == taskid
+        self.put(item)
+
+    def __delitem__(self, taskid):
+        self._remove(self.queue_index[taskid])
+
+
+class HostQueue(PriorityTaskQueue):
+    '''PriorityTaskQueue of one host, without the locks of Queue, use _put / _get / _qsize'''
+
+    def __init__(self):
+        self._init(0)
+
+
+class HostPriorityQueue(object):
+    '''
+    priority queue of ready tasks with per-host politeness
+
+    tasks are kept in a HostQueue per host. a host is ready when its token bucket
+    (rate / burst) has a token and less than `concurrency` of its tasks are processing.
+    ready hosts are indexed by their top task in a PriorityTaskQueue, hosts waiting
+    for tokens are kept in a heap by the time they have a token again, and hosts
+    reached concurrency limit are scheduled again when a task of them released.
+    state of a host without tasks is dropped when its bucket is full again.
+
+    It's not thread safe, guarded by the mutex of TaskQueue.
+    '''
+
+    def __init__(self, rate=0, burst=0, concurrency=0):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.host_queues = dict()
+        self.task_host = dict()
+        # host -> [tokens, last update time, processing tasks]
+        self.host_state = dict()
+        self.ready = PriorityTaskQueue()
+        self.waiting = []
+        self.waiting_time = dict()
+        # heap of (time bucket is full, host) of hosts without tasks
+        self.idle = []
+
+    def qsize(self):
+        return len(self.task_host)
+
+    @property
+    def queue(self):
+        '''all tasks in queue'''
+        result = []
+        for queue in itervalues(self.host_queues):
+            result.extend(queue.queue)
+        return result
+
+    def _state(self, host, now):
+        state = self.host_state.get(host)
+        if state is None:
+            state = self.host_state[host] = [max(self.burst, 1), now, 0]
+        elif self.rate > 0:
+            state[0] = min(max(self.burst, 1), state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+        return state
+
+    def _schedule(self, host, now):
+        '''place host in ready index or waiting heap by its state'''
+        if host in self.ready:
+            del self.ready[host]
+        self.waiting_time.pop(host, None)
+
+        queue = self.host_queues.get(host)
+        state = self._state(host, now)
+        if not queue or not queue._qsize():
+            self.host_queues.pop(host, None)
+            if state[2]:
+                return
+            if self.rate <= 0 or state[0] >= max(self.burst, 1):
+                del self.host_state[host]
+            else:
+                heapq.heappush(self.idle, (now + (max(self.burst, 1) - state[0]) / self.rate, host))
+            return
+        # tasks without host (e.g. data: urls) are not limited
+        if host is not None and self.concurrency > 0 and state[2] >= self.concurrency:
+            return
+        if host is not None and self.rate > 0 and state[0] < 1:
+            ready_time = now + (1 - state[0]) / self.rate
+            self.waiting_time[host] = ready_time
+            heapq.heappush(self.waiting, (ready_time, host))
+            return
+        top = queue.top
+        entry = InQueueTask(host, top.priority, top.exetime)
+        entry.sequence = top.sequence
+        self.ready.put(entry)
+
+    def _expire_idle(self, now):
+        '''drop state of hosts without tasks, whose bucket is full again'''
+        while self.idle and self.idle[0][0] <= now:
+            _, host = heapq.heappop(self.idle)
+            if host in self.host_queues:
+                continue
+            state = self.host_state.get(host)
+            if state and not state[2] and self._state(host, now)[0] >= max(self.burst, 1):
+                del self.host_state[host]
+
+    def put(self, task):
+        host = task.host
+        if task.taskid in self.task_host:
+            host = self.task_host[task.taskid]
+        queue = self.host_queues.get(host)
+        if queue is None:
+            queue = self.host_queues[host] = HostQueue()
+        queue._put(task)
+        self.task_host[task.taskid] = host
+        if host not in self.waiting_time:
+            self._schedule(host, time.time())
+
+    def get_nowait(self):
+        now = time.time()
+        self._expire_idle(now)
+        while self.waiting and self.waiting[0][0] <= now:
+            ready_time, host = heapq.heappop(self.waiting)
+            if self.waiting_time.get(host) == ready_time:
+                self._schedule(host, now)
+        if not self.ready.qsize():
+            raise Queue.Empty
+        host = self.ready.get_nowait().taskid
+        task = self.host_queues[host]._get()
+        del self.task_host[task.taskid]
+        state = self._state(host, now)
+        if self.rate > 0:
+            state[0] -= 1
+        state[2] += 1
+        self._schedule(host, now)
+        return task
+
+    def next_time(self):
+        '''time when a host is ready, None if all hosts reached concurrency limit'''
+        if self.ready.qsize():
+            return time.time()
+        if self.waiting:
+            return self.waiting[0][0]
+        return None
+
+    def acquire(self, host):
+        '''count a processing task of host'''
+        self._state(host, time.time())[2] += 1
+
+    def release(self, host):
+        '''a processing task of host is done or timeout'''
+        state = self.host_state.get(host)
+        if not state or not state[2]:
+            return
+        state[2] -= 1
+        if host not in self.ready and host not in self.waiting_time:
+            self._schedule(host, time.time())
+
+    def __contains__(self, taskid):
+        return taskid in self.task_host
+
+    def __getitem__(self, taskid):
+        return self.host_queues[self.task_host[taskid]][taskid]
+
+    def __delitem__(self, taskid):
+        host = self.task_host.pop(taskid)
+        del self.host_queues[host][taskid]
+        if host not in self.waiting_time:
+            self._schedule(host, time.time())
+
+
+class TimingWheel(object):
+    '''
+    Hierarchical timing wheel of delayed tasks
+
+    Same taskid items will been merged
+
+    LEVELS are (granularity in seconds, number of slots), a task is put into the slot
+    of the lowest level covering its exetime in O(1). Slots of higher levels are moved
+    to lower levels when the wheel turns to them, `expire` pops tasks in amortized O(1).
+    Tasks later than the highest level are parked aside, and placed when the highest
+    level turns to a slot covering them.
+    '''
+    LEVELS = ((1, 60), (60, 60), (60 * 60, 24), (24 * 60 * 60, 366))
+
+    def __init__(self, now=None):
+        # all seconds before current are expired
+        self.current = int(time.time() if now is None else now)
+        self.wheels = [dict() for _ in self.LEVELS]
+        self.counts = [0] * len(self.LEVELS)
+        self.queue_dict = dict()
+        self.queue_slot = dict()
+        # tasks later than the highest level
+        self.parked = dict()
+        self.parked_turn = self.current // self.LEVELS[-1][0]
+
+    def qsize(self):
+        return len(self.queue_dict)
+
+    def empty(self):
+        return not self.queue_dict
+
+    def _place(self, task):
+        tick = max(int(task.exetime), self.current)
+        for level, (granularity, size) in enumerate(self.LEVELS):
+            bucket = tick // granularity
+            start = self.current // granularity
+            if bucket - start < size:
+                break
+        else:
+            self.parked[task.taskid] = task
+            self.queue_slot[task.taskid] = (None, None)
+            return
+        slot = bucket % size
+        wheel = self.wheels[level]
+        if slot not in wheel:
+            wheel[slot] = dict()
+        wheel[slot][task.taskid] = task
+        self.queue_slot[task.taskid] = (level, slot)
+        self.counts[level] += 1
+
+    def _unplace(self, taskid):
+        level, slot = self.queue_slot.pop(taskid)
+        if level is None:
+            return self.parked.pop(taskid)
+        wheel = self.wheels[level]
+        task = wheel[slot].pop(taskid)
+        if not wheel[slot]:
+            del wheel[slot]
+        self.counts[level] -= 1
+        return task
+
+    def _cascade(self):
+        '''re-place tasks of the higher level slots starting at current second'''
+        for level in range(len(self.LEVELS) - 1, 0, -1):
+            granularity, size = self.LEVELS[level]
+            if self.current % granularity:
+                continue
+            slot = self.wheels[level].pop(self.current // granularity % size, None)
+            if not slot:
+                continue
+            self.counts[level] -= len(slot)
+            for task in itervalues(slot):
+                self._place(task)
+        self._unpark()
+
+    def _unpark(self):
+        '''place parked tasks covered by the highest level after it turned'''
+        granularity, size = self.LEVELS[-1]
+        turn = self.current // granularity
+        if not self.parked or turn == self.parked_turn:
+            self.parked_turn = turn
+            return
+        self.parked_turn = turn
+        end = (turn + size) * granularity
+        for task in [task for task in itervalues(self.parked) if task.exetime < end]:
+            del self.parked[task.taskid]
+            self._place(task)
+
+    def put(self, task):
+        if task.taskid in self.queue_dict:
+            old = self.queue_dict[task.taskid]
+            old.priority = max(task.priority, old.priority)
+            if task.exetime < old.exetime:
+                self._unplace(old.taskid)
+                old.exetime = task.exetime
+                self._place(old)
+        else:
+            self.queue_dict[task.taskid] = task
+            self._place(task)
+
+    def expire(self, now=None):
+        '''pop and return tasks with exetime < now'''
+        if now is None:
+            now = time.time()
+        target = int(now)
+        size = self.LEVELS[0][1]
+        wheel = self.wheels[0]
+        result = []
+        while self.current < target:
+            # expire seconds until the next turn of level 1, only non-empty slots are visited
+            end = min(target, (self.current // size + 1) * size)
+            if end - self.current > len(wheel):
+                slots = [x for x in list(wheel) if (x - self.current) % size < end - self.current]
+            else:
+                slots = [x % size for x in range(self.current, end)]
+            for slot in slots:
+                slot = wheel.pop(slot, None)
+                if not slot:
+                    continue
+                self.counts[0] -= len(slot)
+                for taskid, task in iteritems(slot):
+                    del self.queue_slot[taskid]
+                    del self.queue_dict[taskid]
+                    result.append(task)
+            self.current = end
+            self._cascade()
+
+            # skip turns of empty levels
+            next_tick = self.current
+            for level, count in enumerate(self.counts):
+                if count:
+                    break
+                if level + 1 < len(self.LEVELS):
+                    granularity = self.LEVELS[level + 1][0]
+                    next_tick = (self.current // granularity + 1) * granularity
+                else:
+                    next_tick = target
+            if next_tick > self.current:
+                self.current = min(next_tick, target)
+                self._cascade()
+
+        slot = wheel.get(self.current % size)
+        if slot:
+            for taskid in [k for k, v in iteritems(slot) if v.exetime < now]:
+                result.append(self._unplace(taskid))
+                del self.queue_dict[taskid]
+        return result
+
+    @property
+    def top(self):
+        '''task with the earliest exetime'''
+        result = None
+        for level, (granularity, size) in enumerate(self.LEVELS):
+            if not self.counts[level]:
+                continue
+            wheel = self.wheels[level]
+            start = self.current // granularity
+            for i in range(size):
+                slot = wheel.get((start + i) % size)
+                if slot:
+                    task = min(itervalues(slot))
+                    if result is None or task < result:
+                        result = task
+                    break
+        # parked tasks are later than any task in the wheels
+        if result is None and self.parked:
+            result = min(itervalues(self.parked))
+        return result
+
+    def next_time(self):
+        '''
+        lower bound of the earliest exetime, None if empty
+
+        exact for tasks in current slots, start time of the slot otherwise
+        '''
+        result = None
+        for level, (granularity, size) in enumerate(self.LEVELS):
+            if not self.counts[level]:
+                continue
+            wheel = self.wheels[level]
+            start = self.current // granularity
+            for i in range(size):
+                slot = wheel.get((start + i) % size)
+                if slot:
+                    if i == 0:
+                        exetime = min(task.exetime for task in itervalues(slot))
+                    else:
+                        exetime = (start + i) * granularity
+                    if result is None or exetime < result:
+                        result = exetime
+                    break
+        if result is None and self.parked:
+            result = min(task.exetime for task in itervalues(self.parked))
+        return result
+
+    def get_nowait(self):
+        task = self.top
+        if task is None:
+            raise Queue.Empty
+        del self[task.taskid]
+        return task
+
+    get = get_nowait
 
     def __contains__(self, taskid):
         return taskid in self.queue_dict
@@ -128,20 +571,25 @@ class PriorityTaskQueue(Queue.Queue):
         self.put(item)
 
     def __delitem__(self, taskid):
-        self.queue_dict.pop(taskid).taskid = None
+        self._unplace(taskid)
+        del self.queue_dict[taskid]
 
 
 class TaskQueue(object):
     '''
     task queue for scheduler, have a priority queue and a time queue for delayed tasks
+
+    delayed tasks and processing timeouts are tracked by timing wheels
     '''
     processing_timeout = 10 * 60
 
     def __init__(self, rate=0, burst=0):
         self.mutex = threading.RLock()
         self.priority_queue = PriorityTaskQueue()
-        self.time_queue = PriorityTaskQueue()
-        self.processing = PriorityTaskQueue()
+        # host -> [host, number of tasks in queue], to share the host strings of tasks
+        self.hosts = dict()
+        self.time_queue = TimingWheel()
+        self.processing = TimingWheel()
         self.bucket = Bucket(rate=rate, burst=burst)
 
     @property
@@ -160,6 +608,67 @@ class TaskQueue(object):
     def burst(self, value):
         self.bucket.burst = value
 
+    def set_host_limits(self, rate=0, burst=0, concurrency=0):
+        '''
+        set per-host rate / burst and concurrency limit, 0 for unlimited
+
+        tasks of each host are queued separately when any limit is set.
+        '''
+        self.mutex.acquire()
+        old = self.priority_queue
+        if not rate and not concurrency:
+            if isinstance(old, HostPriorityQueue):
+                self.priority_queue = PriorityTaskQueue()
+                for task in old.queue:
+                    self.priority_queue.put(task)
+        elif isinstance(old, HostPriorityQueue):
+            old.rate, old.burst, old.concurrency = rate, burst, concurrency
+        else:
+            self.priority_queue = HostPriorityQueue(rate, burst, concurrency)
+            for task in self.processing.queue_dict.values():
+                self.priority_queue.acquire(task.host)
+            for task in old.queue:
+                self.priority_queue.put(task)
+        self.mutex.release()
+
+    def next_time(self):
+        '''
+        time when a task may be got from queue next time, None if no task would be
+        available without new tasks put or done
+        '''
+        times = [self.time_queue.next_time(), self.processing.next_time()]
+        if self.priority_queue.qsize():
+            ready_time = self.bucket.next_time()
+            if ready_time is not None and isinstance(self.priority_queue, HostPriorityQueue):
+                host_time = self.priority_queue.next_time()
+                ready_time = None if host_time is None else max(ready_time, host_time)
+            times.append(ready_time)
+        times = [x for x in times if x is not None]
+        return min(times) if times else None
+
+    def _release(self, task):
+        if isinstance(self.priority_queue, HostPriorityQueue):
+            self.priority_queue.release(task.host)
+
+    def _ref_host(self, host):
+        '''shared string of host counted for a new task'''
+        if host is None:
+            return None
+        entry = self.hosts.get(host)
+        if entry is None:
+            entry = self.hosts[host] = [host, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _unref_host(self, host):
+        '''a task of host left the queue, host is removed with its last task'''
+        entry = self.hosts.get(host)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self.hosts[host]
+
     def check_update(self):
         '''
         Check time queue and processing queue
@@ -172,8 +681,7 @@ class TaskQueue(object):
     def _check_time_queue(self):
         now = time.time()
         self.mutex.acquire()
-        while self.time_queue.qsize() and self.time_queue.top and self.time_queue.top.exetime < now:
-            task = self.time_queue.get_nowait()  # type: InQueueTask
+        for task in self.time_queue.expire(now):  # type: InQueueTask
             task.exetime = 0
             self.priority_queue.put(task)
         self.mutex.release()
@@ -181,18 +689,16 @@ class TaskQueue(object):
     def _check_processing(self):
         now = time.time()
         self.mutex.acquire()
-        while self.processing.qsize() and self.processing.top and self.processing.top.exetime < now:
-            task = self.processing.get_nowait()
-            if task.taskid is None:
-                continue
+        for task in self.processing.expire(now):
             task.exetime = 0
+            self._release(task)
             self.priority_queue.put(task)
             logger.info("processing: retry %s", task.taskid)
         self.mutex.release()
 
-    def put(self, taskid, priority=0, exetime=0):
+    def put(self, taskid, priority=0, exetime=0, host=None):
         """
-        Put a task into task queue
+        Put a task into task queue, host of the task is used by per-host limits
 
         when use heap sort, if we put tasks(with the same priority and exetime=0) into queue,
         the queue is not a strict FIFO queue, but more like a FILO stack.
@@ -207,18 +713,18 @@ class TaskQueue(object):
         """
         now = time.time()
 
-        task = InQueueTask(taskid, priority, exetime)
-
         self.mutex.acquire()
+        task = InQueueTask(taskid, priority, exetime, host)
         if taskid in self.priority_queue:
             self.priority_queue.put(task)
         elif taskid in self.time_queue:
             self.time_queue.put(task)
-        elif taskid in self.processing and self.processing[taskid].taskid:
+        elif taskid in self.processing:
             # force update a processing task is not allowed as there are so many
             # problems may happen
             pass
         else:
+            task.host = self._ref_host(host)
             if exetime and exetime > now:
                 self.time_queue.put(task)
             else:
@@ -249,6 +755,9 @@ class TaskQueue(object):
         if taskid in self.processing:
             self.mutex.acquire()
             if taskid in self.processing:
+                task = self.processing[taskid]
+                self._release(task)
+                self._unref_host(task.host)
                 del self.processing[taskid]
             self.mutex.release()
             return True
@@ -259,16 +768,46 @@ class TaskQueue(object):
             return False
         if taskid in self.priority_queue:
             self.mutex.acquire()
+            self._unref_host(self.priority_queue[taskid].host)
             del self.priority_queue[taskid]
             self.mutex.release()
         elif taskid in self.time_queue:
             self.mutex.acquire()
+            self._unref_host(self.time_queue[taskid].host)
             del self.time_queue[taskid]
             self.mutex.release()
         elif taskid in self.processing:
             self.done(taskid)
         return True
 
+    def dump(self):
+        '''
+        list (taskid, priority, exetime, processing, host) of tasks in queue
+
+        exetime of a processing task is the time it timeouts, tasks are listed in
+        the order they entered the queue.
+        '''
+        self.mutex.acquire()
+        tasks = [(task, False) for task in self.priority_queue.queue]
+        tasks.extend((task, False) for task in self.time_queue.queue_dict.values())
+        tasks.extend((task, True) for task in self.processing.queue_dict.values())
+        self.mutex.release()
+        tasks.sort(key=lambda x: x[0].sequence)
+        return [(task.taskid, task.priority, task.exetime, processing, task.host)
+                for task, processing in tasks]
+
+    def load(self, taskid, priority=0, exetime=0, processing=False, host=None):
+        '''put a task listed by `dump` back into queue'''
+        if not processing:
+            return self.put(taskid, priority, exetime, host)
+        self.mutex.acquire()
+        if taskid not in self:
+            host = self._ref_host(host)
+            self.processing.put(InQueueTask(taskid, priority, exetime, host))
+            if isinstance(self.priority_queue, HostPriorityQueue):
+                self.priority_queue.acquire(host)
+        self.mutex.release()
+
     def size(self):
         return self.priority_queue.qsize() + self.time_queue.qsize() + self.processing.qsize()
 
@@ -276,17 +815,14 @@ class TaskQueue(object):
         '''
         return True if taskid is in processing
         '''
-        return taskid in self.processing and self.processing[taskid].taskid
+        return taskid in self.processing
 
     def __len__(self):
         return self.size()
 
     def __contains__(self, taskid):
-        if taskid in self.priority_queue or taskid in self.time_queue:
-            return True
-        if taskid in self.processing and self.processing[taskid].taskid:
-            return True
-        return False
+        return (taskid in self.priority_queue or taskid in self.time_queue
+                or taskid in self.processing)
 
 
 if __name__ == '__main__':
@@ -46,6 +46,15 @@ class Bucket(object):
         self.mutex.release()
         return self.bucket
 
+    def next_time(self):
+        '''Time when there is a token in bucket, None if never'''
+        if self.bucket >= 1:
+            return self.last_update
+        if self.rate <= 0:
+            return None
+        # tokens are only added when more than one is accumulated
+        return self.last_update + max(1, 1 - self.bucket) / self.rate + 1e-3
+
     def set(self, value):
         '''Set number of tokens in bucket'''
         self.bucket = value
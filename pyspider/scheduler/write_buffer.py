@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import copy
+import time
+import logging
+import threading
+
+from six import iteritems
+
+logger = logging.getLogger('scheduler')
+
+
+class WriteBuffer(object):
+    '''
+    write-behind buffer of task updates
+
+    updates of the same (project, taskid) are merged in memory and written with
+    taskdb.update_many when flushed. updates not written yet should be applied
+    to tasks loaded from taskdb with `merge`.
+
+    a failed flush is logged and retried after retry_interval, doubled on each
+    failure up to max_retry_interval.
+    '''
+
+    def __init__(self, retry_interval=1.0, max_retry_interval=60.0):
+        self.mutex = threading.RLock()
+        self.flush_mutex = threading.Lock()
+        self.pending = dict()
+        self.flushing = dict()
+        self.last_flush = time.time()
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.failures = 0
+        self.retry_time = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, project, taskid, obj):
+        '''buffer an update of task'''
+        # task dicts are modified after updated (e.g. trimmed by get_active_tasks)
+        obj = copy.deepcopy(obj)
+        key = (project, taskid)
+        with self.mutex:
+            if key in self.pending:
+                self.pending[key].update(obj)
+            else:
+                self.pending[key] = obj
+
+    def get(self, project, taskid):
+        '''get the updates of task not in taskdb yet, None if nothing buffered'''
+        key = (project, taskid)
+        with self.mutex:
+            if key not in self.pending and key not in self.flushing:
+                return None
+            obj = dict(self.flushing.get(key, {}))
+            obj.update(self.pending.get(key, {}))
+            return copy.deepcopy(obj)
+
+    def merge(self, project, task, fields=None):
+        '''apply buffered updates to a task loaded from taskdb'''
+        if not task or not (self.pending or self.flushing):
+            return task
+        obj = self.get(project, task['taskid'])
+        if obj:
+            for key, value in iteritems(obj):
+                if fields and key not in fields:
+                    continue
+                task[key] = value
+        return task
+
+    def discard(self, project):
+        '''drop buffered updates of project'''
+        with self.mutex:
+            for key in [x for x in self.pending if x[0] == project]:
+                del self.pending[key]
+
+    def flush(self, taskdb, force=False):
+        '''
+        write buffered updates to taskdb, return number of tasks written
+
+        it's skipped until retry_time after a failure, unless force.
+        '''
+        with self.flush_mutex:
+            if not force and time.time() < self.retry_time:
+                return 0
+            with self.mutex:
+                self.flushing, self.pending = self.pending, dict()
+                self.last_flush = time.time()
+            if not self.flushing:
+                return 0
+
+            projects = dict()
+            for (project, taskid), obj in iteritems(self.flushing):
+                obj = dict(obj)
+                obj['taskid'] = taskid
+                projects.setdefault(project, []).append(obj)
+
+            try:
+                for project, objs in iteritems(projects):
+                    taskdb.update_many(project, objs)
+            except Exception as e:
+                # put them back under newer updates, retry with next flush
+                with self.mutex:
+                    for key, obj in iteritems(self.flushing):
+                        obj.update(self.pending.get(key, {}))
+                        self.pending[key] = obj
+                    self.flushing = dict()
+                self.failures += 1
+                delay = min(self.retry_interval * 2 ** (self.failures - 1),
+                            self.max_retry_interval)
+                self.retry_time = time.time() + delay
+                logger.error('flush %d task updates failed, retry in %.1fs: %r',
+                             len(self.pending), delay, e)
+                return 0
+
+            with self.mutex:
+                cnt = len(self.flushing)
+                self.flushing = dict()
+            self.failures = 0
+            self.retry_time = 0
+            logger.debug('flushed %d task updates', cnt)
+            return cnt
@@ -5,9 +5,15 @@
 #         http://binux.me
 # Created on 2015-04-05 00:05:58
 
+import os
 import sys
 import time
+import shutil
+import tempfile
 import unittest
+from collections import deque
+
+from six.moves import cPickle
 
 from pyspider.libs import counter
 
@@ -52,3 +58,154 @@ class TestCounter(unittest.TestCase):
 
         self.assertNotIn('a', c)
         self.assertIsNotNone(c['b'])
+
+    def test_040_prefix_index(self):
+        c = counter.CounterManager(counter.TotalCounter)
+        c.event(('a', 'b'), 1)
+        c.event(('a', 'c', 'd'), 2)
+        c.event(('e', ), 3)
+        c.value(('a', ), 4)
+
+        self.assertEqual(c.keys(), set(['a', 'e']))
+        self.assertEqual(len(c), 2)
+        self.assertIn('a', c)
+        self.assertNotIn('b', c)
+        self.assertRaises(KeyError, lambda: c['b'])
+        self.assertEqual(c['e'].sum, 3)
+        self.assertEqual(c['a'].keys(), set(['b', 'c', '__value__']))
+        self.assertEqual(c['a']['__value__'].sum, 4)
+        self.assertEqual(c['a']['c']['d'].sum, 2)
+        self.assertIn('b', c['a'])
+        self.assertEqual(c['a'].to_dict('sum'), {'b': 1, 'c': {'d': 2}, '__value__': 4})
+
+        c.value(('a', 'b'), 0)
+        c.trim()
+        self.assertEqual(c['a'].keys(), set(['c', '__value__']))
+        c.value(('a', 'c', 'd'), 0)
+        c.trim()
+        self.assertEqual(c['a'].sum, 4)
+        del c['a']
+        self.assertEqual(list(c.counters), [('e', )])
+        self.assertNotIn('a', c)
+
+    def test_050_dump_load(self):
+        path = os.path.join(tempfile.mkdtemp(), 'counter')
+        c = counter.CounterManager(counter.TotalCounter)
+        c.event(('a', 'b'), 1)
+        c.event(('a', 'c'), 2)
+        self.assertTrue(c.dump(path))
+        # file is the pickled dict of counters
+        with open(path, 'rb') as fp:
+            self.assertEqual(sorted(cPickle.load(fp)), [('a', 'b'), ('a', 'c')])
+
+        c2 = counter.CounterManager(counter.TotalCounter)
+        self.assertTrue(c2.load(path))
+        self.assertEqual(c2['a'].to_dict('sum'), {'b': 1, 'c': 2})
+        shutil.rmtree(os.path.dirname(path))
+
+    def test_060_CounterGroup(self):
+        managers = [counter.CounterManager(counter.TotalCounter) for _ in range(3)]
+        group = counter.CounterGroup(*managers)
+        group.event(('a', 'b'), 2).event(('a', 'b'), 1)
+        for manager in managers:
+            self.assertEqual(manager['a']['b'].sum, 3)
+
+        # removed counters are created again
+        del managers[1]['a']
+        group.event(('a', 'b'), 1)
+        self.assertEqual([m['a']['b'].sum for m in managers], [4, 1, 4])
+
+    def test_070_ring_window(self):
+        now = [1000.0]
+
+        class Clock(object):
+            def time(self):
+                return now[0]
+
+        real_time, counter.time = counter.time, Clock()
+        try:
+            c = counter.TimebaseAverageEventCounter(3, 10)
+            for i in range(10):
+                c.event(i)
+                c.event(i)
+                now[0] += 11
+            # the last window is still open
+            now[0] -= 11
+            self.assertEqual(c.sum, (7 + 8 + 9) * 2)
+            self.assertEqual(c.avg, 8)
+            now[0] += 100
+            self.assertEqual(c.sum, 0)
+            self.assertTrue(c.empty())
+
+            c = counter.TimebaseAverageWindowCounter(3, 10)
+            c.event(1)
+            now[0] += 11
+            c.event(2)
+            manager = counter.CounterManager()
+            manager.counters[('a', )] = c
+            manager._rebuild_index()
+            self.assertEqual(manager.to_dict('sum'), {'a': 3})
+            now[0] += 100
+            self.assertEqual(manager.to_dict('sum'), {})
+            self.assertNotIn('a', manager)
+        finally:
+            counter.time = real_time
+
+    def test_080_load_deque_windows(self):
+        c = counter.TimebaseAverageEventCounter.__new__(counter.TimebaseAverageEventCounter)
+        now = time.time()
+        c.__setstate__({
+            'max_window_size': 3, 'window_size': 3, 'window_interval': 10,
+            'values': deque([1, 2], maxlen=3), 'events': deque([1, 2], maxlen=3),
+            'times': deque([now - 20, now - 10], maxlen=3),
+            'cache_value': 3, 'cache_event': 3, 'cache_start': now, '_first_data_time': now - 20,
+        })
+        self.assertEqual(c.sum, 6)
+        self.assertEqual(c.avg, 1)
+        c.event(1)
+        self.assertEqual(c.sum, 7)
+
+    def test_090_journal(self):
+        path = os.path.join(tempfile.mkdtemp(), 'counter.journal')
+        c = counter.CounterManager(lambda: counter.TimebaseAverageEventCounter(30, 10))
+        t = counter.CounterManager(counter.TotalCounter)
+        journal, t_journal = counter.CounterJournal(c, path), counter.CounterJournal(t, path + '2')
+        self.assertFalse(journal.load())
+        for i in range(10):
+            c.event(('a', 'b%d' % i), i)
+        t.event(('a', 'b'), 3)
+        self.assertTrue(journal.write())
+        self.assertTrue(t_journal.write())
+        size = os.path.getsize(path)
+
+        # only changed counters are appended
+        c.event(('a', 'b1'), 3)
+        self.assertTrue(journal.write())
+        self.assertLess(os.path.getsize(path) - size, size / 5)
+        del c['a']
+        c.event(('d', ), 1)
+        t.value(('a', 'b'), 5)
+        journal.write()
+        t_journal.write()
+
+        c2 = counter.CounterManager(lambda: counter.TimebaseAverageEventCounter(30, 10))
+        t2 = counter.CounterManager(counter.TotalCounter)
+        self.assertTrue(counter.CounterJournal(c2, path).load())
+        self.assertTrue(counter.CounterJournal(t2, path + '2').load())
+        self.assertEqual(c2.to_dict('sum'), {'d': 1})
+        self.assertEqual(t2.to_dict('sum'), {'a': {'b': 5}})
+
+        # broken batch at the end is dropped
+        with open(path, 'ab') as fp:
+            fp.write(b'\x10\x00\x00\x00broken')
+        c3 = counter.CounterManager(lambda: counter.TimebaseAverageEventCounter(30, 10))
+        journal = counter.CounterJournal(c3, path)
+        self.assertTrue(journal.load())
+        self.assertEqual(c3.to_dict('sum'), {'d': 1})
+        c3.event(('d', ), 1)
+        self.assertTrue(journal.compact())
+        journal.close()
+        c4 = counter.CounterManager(lambda: counter.TimebaseAverageEventCounter(30, 10))
+        self.assertTrue(counter.CounterJournal(c4, path).load())
+        self.assertEqual(c4.to_dict('sum'), {'d': 2})
+        shutil.rmtree(os.path.dirname(path))
@@ -101,6 +101,20 @@ class TaskDBCase(object):
         self.assertIn('track', task)
         self.assertNotIn('project', task)
 
+    def test_26_get_tasks(self):
+        tasks = list(self.taskdb.get_tasks('project', ['taskid', 'taskid1', 'taskid2']))
+        self.assertEqual(sorted(x['taskid'] for x in tasks), ['taskid', 'taskid2'])
+        for task in tasks:
+            self.assertEqual(task['schedule'], self.sample_task['schedule'])
+
+        tasks = list(self.taskdb.get_tasks('project', ['taskid2', ], fields=['taskid', 'url']))
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(tasks[0]['url'], self.sample_task['url'])
+        self.assertNotIn('track', tasks[0])
+
+        self.assertEqual(list(self.taskdb.get_tasks('project', [])), [])
+        self.assertEqual(list(self.taskdb.get_tasks('abc', ['taskid', ])), [])
+
     def test_30_status_count(self):
         status = self.taskdb.status_count('abc')
         self.assertEqual(status, {})
@@ -134,6 +148,62 @@ class TaskDBCase(object):
         self.assertEqual(tasks[0]['taskid'], 'taskid')
         self.assertNotIn('project', tasks[0])
 
+    def test_55_insert_many_update_many(self):
+        tasks = []
+        for i in range(3):
+            task = dict(self.sample_task)
+            task['taskid'] = 'taskid%d' % i
+            task['status'] = self.taskdb.ACTIVE
+            tasks.append(task)
+        self.taskdb.insert_many('many_project', tasks)
+        self.assertEqual(self.taskdb.status_count('many_project'), {self.taskdb.ACTIVE: 3})
+
+        self.taskdb.update_many('many_project', [
+            {'taskid': 'taskid0', 'status': self.taskdb.SUCCESS, 'track': {}},
+            {'taskid': 'taskid1', 'status': self.taskdb.SUCCESS, 'track': {}},
+            {'taskid': 'taskid2', 'url': 'www.google.com/'},
+        ])
+        self.assertEqual(self.taskdb.status_count('many_project'),
+                         {self.taskdb.ACTIVE: 1, self.taskdb.SUCCESS: 2})
+        task = self.taskdb.get_task('many_project', 'taskid0')
+        self.assertEqual(task['track'], {})
+        self.assertEqual(task['fetch'], self.sample_task['fetch'])
+        task = self.taskdb.get_task('many_project', 'taskid2')
+        self.assertEqual(task['url'], 'www.google.com/')
+        self.assertEqual(task['track'], self.sample_task['track'])
+
+    def test_57_load_tasks_pages(self):
+        tasks = []
+        for i in range(5):
+            task = dict(self.sample_task)
+            task['taskid'] = 'page%d' % i
+            task['status'] = self.taskdb.ACTIVE
+            tasks.append(task)
+        self.taskdb.insert_many('many_project', tasks)
+
+        pages = list(self.taskdb.load_tasks_pages(self.taskdb.ACTIVE, 'many_project',
+                                                  fields=['schedule'], page_size=2))
+        self.assertEqual([len(x) for x in pages], [2, 2, 2])
+        taskids = [task['taskid'] for page in pages for task in page]
+        self.assertEqual(sorted(taskids), ['page0', 'page1', 'page2', 'page3', 'page4', 'taskid2'])
+        self.assertEqual(pages[0][0]['schedule'], self.sample_task['schedule'])
+        self.assertNotIn('url', pages[0][0])
+
+        self.assertEqual(list(self.taskdb.load_tasks_pages(self.taskdb.ACTIVE, 'abc')), [])
+
+    def test_58_load_tasks_since(self):
+        now = time.time()
+        time.sleep(0.01)
+        self.taskdb.update('many_project', 'page1', status=self.taskdb.SUCCESS)
+        self.taskdb.update('many_project', 'page3', track={})
+        tasks = list(self.taskdb.load_tasks_since('many_project', now, fields=['taskid']))
+        self.assertEqual(sorted(task['taskid'] for task in tasks), ['page1', 'page3'])
+        status = dict((task['taskid'], task['status']) for task in tasks)
+        self.assertEqual(status['page1'], self.taskdb.SUCCESS)
+        self.assertEqual(status['page3'], self.taskdb.ACTIVE)
+
+        self.assertEqual(list(self.taskdb.load_tasks_since('abc', now)), [])
+
     def test_60_relist_projects(self):
         if hasattr(self.taskdb, '_list_project'):
             self.taskdb._list_project()
@@ -11,6 +11,7 @@ import copy
 import time
 import socket
 import umsgpack
+import functools
 import subprocess
 import unittest
 
@@ -619,3 +620,450 @@ class TestSplashFetcher(unittest.TestCase):
         self.assertIn('c=d', data['headers'].get('Cookie'), response.content)
         self.assertIn('a=b', data['headers'].get('Cookie'), response.content)
         self.fetcher.proxy = None
+
+
+class TestFetcherConcurrency(unittest.TestCase):
+    '''a slow host and a fast host served by local tornado servers'''
+
+    @classmethod
+    def setUpClass(self):
+        import tornado.web
+        import tornado.ioloop
+        from tornado import gen
+
+        self.active = {'slow': 0, 'fast': 0}
+        self.max_active = {'slow': 0, 'fast': 0}
+        active, max_active = self.active, self.max_active
+
+        class Handler(tornado.web.RequestHandler):
+            @gen.coroutine
+            def get(self, host):
+                active[host] += 1
+                max_active[host] = max(max_active[host], active[host])
+                try:
+                    yield gen.sleep(1 if host == 'slow' else 0)
+                    self.write(host)
+                finally:
+                    active[host] -= 1
+
+        def run():
+            self.server_ioloop = tornado.ioloop.IOLoop.current()
+            tornado.web.Application([(r'/(slow)', Handler)]).listen(14888, '127.0.0.1')
+            tornado.web.Application([(r'/(fast)', Handler)]).listen(14889, '127.0.0.1')
+            self.server_ioloop.start()
+
+        self.server_thread = utils.run_in_thread(run)
+        self.fetcher = Fetcher(None, None)
+        self.fetcher.host_concurrency = 2
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(self):
+        self.server_ioloop.add_callback(self.server_ioloop.stop)
+        self.server_thread.join()
+
+    def fetch_all(self, tasks):
+        from tornado import gen
+
+        done = {}
+
+        def callback(type, task, result):
+            done[task['taskid']] = (time.time() - start, result)
+
+        @gen.coroutine
+        def run():
+            yield [self.fetcher.async_fetch(task, callback) for task in tasks]
+
+        start = time.time()
+        self.fetcher.ioloop.run_sync(run, timeout=30)
+        return done
+
+    def task(self, taskid, url, **fetch):
+        return {'taskid': taskid, 'project': 'project', 'url': url, 'fetch': fetch}
+
+    def test_10_no_head_of_line_blocking(self):
+        tasks = [self.task('slow%d' % i, 'http://127.0.0.1:14888/slow') for i in range(6)]
+        tasks += [self.task('fast%d' % i, 'http://127.0.0.1:14889/fast') for i in range(2)]
+        done = self.fetch_all(tasks)
+
+        self.assertEqual(self.max_active['slow'], 2)
+        for taskid, (finish, result) in done.items():
+            self.assertEqual(result['status_code'], 200, result)
+            if taskid.startswith('fast'):
+                self.assertLess(finish, 0.5)
+        # 6 slow tasks are fetched 2 by 2
+        self.assertGreater(max(finish for finish, _ in done.values()), 2.9)
+        self.assertEqual(self.fetcher._slots, {})
+        self.assertEqual(self.fetcher._waiting, 0)
+        wait_time = self.fetcher._cnt['5m'].to_dict('sum')['project']['wait_time']
+        self.assertGreater(wait_time, 5)
+
+    def test_20_limit_in_task(self):
+        self.max_active['slow'] = 0
+        tasks = [self.task('slow%d' % i, 'http://127.0.0.1:14888/slow',
+                           host_concurrency=0, project_concurrency=3) for i in range(3)]
+        done = self.fetch_all(tasks)
+
+        self.assertEqual(self.max_active['slow'], 3)
+        self.assertLess(max(finish for finish, _ in done.values()), 1.9)
+        self.assertEqual(self.fetcher._slots, {})
+
+    def test_25_saturated_host_in_project(self):
+        self.max_active['slow'] = 0
+        tasks = [self.task('slow%d' % i, 'http://127.0.0.1:14888/slow',
+                           host_concurrency=1, project_concurrency=3) for i in range(4)]
+        tasks += [self.task('fast%d' % i, 'http://127.0.0.1:14889/fast',
+                            host_concurrency=1, project_concurrency=3) for i in range(2)]
+        done = self.fetch_all(tasks)
+
+        self.assertEqual(self.max_active['slow'], 1)
+        for taskid, (finish, result) in done.items():
+            self.assertEqual(result['status_code'], 200, result)
+            if taskid.startswith('fast'):
+                self.assertLess(finish, 0.5)
+        self.assertEqual(self.fetcher._slots, {})
+        self.assertEqual(self.fetcher._waiting, 0)
+
+    def test_30_event_driven_queue(self):
+        inqueue, outqueue = Queue(), Queue()
+        fetchers = []
+
+        def run():
+            fetcher = Fetcher(inqueue, outqueue, poolsize=2)
+            fetchers.append(fetcher)
+            fetcher.run()
+        thread = utils.run_in_thread(run)
+        time.sleep(0.5)
+
+        start = time.time()
+        for i in range(20):
+            inqueue.put(self.task('fast%d' % i, 'http://127.0.0.1:14889/fast'))
+        for _ in range(20):
+            task, result = outqueue.get(timeout=5)
+            self.assertEqual(result['status_code'], 200, result)
+        # 10 rounds of 2 fetches, it takes 1s when inqueue is polled every 100ms
+        self.assertLess(time.time() - start, 0.8)
+
+        fetchers[0].quit()
+        thread.join()
+
+
+class TestFetcherHTTPCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        import shutil
+        import tornado.web
+        import tornado.ioloop
+
+        self.hits = hits = {}
+
+        class Handler(tornado.web.RequestHandler):
+            def get(self, path):
+                hits[path] = hits.get(path, 0) + 1
+                if path == 'fresh':
+                    self.set_header('Cache-Control', 'max-age=60')
+                elif path == 'etag':
+                    self.set_header('Cache-Control', 'no-cache')
+                    self.set_header('ETag', '"v1"')
+                    if self.request.headers.get('If-None-Match') == '"v1"':
+                        self.set_status(304)
+                        return
+                self.write('%s %d' % (path, hits[path]))
+
+        def run():
+            self.server_ioloop = tornado.ioloop.IOLoop.current()
+            tornado.web.Application([(r'/(\w+)', Handler)]).listen(14891, '127.0.0.1')
+            self.server_ioloop.start()
+
+        self.server_thread = utils.run_in_thread(run)
+        self.path = './data/tests/http_cache'
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.fetcher = Fetcher(None, None)
+        self.fetcher.http_cache_path = self.path
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(self):
+        import shutil
+        self.server_ioloop.add_callback(self.server_ioloop.stop)
+        self.server_thread.join()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def fetch(self, path, fetcher=None, **fetch):
+        fetch.setdefault('http_cache', True)
+        task = {'taskid': path, 'project': 'project',
+                'url': 'http://127.0.0.1:14891/%s' % path, 'fetch': fetch}
+        fetcher = fetcher or self.fetcher
+        if not fetcher.async_mode:
+            result = fetcher.fetch(task)
+        else:
+            result = fetcher.ioloop.run_sync(
+                functools.partial(fetcher.async_fetch, task, lambda *args: None))
+        result['content'] = utils.text(result['content'])
+        return result
+
+    def test_10_fresh(self):
+        for _ in range(3):
+            result = self.fetch('fresh')
+            self.assertEqual(result['status_code'], 200, result)
+            self.assertEqual(result['content'], 'fresh 1')
+        self.assertEqual(self.hits['fresh'], 1)
+        self.assertEqual(self.fetch('fresh', http_cache=False)['content'], 'fresh 2')
+        self.assertEqual(self.fetch('fresh', headers={'Cache-Control': 'no-cache'})['content'],
+                         'fresh 3')
+        self.assertEqual(self.fetcher._cnt['5m'].to_dict('sum')['project']['cache_hit'], 2)
+
+    def test_20_revalidate(self):
+        self.assertEqual(self.fetch('etag')['content'], 'etag 1')
+        result = self.fetch('etag')
+        self.assertEqual(result['status_code'], 200, result)
+        self.assertEqual(result['content'], 'etag 1')
+        self.assertEqual(self.hits['etag'], 2)
+        # etag of last crawl is answered by cache
+        result = self.fetch('etag', etag='"v1"')
+        self.assertEqual(result['status_code'], 304, result)
+
+    def test_30_sync_fetch(self):
+        fetcher = Fetcher(None, None, async_mode=False)
+        fetcher.http_cache_path = self.path
+        self.fetch('fresh')
+        hits = self.hits['fresh']
+        result = self.fetch('fresh', fetcher)
+        self.assertEqual(result['status_code'], 200, result)
+        self.assertEqual(self.hits['fresh'], hits)
+
+    def test_40_io_off_ioloop(self):
+        import threading
+
+        threads = set()
+        http_cache = self.fetcher.http_cache
+        lookup, store = http_cache.lookup, http_cache.store
+
+        def wrap(method):
+            def wrapper(*args, **kwargs):
+                threads.add(threading.current_thread().ident)
+                return method(*args, **kwargs)
+            return wrapper
+        http_cache.lookup, http_cache.store = wrap(lookup), wrap(store)
+        try:
+            for _ in range(2):
+                self.assertEqual(self.fetch('io')['status_code'], 200)
+        finally:
+            http_cache.lookup, http_cache.store = lookup, store
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread().ident, threads)
+
+
+class TestFetcherRobotsTxt(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        import tornado.web
+        import tornado.ioloop
+        from tornado import gen
+
+        self.hits = hits = {}
+
+        class Handler(tornado.web.RequestHandler):
+            @gen.coroutine
+            def get(self, path):
+                key = (self.request.host, path)
+                hits[key] = hits.get(key, 0) + 1
+                if path == 'robots.txt':
+                    yield gen.sleep(0.2)
+                    if self.request.host.endswith('14893'):
+                        raise tornado.web.HTTPError(500)
+                    self.write('User-agent: *\nDisallow: /private\n')
+                else:
+                    self.write(path)
+
+        def run():
+            self.server_ioloop = tornado.ioloop.IOLoop.current()
+            application = tornado.web.Application([(r'/([\w.]+)', Handler)])
+            application.listen(14892, '127.0.0.1')
+            application.listen(14893, '127.0.0.1')
+            self.server_ioloop.start()
+
+        self.server_thread = utils.run_in_thread(run)
+        self.fetcher = Fetcher(None, None)
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(self):
+        self.server_ioloop.add_callback(self.server_ioloop.stop)
+        self.server_thread.join()
+
+    def fetch_all(self, urls):
+        from tornado import gen
+
+        @gen.coroutine
+        def run():
+            results = yield [self.fetcher.async_fetch(
+                {'taskid': url, 'project': 'project', 'url': url, 'fetch': {'robots_txt': True}},
+                lambda *args: None) for url in urls]
+            raise gen.Return(results)
+        return self.fetcher.ioloop.run_sync(run, timeout=30)
+
+    def test_10_singleflight(self):
+        urls = ['http://127.0.0.1:14892/page%d' % i for i in range(10)]
+        urls.append('http://127.0.0.1:14892/private')
+        results = self.fetch_all(urls)
+
+        self.assertEqual(self.hits[('127.0.0.1:14892', 'robots.txt')], 1)
+        self.assertEqual([each['status_code'] for each in results], [200] * 10 + [403])
+        self.assertEqual(self.fetcher._robots_txt_loading, {})
+
+        self.fetch_all(['http://127.0.0.1:14892/page'])
+        self.assertEqual(self.hits[('127.0.0.1:14892', 'robots.txt')], 1)
+
+    def test_20_error_cached(self):
+        results = self.fetch_all(['http://127.0.0.1:14893/page%d' % i for i in range(3)])
+        self.fetch_all(['http://127.0.0.1:14893/page'])
+
+        self.assertEqual(self.hits[('127.0.0.1:14893', 'robots.txt')], 1)
+        self.assertEqual([each['status_code'] for each in results], [200] * 3)
+        expire, _ = self.fetcher.robots_txt_cache._cache['127.0.0.1:14893']
+        self.assertLessEqual(expire - time.time(), self.fetcher.robot_txt_error_age)
+
+    def test_30_shared_cache_off_ioloop(self):
+        import shutil
+        import tempfile
+        import threading
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        threads = set()
+
+        def wrap(method):
+            def wrapper(*args):
+                threads.add(threading.current_thread().ident)
+                return method(*args)
+            return wrapper
+
+        def fetcher():
+            fetcher = Fetcher(None, None)
+            fetcher.robot_txt_cache_path = os.path.join(path, 'robots_txt.db')
+            robots_txt_cache = fetcher.robots_txt_cache
+            for name in ('get', 'set', 'expire'):
+                setattr(robots_txt_cache, name, wrap(getattr(robots_txt_cache, name)))
+            return fetcher
+
+        url = 'http://127.0.0.1:14892/shared'
+        hits = self.hits[('127.0.0.1:14892', 'robots.txt')]
+        for each in (fetcher(), fetcher()):
+            result = each.ioloop.run_sync(lambda: each.async_fetch(
+                {'taskid': url, 'project': 'project', 'url': url, 'fetch': {'robots_txt': True}},
+                lambda *args: None), timeout=30)
+            self.assertEqual(result['status_code'], 200, result)
+        # robots.txt fetched by the first fetcher is loaded from sqlite by the second one
+        self.assertEqual(self.hits[('127.0.0.1:14892', 'robots.txt')], hits + 1)
+
+        each.clear_robot_txt_cache()
+        each._robots_txt_expiring.result()
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread().ident, threads)
+
+
+class TestFetcherStreaming(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        import shutil
+        import tornado.web
+        import tornado.ioloop
+        from tornado import gen
+        from tornado.iostream import StreamClosedError
+
+        class Handler(tornado.web.RequestHandler):
+            @gen.coroutine
+            def get(self, size):
+                size = int(size)
+                chunk = b'x' * 65536
+                try:
+                    while size != 0:
+                        self.write(chunk[:size] if size > 0 else chunk)
+                        size = max(0, size - len(chunk)) if size > 0 else size
+                        yield self.flush()
+                except StreamClosedError:
+                    pass
+
+        def run():
+            self.server_ioloop = tornado.ioloop.IOLoop.current()
+            tornado.web.Application([(r'/(-?\d+)', Handler)]).listen(14894, '127.0.0.1')
+            self.server_ioloop.start()
+
+        self.server_thread = utils.run_in_thread(run)
+        self.path = './data/tests/spool'
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.fetcher = Fetcher(None, None)
+        self.fetcher.spool_path = self.path
+        self.fetcher.spool_threshold = 1024 * 1024
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(self):
+        import shutil
+        self.server_ioloop.add_callback(self.server_ioloop.stop)
+        self.server_thread.join()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def task(self, size, **fetch):
+        return {'taskid': str(size), 'project': 'project',
+                'url': 'http://127.0.0.1:14894/%d' % size, 'fetch': fetch}
+
+    def fetch(self, task):
+        return self.fetcher.ioloop.run_sync(
+            functools.partial(self.fetcher.async_fetch, task, lambda *args: None), timeout=30)
+
+    def test_10_in_memory(self):
+        result = self.fetch(self.task(1000))
+        self.assertEqual(result['status_code'], 200, result)
+        self.assertEqual(result['content'], b'x' * 1000)
+        self.assertNotIn('content_file', result)
+
+    def test_15_buffer_not_copied(self):
+        from pyspider.fetcher.spool import SpooledBody
+
+        body = SpooledBody()
+        body.write(b'x' * 1000)
+        buffer = body._buffer
+        self.assertIs(body.detach(), buffer)
+        self.assertEqual(buffer.tell(), 0)
+        self.assertEqual(buffer.getvalue(), b'x' * 1000)
+
+    def test_20_spooled(self):
+        import tracemalloc
+
+        size = 30 * 1024 * 1024
+        tracemalloc.start()
+        result = self.fetch(self.task(size))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self.assertEqual(result['status_code'], 200, result)
+        self.assertEqual(result['content'], '')
+        self.assertEqual(os.path.getsize(result['content_file']), size)
+        self.assertEqual(result['content_size'], size)
+        self.assertLess(peak, 8 * 1024 * 1024)
+
+        response = rebuild_response(result)
+        self.assertEqual(response.content_size, size)
+        self.assertIsNone(response._content)
+        self.assertEqual(len(response.content), size)
+        os.remove(result['content_file'])
+
+    def test_30_max_body_size(self):
+        start = time.time()
+        result = self.fetch(self.task(-1, max_body_size=2 * 1024 * 1024))
+        self.assertEqual(result['status_code'], 599, result)
+        self.assertIn('max_body_size', result['error'])
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_40_sync_fetch(self):
+        result = self.fetcher.sync_fetch(self.task(2 * 1024 * 1024))
+        self.assertEqual(result['status_code'], 200, result)
+        self.assertEqual(len(result['content']), 2 * 1024 * 1024)
+        self.assertNotIn('content_file', result)
+        self.assertEqual(os.listdir(self.path), [])
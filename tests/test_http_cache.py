@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import time
+import shutil
+import hashlib
+import unittest
+from email.utils import formatdate
+
+from pyspider.fetcher.http_cache import HTTPCache, parse_cache_control
+
+
+class TestHTTPCache(unittest.TestCase):
+    path = './data/tests/http_cache'
+
+    def setUp(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.cache = HTTPCache(self.path, max_size=1000)
+        self.now = time.time()
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def store(self, url, headers, body=b'body', status=200, request_headers=None, age=0):
+        return self.cache.store('GET', url, request_headers or {}, status, headers, body,
+                                self.now - age, self.now - age)
+
+    def test_10_parse_cache_control(self):
+        self.assertEqual(parse_cache_control('max-age=60, no-cache, private="set-cookie"'),
+                         {'max-age': '60', 'no-cache': None, 'private': 'set-cookie'})
+        self.assertEqual(parse_cache_control(None), {})
+
+    def test_20_max_age(self):
+        self.store('http://a/1', {'Cache-Control': 'max-age=60'}, age=30)
+        entry = self.cache.lookup('GET', 'http://a/1', {})
+        self.assertTrue(entry.is_fresh({}))
+        self.assertEqual(self.cache.body(entry), b'body')
+        self.assertFalse(entry.is_fresh({'Cache-Control': 'max-age=10'}))
+        self.assertFalse(entry.is_fresh({'Cache-Control': 'no-cache'}))
+        self.assertFalse(entry.is_fresh({'Cache-Control': 'min-fresh=40'}))
+        self.assertFalse(entry.is_fresh({}, now=self.now + 31))
+        self.assertTrue(entry.is_fresh({'Cache-Control': 'max-stale=10'}, now=self.now + 31))
+        # Age header from upstream cache
+        self.store('http://a/2', {'Cache-Control': 'max-age=60', 'Age': '50'}, age=20)
+        self.assertFalse(self.cache.lookup('GET', 'http://a/2', {}).is_fresh({}))
+        # s-maxage of shared cache
+        self.store('http://a/3', {'Cache-Control': 'max-age=60, s-maxage=10'}, age=30)
+        self.assertFalse(self.cache.lookup('GET', 'http://a/3', {}).is_fresh({}))
+
+    def test_30_expires_and_heuristic(self):
+        self.store('http://a/1', {'Date': formatdate(self.now),
+                                  'Expires': formatdate(self.now + 60)})
+        self.assertTrue(self.cache.lookup('GET', 'http://a/1', {}).is_fresh({}))
+        self.store('http://a/2', {'Expires': '0'})
+        self.assertFalse(self.cache.lookup('GET', 'http://a/2', {}).is_fresh({}))
+        # 10% of 1000s since Last-Modified
+        self.store('http://a/3', {'Date': formatdate(self.now),
+                                  'Last-Modified': formatdate(self.now - 1000)})
+        entry = self.cache.lookup('GET', 'http://a/3', {})
+        self.assertAlmostEqual(entry.freshness_lifetime(), 100, delta=1)
+        self.assertTrue(entry.is_fresh({}, now=self.now + 90))
+        self.assertFalse(entry.is_fresh({}, now=self.now + 110))
+        # no freshness, stored for revalidation
+        self.store('http://a/4', {'ETag': '"abc"'})
+        entry = self.cache.lookup('GET', 'http://a/4', {})
+        self.assertFalse(entry.is_fresh({}))
+        self.assertEqual(entry.conditional_headers(), {'If-None-Match': '"abc"'})
+
+    def test_40_not_stored(self):
+        self.assertIsNone(self.store('http://a/1', {'Cache-Control': 'no-store'}))
+        self.assertIsNone(self.store('http://a/2', {'Cache-Control': 'private, max-age=60'}))
+        self.assertIsNone(self.store('http://a/3', {'Cache-Control': 'max-age=60'},
+                                     request_headers={'Authorization': 'Basic eA=='}))
+        self.assertIsNotNone(self.store('http://a/3', {'Cache-Control': 'public, max-age=60'},
+                                        request_headers={'Authorization': 'Basic eA=='}))
+        self.assertIsNone(self.store('http://a/4', {'Vary': '*'}))
+        self.assertIsNone(self.store('http://a/5', {}, status=500))
+        self.assertIsNone(self.cache.store('POST', 'http://a/6', {}, 200,
+                                           {'Cache-Control': 'max-age=60'}, b'', 0, 0))
+        self.assertIsNone(self.cache.lookup('GET', 'http://a/1', {}))
+        entry = self.store('http://a/7', {'Cache-Control': 'max-age=60', 'Set-Cookie': 'a=b'})
+        self.assertIsNone(entry.header('Set-Cookie'))
+
+    def test_50_vary(self):
+        self.store('http://a/1', {'Cache-Control': 'max-age=60', 'Vary': 'Accept-Language'},
+                   body=b'en', request_headers={'Accept-Language': 'en'})
+        self.store('http://a/1', {'Cache-Control': 'max-age=60', 'Vary': 'Accept-Language'},
+                   body=b'ja', request_headers={'Accept-Language': 'ja'})
+        entry = self.cache.lookup('GET', 'http://a/1', {'accept-language': 'ja'})
+        self.assertEqual(self.cache.body(entry), b'ja')
+        entry = self.cache.lookup('GET', 'http://a/1', {'Accept-Language': 'en'})
+        self.assertEqual(self.cache.body(entry), b'en')
+        self.assertIsNone(self.cache.lookup('GET', 'http://a/1', {}))
+
+    def test_60_update_and_conditional(self):
+        entry = self.store('http://a/1', {'ETag': 'W/"abc"', 'Content-Length': '4',
+                                          'Cache-Control': 'no-cache'}, age=100)
+        entry = self.cache.update(entry, {'Cache-Control': 'max-age=60', 'Content-Length': '0'},
+                                  self.now, self.now)
+        self.assertTrue(entry.is_fresh({}))
+        self.assertEqual(entry.header('Content-Length'), '4')
+        entry = self.cache.lookup('GET', 'http://a/1', {})
+        self.assertTrue(entry.is_fresh({}))
+        self.assertTrue(entry.not_modified({'If-None-Match': '"abc"'}))
+        self.assertFalse(entry.not_modified({'If-None-Match': '"def"'}))
+        self.assertFalse(entry.not_modified({}))
+
+        self.cache.invalidate('http://a/1')
+        self.assertIsNone(self.cache.lookup('GET', 'http://a/1', {}))
+
+    def test_70_lru_eviction(self):
+        for i in range(5):
+            self.store('http://a/%d' % i, {'Cache-Control': 'max-age=60'}, body=b'%d' % i * 200)
+            time.sleep(0.01)
+        evicted = self.cache._body_path(hashlib.sha1(b'1' * 200).hexdigest())
+        # same content is stored once
+        self.store('http://a/same', {'Cache-Control': 'max-age=60'}, body=b'4' * 200)
+        self.assertEqual(self.cache.size, 1000)
+        self.cache.lookup('GET', 'http://a/0', {})
+        time.sleep(0.01)
+        self.store('http://a/5', {'Cache-Control': 'max-age=60'}, body=b'5' * 200)
+
+        self.assertLessEqual(self.cache.size, 900)
+        self.assertIsNotNone(self.cache.lookup('GET', 'http://a/0', {}))
+        self.assertIsNone(self.cache.lookup('GET', 'http://a/1', {}))
+        self.assertIsNotNone(self.cache.lookup('GET', 'http://a/5', {}))
+        self.assertFalse(os.path.exists(evicted))
+        self.assertEqual(HTTPCache(self.path, max_size=1000).size, self.cache.size)
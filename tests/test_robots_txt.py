@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+import os
+import time
+import shutil
+import unittest
+
+from pyspider.fetcher.robots_txt import RobotsTxtCache
+
+DISALLOW = 'User-agent: *\nDisallow: /private'
+
+
+class TestRobotsTxtCache(unittest.TestCase):
+    path = './data/tests/robots_txt.db'
+
+    def setUp(self):
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+
+    def test_10_expire(self):
+        cache = RobotsTxtCache()
+        now = time.time()
+        robot_txt = cache.set('a.com', DISALLOW, 60, now=now)
+        self.assertFalse(robot_txt.can_fetch('pyspider', 'http://a.com/private'))
+        self.assertTrue(robot_txt.can_fetch('pyspider', 'http://a.com/public'))
+        self.assertIs(cache.get('a.com', now=now + 30), robot_txt)
+        self.assertIsNone(cache.get('a.com', now=now + 61))
+        self.assertIsNone(cache.get('b.com'))
+
+        cache.set('b.com', '', 10, now=now)
+        cache.set('c.com', '', 60, now=now)
+        cache.expire(now=now + 30)
+        self.assertEqual(len(cache), 1)
+        self.assertIsNotNone(cache.get('c.com', now=now + 30))
+
+    def test_20_lru(self):
+        cache = RobotsTxtCache(max_size=3)
+        for host in ('a.com', 'b.com', 'c.com'):
+            cache.set(host, '', 60)
+        cache.get('a.com')
+        cache.set('d.com', '', 60)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get('b.com'))
+        for host in ('a.com', 'c.com', 'd.com'):
+            self.assertIsNotNone(cache.get(host), host)
+
+    def test_30_shared(self):
+        cache = RobotsTxtCache(path=self.path)
+        now = time.time()
+        cache.set('a.com', DISALLOW, 60, now=now)
+        cache.set('b.com', DISALLOW, 10, now=now)
+
+        other = RobotsTxtCache(path=self.path)
+        robot_txt = other.get('a.com', now=now + 30)
+        self.assertFalse(robot_txt.can_fetch('pyspider', 'http://a.com/private'))
+        self.assertEqual(len(other), 1)
+        self.assertIsNone(other.get('b.com', now=now + 30))
+
+        cache.expire(now=now + 30)
+        self.assertIsNone(RobotsTxtCache(path=self.path).get('b.com', now=now))
+        cache.close()
+        other.close()
@@ -8,6 +8,8 @@
 import os
 import time
 import shutil
+import tempfile
+import threading
 import unittest
 import logging
 import logging.config
@@ -92,6 +94,635 @@ class TestBucket(unittest.TestCase):
         self.assertAlmostEqual(bucket.get(), 920, delta=2)
 
 
+class TestWriteBuffer(unittest.TestCase):
+
+    def test_coalesce_and_flush(self):
+        from pyspider.database.sqlite.taskdb import TaskDB
+        from pyspider.scheduler.write_buffer import WriteBuffer
+
+        db = TaskDB(':memory:')
+        db.insert('p', 't1', {'taskid': 't1', 'url': 'u1', 'status': db.ACTIVE})
+        db.insert('p', 't2', {'taskid': 't2', 'url': 'u2', 'status': db.ACTIVE})
+
+        buf = WriteBuffer()
+        track = {'fetch': {'ok': True}}
+        buf.put('p', 't1', {'status': db.FAILED, 'track': track,
+                            'schedule': {'retried': 1}})
+        buf.put('p', 't1', {'status': db.SUCCESS})
+        buf.put('p', 't2', {'status': db.BAD})
+        del track['fetch']
+        self.assertEqual(len(buf), 2)
+
+        task = buf.merge('p', db.get_task('p', 't1'), ['taskid', 'status', 'schedule'])
+        self.assertEqual(task['status'], db.SUCCESS)
+        self.assertEqual(task['schedule'], {'retried': 1})
+        self.assertEqual(task['track'], {})
+        buf.get('p', 't1')['schedule']['retried'] = 2
+        self.assertEqual(buf.get('p', 't1')['schedule'], {'retried': 1})
+        self.assertEqual(db.get_task('p', 't1')['status'], db.ACTIVE)
+
+        self.assertEqual(buf.flush(db), 2)
+        self.assertEqual(len(buf), 0)
+        self.assertIsNone(buf.get('p', 't1'))
+        task = db.get_task('p', 't1')
+        self.assertEqual(task['status'], db.SUCCESS)
+        self.assertEqual(task['track'], {'fetch': {'ok': True}})
+        self.assertEqual(db.get_task('p', 't2')['status'], db.BAD)
+
+    def test_flush_failed(self):
+        from pyspider.scheduler.write_buffer import WriteBuffer
+
+        class BrokenTaskDB(object):
+            def update_many(self, project, objs):
+                raise IOError('broken')
+
+        class TaskDB(object):
+            def __init__(self):
+                self.updated = []
+
+            def update_many(self, project, objs):
+                self.updated.extend(objs)
+
+        buf = WriteBuffer(retry_interval=0.1)
+        buf.put('p', 't1', {'status': 1})
+        self.assertEqual(buf.flush(BrokenTaskDB()), 0)
+        self.assertEqual(buf.get('p', 't1'), {'status': 1})
+        self.assertEqual(buf.failures, 1)
+        self.assertEqual(buf.flush(BrokenTaskDB(), force=True), 0)
+        self.assertAlmostEqual(buf.retry_time, time.time() + 0.2, delta=0.05)
+
+        # skipped until retry_time
+        taskdb = TaskDB()
+        buf.put('p', 't1', {'url': 'u1'})
+        self.assertEqual(buf.flush(taskdb), 0)
+        time.sleep(0.2)
+        self.assertEqual(buf.flush(taskdb), 1)
+        self.assertEqual(taskdb.updated, [{'taskid': 't1', 'status': 1, 'url': 'u1'}])
+        self.assertEqual((buf.failures, buf.retry_time), (0, 0))
+
+        buf.put('p', 't1', {'status': 1})
+        buf.discard('p')
+        self.assertEqual(len(buf), 0)
+
+    def test_scheduler_taskdb_failed(self):
+        from pyspider.scheduler import Scheduler
+
+        class FlakyTaskDB(object):
+            broken = True
+            updated = 0
+
+            def update_many(self, project, objs):
+                if self.broken:
+                    raise IOError('broken')
+                self.updated += len(objs)
+
+        taskdb = FlakyTaskDB()
+        data_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_path, True)
+        scheduler = Scheduler(taskdb=taskdb, projectdb=None, newtask_queue=None,
+                              status_queue=None, out_queue=None, data_path=data_path)
+        scheduler.UPDATE_BUFFER_SIZE = 10
+        scheduler.UPDATE_BUFFER_LIMIT = 100
+        scheduler._update_buffer.retry_interval = 0.05
+        scheduler._update_buffer.max_retry_interval = 0.05
+        for i in range(99):
+            scheduler.update_task({'project': 'p', 'taskid': 't%d' % i, 'status': 1})
+        self.assertEqual(len(scheduler._update_buffer), 99)
+
+        # buffer is full, update blocks until taskdb is back
+        timer = threading.Timer(0.3, setattr, (taskdb, 'broken', False))
+        timer.start()
+        start = time.time()
+        scheduler.update_task({'project': 'p', 'taskid': 't99', 'status': 1})
+        self.assertGreaterEqual(time.time() - start, 0.25)
+        self.assertEqual(taskdb.updated, 100)
+        self.assertEqual(len(scheduler._update_buffer), 0)
+        timer.join()
+
+    def test_flush_on_quit_failed(self):
+        from pyspider.scheduler import Scheduler
+
+        class FlakyTaskDB(object):
+            failures = 2
+            updated = 0
+
+            def update_many(self, project, objs):
+                if self.failures:
+                    self.failures -= 1
+                    raise IOError('broken')
+                self.updated += len(objs)
+
+        taskdb = FlakyTaskDB()
+        data_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_path, True)
+        scheduler = Scheduler(taskdb=taskdb, projectdb=None, newtask_queue=None,
+                              status_queue=None, out_queue=None, data_path=data_path)
+        scheduler.UPDATE_BUFFER_SIZE = 100
+        scheduler._update_buffer.retry_interval = 0.05
+        for i in range(10):
+            scheduler.update_task({'project': 'p', 'taskid': 't%d' % i, 'status': 1})
+
+        # first flushes on quit fail, updates are written by retries
+        scheduler._flush_update_buffer_on_quit()
+        self.assertEqual(taskdb.failures, 0)
+        self.assertEqual(taskdb.updated, 10)
+        self.assertEqual(len(scheduler._update_buffer), 0)
+
+        # gave up after UPDATE_BUFFER_QUIT_TIMEOUT
+        taskdb.failures = 1000
+        scheduler.UPDATE_BUFFER_QUIT_TIMEOUT = 0.3
+        scheduler.update_task({'project': 'p', 'taskid': 't0', 'status': 2})
+        start = time.time()
+        scheduler._flush_update_buffer_on_quit()
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(len(scheduler._update_buffer), 1)
+
+
+class TestDeficitRoundRobinPolicy(unittest.TestCase):
+
+    def test_select(self):
+        from pyspider.scheduler.select_policy import DeficitRoundRobinPolicy
+
+        projects = [utils.ObjectDict(name=name, task_queue=TaskQueue(rate=rate, burst=1e9))
+                    for name, rate in (('a', 1), ('b', 2), ('c', 1))]
+        for project, size in zip(projects, (100, 100, 3)):
+            for i in range(size):
+                project.task_queue.put('%s%d' % (project.name, i))
+
+        selected = []
+
+        def take(project, n):
+            cnt = 0
+            while cnt < n and project.task_queue.get():
+                selected.append(project.name)
+                cnt += 1
+            return cnt
+
+        policy = DeficitRoundRobinPolicy()
+        self.assertEqual(policy.select(projects, 10, take), 10)
+        self.assertEqual(''.join(selected), 'abbcabbcab')
+        # continue the round with b, c has no more task after the first one
+        del selected[:]
+        self.assertEqual(policy.select(projects, 10, take), 10)
+        self.assertEqual(''.join(selected), 'bcabbabbab')
+        del selected[:]
+        # unused share of empty projects is given to others
+        self.assertEqual(policy.select(projects, 300, take), 203 - 20)
+        self.assertEqual(sum(project.task_queue.priority_queue.qsize() for project in projects), 0)
+        self.assertEqual(policy.deficit, {})
+
+
+class TestThreadBaseScheduler(unittest.TestCase):
+
+    def setUp(self):
+        from six.moves import queue as Queue
+        from pyspider.database import connect_database
+        from pyspider.scheduler.scheduler import ThreadBaseScheduler
+
+        self.data_path = tempfile.mkdtemp()
+        self.taskdb = connect_database('sqlite+taskdb:///%s/task.db' % self.data_path)
+        projectdb = connect_database('sqlite+projectdb:///%s/project.db' % self.data_path)
+        projectdb.insert('p', dict(name='p', group='', status='RUNNING', script='',
+                                   rate=1000, burst=1000, updatetime=time.time()))
+        self.newtask_queue, self.out_queue = Queue.Queue(), Queue.Queue()
+        self.scheduler = ThreadBaseScheduler(
+            threads=4, taskdb=self.taskdb, projectdb=projectdb,
+            newtask_queue=self.newtask_queue, status_queue=Queue.Queue(),
+            out_queue=self.out_queue, data_path=self.data_path)
+        self.scheduler._dump_cnt = lambda: None
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+
+    def test_no_barrier(self):
+        self.assertEqual(self.scheduler.threads, 4)
+        self.assertIsNotNone(self.scheduler._writer)
+
+        # a slow work of one shard doesn't stall the loop
+        slow = self.scheduler._run_in_thread(time.sleep, 1, _i=0)
+        start = time.time()
+        self.scheduler.run_once()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertIn('p', self.scheduler.projects)
+        self.assertFalse(slow.done())
+        self.assertTrue(self.scheduler._wait_thread(timeout=5))
+        self.assertTrue(slow.done())
+
+    def test_requests(self):
+        self.scheduler._update_projects()
+        project = self.scheduler.projects['p']
+        project.waiting_get_info = False
+        for i in range(200):
+            self.newtask_queue.put({'taskid': 't%d' % i, 'project': 'p',
+                                    'url': 'http://example.com/%d' % i})
+        self.scheduler.run_once()
+        self.assertTrue(self.scheduler._wait_thread(timeout=10))
+        self.assertEqual(len(project.task_queue), 200)
+        self.assertEqual(self.taskdb.status_count('p')[self.taskdb.ACTIVE], 200)
+
+
+    def test_loop_calls(self):
+        scheduler = self.scheduler
+        scheduler._update_projects()
+        project = scheduler.projects['p']
+        for i in range(200):
+            self.newtask_queue.put({'taskid': 't%d' % i, 'project': 'p',
+                                    'url': 'http://example.com/%d' % i})
+        scheduler._check_request()
+        self.assertTrue(scheduler._wait_thread(timeout=10))
+        # counters are only updated in loop thread
+        self.assertNotIn('p', scheduler._cnt['1h'])
+        scheduler._check_loop_calls()
+        self.assertEqual(scheduler._cnt['all'].to_dict('sum')['p']['pending'], 200)
+        self.assertEqual(scheduler._cnt['1h'].to_dict('sum')['p']['pending'], 200)
+
+        # requests of processing tasks are postponed by workers while loop checks them
+        project.task_queue.bucket.set(200)
+        while project.task_queue.get():
+            pass
+        self.assertEqual(project.task_queue.processing.qsize(), 200)
+        for i in range(200):
+            self.newtask_queue.put({'taskid': 't%d' % i, 'project': 'p',
+                                    'url': 'http://example.com/%d' % i,
+                                    'schedule': {'force_update': True}})
+        scheduler._check_request()
+        start = time.time()
+        while not scheduler._wait_thread(timeout=0.001) and time.time() - start < 10:
+            scheduler._check_request()
+        scheduler._check_loop_calls()
+        self.assertEqual(sorted(task['taskid'] for task in scheduler._postpone_request),
+                         sorted('t%d' % i for i in range(200)))
+
+    def test_load_tasks(self):
+        scheduler = self.scheduler
+        scheduler.KNOWN_FILTER = True
+        scheduler.LOAD_TASKS_PAGE_SIZE = 10
+        for i in range(100):
+            self.taskdb.insert('p', 't%d' % i, {
+                'taskid': 't%d' % i, 'url': 'http://example.com/%d' % i,
+                'status': self.taskdb.ACTIVE if i < 80 else self.taskdb.SUCCESS})
+        scheduler._update_projects()
+        project = scheduler.projects['p']
+        self.assertTrue(project.task_loading)
+
+        # rows are read in background, and only applied in scheduler thread
+        time.sleep(0.5)
+        self.assertEqual(len(project.task_queue), 0)
+        self.assertNotIn('p', scheduler._cnt['all'])
+        self.assertEqual(len(project.known_tasks), 0)
+
+        start = time.time()
+        while not project.known_tasks_seeded and time.time() - start < 10:
+            scheduler._check_loaded()
+            time.sleep(0.01)
+        self.assertFalse(project.task_loading)
+        self.assertEqual(len(project.task_queue), 80)
+        self.assertEqual(scheduler._cnt['all'].to_dict('sum')['p'],
+                         {'pending': 80, 'success': 20})
+        self.assertEqual(len(project.known_tasks), 100)
+        self.assertTrue(scheduler._loaded_queue.empty())
+
+
+class TestRestoreTasks(unittest.TestCase):
+
+    def setUp(self):
+        from six.moves import queue as Queue
+        from pyspider.database import connect_database
+        from pyspider.scheduler import Scheduler, snapshot
+
+        self.data_path = tempfile.mkdtemp()
+        self.taskdb = connect_database('sqlite+taskdb:///%s/task.db' % self.data_path)
+        projectdb = connect_database('sqlite+projectdb:///%s/project.db' % self.data_path)
+        projectdb.insert('p', dict(name='p', group='', status='RUNNING', script='',
+                                   rate=1000, burst=1000, updatetime=time.time()))
+        self.out_queue = Queue.Queue()
+        self.scheduler = Scheduler(taskdb=self.taskdb, projectdb=projectdb,
+                                   newtask_queue=Queue.Queue(), status_queue=Queue.Queue(),
+                                   out_queue=self.out_queue, data_path=self.data_path)
+        self.scheduler._dump_cnt = lambda: None
+
+        # t1 is done and t2 is processing in snapshot, both succeeded after it
+        watermark = time.time() - 100
+        path = os.path.join(self.data_path, 'queue')
+        snapshot.dump(path, watermark, {'p': [
+            ('t1', 0, 0, False, None),
+            ('t2', 0, time.time() + 600, True, None),
+            ('t3', 0, 0, False, None),
+        ]})
+        for taskid in ('t1', 't2', 't3'):
+            self.taskdb.insert('p', taskid, {
+                'taskid': taskid, 'url': 'http://example.com/%s' % taskid,
+                'status': self.taskdb.ACTIVE if taskid == 't3' else self.taskdb.SUCCESS})
+        self.scheduler._snapshot = snapshot.Snapshot.open(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+
+    def test_restore(self):
+        scheduler = self.scheduler
+        loads = []
+        scheduler._load_in_background = lambda *args: loads.append(args)
+        scheduler._update_projects()
+        project = scheduler.projects['p']
+        project.waiting_get_info = False
+        self.assertEqual(self.out_queue.get_nowait()['taskid'], '_on_get_info')
+        start = time.time()
+        while not loads and time.time() - start < 5:
+            time.sleep(0.01)
+
+        rows = scheduler._load_rows(*loads[0])
+        scheduler._on_loaded(*next(rows))
+        self.assertEqual(len(project.task_queue), 3)
+        self.assertTrue(project.task_restoring)
+        # not selected before stale tasks of snapshot are replayed
+        scheduler._check_select()
+        self.assertTrue(self.out_queue.empty())
+
+        for item in rows:
+            scheduler._on_loaded(*item)
+        self.assertFalse(project.task_restoring)
+        self.assertFalse(project.task_loading)
+        self.assertNotIn('t1', project.task_queue)
+        self.assertTrue(project.task_queue.is_processing('t2'))
+        scheduler._check_select()
+        self.assertEqual(self.out_queue.get_nowait()['taskid'], 't3')
+        self.assertTrue(self.out_queue.empty())
+
+        # status pack of the task processing before restart is not lost
+        task = self.taskdb.get_task('p', 't2')
+        task['track'] = {'fetch': {'ok': True}, 'process': {'ok': True}}
+        self.assertIsNotNone(scheduler.on_task_status(task))
+        self.assertFalse(project.task_queue.is_processing('t2'))
+
+
+class TestShard(unittest.TestCase):
+
+    def test_owner(self):
+        from pyspider.scheduler.shard import Shard
+
+        projects = ['project%d' % i for i in range(3000)]
+        shards = [Shard(i, 3) for i in range(3)]
+        owners = [shards[0].owner(x) for x in projects]
+        for shard in shards:
+            self.assertEqual([shard.owner(x) for x in projects], owners)
+            self.assertGreater(owners.count(shard.index), 600)
+        self.assertEqual(Shard.parse('2/3').index, 2)
+        self.assertRaises(ValueError, Shard.parse, '3/3')
+
+        # only projects moved to the new shard change owner
+        moved = [x for x, owner in zip(projects, owners) if Shard(0, 4).owner(x) != owner]
+        self.assertLess(len(moved), 1000)
+        self.assertTrue(all(Shard(0, 4).owner(x) == 3 for x in moved))
+
+    def test_queue(self):
+        from six.moves import queue as Queue
+        from pyspider.scheduler.shard import Shard, ShardQueue
+
+        shared = Queue.Queue()
+        shard_queues = [Queue.Queue(), Queue.Queue()]
+        queues = [ShardQueue(shared, Shard(i, 2), shard_queues) for i in range(2)]
+        tasks = [{'taskid': 't%d' % i, 'project': 'project%d' % i} for i in range(20)]
+        for task in tasks:
+            queues[0].put(task)
+
+        got = [[], []]
+        for i in (0, 1, 0, 1):
+            try:
+                while True:
+                    got[i].append(queues[i].get_nowait())
+            except Queue.Empty:
+                pass
+        self.assertEqual(sorted(x['taskid'] for x in got[0] + got[1]),
+                         sorted(x['taskid'] for x in tasks))
+        for i in range(2):
+            self.assertTrue(all(Shard(i, 2).owns(x['project']) for x in got[i]))
+            self.assertTrue(queues[i].empty())
+
+        # batches of tasks are split by owners
+        queues[1].put(tasks)
+        got = [[], []]
+        for i in (0, 1, 0):
+            try:
+                while True:
+                    got[i].extend(queues[i].get_nowait())
+            except Queue.Empty:
+                pass
+        self.assertEqual(len(got[0]) + len(got[1]), len(tasks))
+        for i in range(2):
+            self.assertTrue(all(Shard(i, 2).owns(x['project']) for x in got[i]))
+
+    def test_rpc(self):
+        from pyspider.scheduler.shard import Shard, ShardedSchedulerRPC
+
+        class FakeRPC(object):
+            def __init__(self, index):
+                self.index = index
+                self.newtasks = []
+
+            def newtask(self, task):
+                self.newtasks.append(task)
+                return True
+
+            def newtask_batch(self, tasks):
+                return [self.newtask(task) and self.index for task in tasks]
+
+            def size(self):
+                return 10
+
+            def get_active_tasks(self, project=None, limit=100):
+                return [(self.index * 10 + i, {'project': 'p%d' % self.index}) for i in range(3)]
+
+            def webui_update(self):
+                name = 'p%d' % self.index
+                return {
+                    'pause_status': {name: False},
+                    'loading': {},
+                    'counter': {
+                        '5m_time': {name: {'time': 1.0}},
+                        'all': {name: {'pending': 1}, '__all__': {'pending': 1}},
+                    },
+                }
+
+        rpcs = [FakeRPC(i) for i in range(3)]
+        rpc = ShardedSchedulerRPC(rpcs)
+        self.assertEqual(rpc.size(), 30)
+        rpc.newtask({'taskid': 't', 'project': 'p0'})
+        self.assertEqual(len(rpcs[Shard(0, 3).owner('p0')].newtasks), 1)
+        projects = ['p%d' % i for i in range(10)]
+        self.assertEqual(rpc.newtask_batch([{'taskid': 't', 'project': p} for p in projects]),
+                         [Shard(0, 3).owner(p) for p in projects])
+        self.assertEqual([x[0] for x in rpc.get_active_tasks(limit=4)], [22, 21, 20, 12])
+
+        data = rpc.webui_update()
+        self.assertEqual(data['pause_status'], {'p0': False, 'p1': False, 'p2': False})
+        self.assertEqual(data['counter']['all']['__all__'], {'pending': 3})
+        self.assertEqual(len(data['counter']['5m_time']), 3)
+
+
+class TestKnownFilter(unittest.TestCase):
+    path = './data/tests/scheduler.known'
+
+    def test_filter(self):
+        from pyspider.scheduler.known_filter import ScalableBloomFilter
+
+        known = ScalableBloomFilter(capacity=1000, error_rate=1e-3)
+        added = len([i for i in range(10000) if known.add('known%d' % i)])
+        self.assertGreater(added, 9990)
+        self.assertFalse(known.add('known0'))
+        self.assertEqual(len(known), added)
+        self.assertEqual(len(known.filters), 4)
+        self.assertTrue(all('known%d' % i in known for i in range(10000)))
+        false_positives = len([i for i in range(10000) if 'new%d' % i in known])
+        self.assertLess(false_positives, 10)
+
+    def test_dump_and_load(self):
+        from pyspider.scheduler import known_filter
+
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        known = known_filter.ScalableBloomFilter(capacity=100)
+        for i in range(500):
+            known.add('t%d' % i)
+        known_filter.dump(self.path, 12345.0, {'a': known, 'b': known_filter.ScalableBloomFilter()})
+        watermark, filters = known_filter.load(self.path)
+        self.assertEqual(watermark, 12345.0)
+        self.assertEqual(sorted(filters), ['a', 'b'])
+        self.assertEqual(len(filters['a']), len(known))
+        self.assertTrue(all('t%d' % i in filters['a'] for i in range(500)))
+        self.assertEqual(len(filters['b']), 0)
+
+        with open(self.path, 'r+b') as fp:
+            fp.truncate(100)
+        self.assertIsNone(known_filter.load(self.path))
+        os.remove(self.path)
+        self.assertIsNone(known_filter.load(self.path))
+
+    def test_known_task(self):
+        from pyspider.scheduler.known_filter import ScalableBloomFilter
+
+        data_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_path, True)
+        scheduler = Scheduler(taskdb=None, projectdb=None, newtask_queue=None,
+                              status_queue=None, out_queue=None, data_path=data_path)
+        scheduler.projects['p'] = utils.ObjectDict(known_tasks=None)
+        task = {'taskid': 't', 'project': 'p', 'url': 'url'}
+        self.assertFalse(scheduler._known_task(task))
+        scheduler.projects['p'].known_tasks = ScalableBloomFilter()
+        self.assertFalse(scheduler._known_task(task))
+        scheduler._add_known_tasks('p', ['t'])
+        self.assertTrue(scheduler._known_task(task))
+        # requests may restart the task are not skipped
+        for schedule in ({'force_update': True}, {'itag': 'v2'}, {'age': 0}):
+            self.assertFalse(scheduler._known_task(dict(task, schedule=schedule)))
+        self.assertTrue(scheduler._known_task(dict(task, schedule={'priority': 1})))
+
+
+class TestAIMDRateControl(unittest.TestCase):
+
+    def test_feed(self):
+        from pyspider.scheduler.rate_control import AIMDRateControl
+
+        control = AIMDRateControl(10, 20)
+        now = control.window_start
+        self.assertEqual(control.rate, 5)
+        self.assertEqual(control.burst, 10)
+
+        # healthy and limited by rate, raised additively
+        for i in range(50):
+            self.assertFalse(control.feed(200, 0.1, now + i * 0.1))
+        self.assertTrue(control.feed(200, 0.1, now + 10))
+        self.assertAlmostEqual(control.rate, 5.5)
+
+        # throttled, cut at once and at most once an interval
+        self.assertTrue(control.feed(429, 0.1, now + 11))
+        self.assertAlmostEqual(control.rate, 2.75)
+        self.assertFalse(control.feed(503, 0.1, now + 12))
+        for i in range(50):
+            control.feed(200, 0.1, now + 12 + i * 0.1)
+        self.assertFalse(control.feed(200, 0.1, now + 20))
+        self.assertAlmostEqual(control.rate, 2.75)
+
+        # slow responses, not raised
+        for i in range(50):
+            control.feed(200, 1.0, now + 20 + i * 0.1)
+        self.assertFalse(control.feed(200, 1.0, now + 30))
+        # not limited by rate, not raised
+        self.assertFalse(control.feed(200, 0.1, now + 40))
+        self.assertAlmostEqual(control.rate, 2.75)
+
+        # bounded by max and min
+        control.set_max(3, 20)
+        for n in range(5):
+            start = now + 50 + n * 10
+            for i in range(50):
+                control.feed(200, 0.1, start + i * 0.1)
+        self.assertLessEqual(control.rate, 3)
+        for n in range(10):
+            control.feed(599, None, now + 100 + n * 10)
+        self.assertAlmostEqual(control.rate, 0.15)
+        self.assertAlmostEqual(control.burst, 1)
+
+
+class TestCronjob(unittest.TestCase):
+
+    def test_deadline_heap(self):
+        from pyspider.scheduler import scheduler as scheduler_module
+        from pyspider.scheduler.scheduler import Project
+
+        now = [1000.5]
+
+        class Clock(object):
+            def time(self):
+                return now[0]
+
+        data_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_path, True)
+        scheduler = Scheduler(taskdb=utils.ObjectDict(SUCCESS=2), projectdb=None,
+                              newtask_queue=None, status_queue=None, out_queue=None,
+                              data_path=data_path)
+        sent = []
+        scheduler.on_select_task = lambda task: sent.append(
+            (task['project'], task['fetch']['save']['tick']))
+        scheduler._last_tick = 1000
+        for name, min_tick in (('a', 10), ('b', 30), ('c', 0)):
+            project = scheduler.projects[name] = Project(scheduler, {
+                'name': name, 'group': '', 'status': 'RUNNING', 'script': '',
+                'rate': 1, 'burst': 1, 'updatetime': 0,
+            })
+            project.on_get_info({'min_tick': min_tick})
+            scheduler._schedule_cronjob(project)
+            # scheduled once
+            scheduler._schedule_cronjob(project)
+        self.assertEqual(sorted(scheduler._cron_heap), [(1010, 'a'), (1020, 'b')])
+
+        real_time, scheduler_module.time = scheduler_module.time, Clock()
+        try:
+            now[0] = 1009.9
+            self.assertFalse(scheduler._check_cronjob())
+            now[0] = 1010.1
+            self.assertTrue(scheduler._check_cronjob())
+            self.assertEqual(sent, [('a', 1010)])
+            self.assertFalse(scheduler._check_cronjob())
+
+            # missed ticks are sent once
+            now[0] = 1075
+            self.assertTrue(scheduler._check_cronjob())
+            self.assertEqual(sorted(sent[1:]), [('a', 1070), ('b', 1050)])
+            self.assertEqual(sorted(scheduler._cron_heap), [(1080, 'a'), (1080, 'b')])
+
+            # rescheduled when min_tick changed, not sent when not active
+            scheduler.projects['a'].on_get_info({'min_tick': 60})
+            scheduler._schedule_cronjob(scheduler.projects['a'])
+            scheduler.projects['b'].db_status = 'STOP'
+            del sent[:]
+            now[0] = 1200
+            self.assertTrue(scheduler._check_cronjob())
+            self.assertEqual(sent, [('a', 1200)])
+            self.assertEqual(scheduler._cron_heap, [(1260, 'a')])
+        finally:
+            scheduler_module.time = real_time
+
+
 try:
     from six.moves import xmlrpc_client
 except ImportError:
@@ -418,6 +1049,32 @@ class TestScheduler(unittest.TestCase):
         time.sleep(0.1)
         self.assertEqual(self.rpc.size(), 0)
 
+    def test_84_newtask_batch_via_msgpack_rpc(self):
+        from pyspider.libs.msgpack_rpc import MsgpackRPCClient
+
+        rpc = MsgpackRPCClient('msgpack://localhost:%d' % self.scheduler_xmlrpc_port)
+        self.assertEqual(rpc.newtask_batch([{
+            'taskid': 'taskid',
+            'project': 'test_project',
+            'url': 'url',
+            'schedule': {
+                'age': 30,
+            },
+        }, {
+            'taskid': 'taskid',
+            'project': 'not_exists',
+            'url': 'url',
+        }]), [True, False])
+        time.sleep(0.1)
+        self.assertEqual(rpc.size(), 0)
+
+        tasks = rpc.get_tasks_batch([['test_project', 'taskid'], ['test_project', 'not_exists']],
+                                    ['taskid', 'url'])
+        self.assertEqual(tasks, [{'taskid': 'taskid', 'url': 'url'}, None])
+        tasks = rpc.get_tasks_batch([['not_exists', 'taskid'], ['test_project', 'not_exists'],
+                                     ['test_project', 'taskid']], ['url'])
+        self.assertEqual(tasks, [None, None, {'url': 'url'}])
+
     def test_90_newtask_with_itag(self):
         '''
         task_queue = [ ]
@@ -793,7 +1450,9 @@ class TestProject(unittest.TestCase):
 
     @classmethod
     def setUpClass(self):
-        self.scheduler = Scheduler(taskdb=None, projectdb=None, newtask_queue=None, status_queue=None, out_queue=None)
+        self.data_path = tempfile.mkdtemp()
+        self.scheduler = Scheduler(taskdb=None, projectdb=None, newtask_queue=None, status_queue=None,
+                                   out_queue=None, data_path=self.data_path)
         self.scheduler.PAUSE_TIME = 2
         self.project = Project(self.scheduler, {
             'name': 'test_project_not_started',
@@ -806,6 +1465,10 @@ class TestProject(unittest.TestCase):
             'updatetime': time.time(),
         })
 
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+
     def test_pause_10_unpaused(self):
         self.assertFalse(self.project.paused)
 
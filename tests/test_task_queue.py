@@ -1,13 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import time
+import heapq
+import random
+import shutil
+import hashlib
+import tempfile
 import unittest
 
 import six
 from six.moves import queue as Queue
 
-from pyspider.scheduler.task_queue import InQueueTask, TaskQueue
+from pyspider.scheduler.task_queue import (InQueueTask, PriorityTaskQueue, TaskQueue,
+                                           TimingWheel, HostPriorityQueue)
+from pyspider.scheduler.compact_task_queue import CompactTaskQueue
+from pyspider.scheduler import snapshot
 
 
 class TestTaskQueue(unittest.TestCase):
@@ -48,9 +57,168 @@ class TestTaskQueue(unittest.TestCase):
             self.assertEqual(q.qsize(), 0)
         pass
 
+    def test_next_time(self):
+        for cls in (TaskQueue, CompactTaskQueue):
+            tq = cls(rate=10, burst=1)
+            self.assertIsNone(tq.next_time())
+            exetime = time.time() + 100
+            tq.put('a1', 0, exetime)
+            self.assertLessEqual(tq.next_time(), exetime)
+            tq.put('a2', 0)
+            self.assertLessEqual(tq.next_time(), time.time())
+            self.assertEqual(tq.get(), 'a2')
+            # waiting for token
+            tq.put('a3', 0)
+            self.assertAlmostEqual(tq.next_time(), time.time() + 0.1, delta=0.02)
+            tq.rate = 0
+            self.assertGreater(tq.next_time(), time.time() + 10)
+
     pass
 
 
+class TestPriorityTaskQueue(unittest.TestCase):
+
+    def assertHeapIndexed(self, q):
+        self.assertEqual(len(q.queue), len(q.queue_dict))
+        self.assertEqual(len(q.queue), len(q.queue_index))
+        for pos, item in enumerate(q.queue):
+            self.assertEqual(q.queue_index[item.taskid], pos)
+            if pos:
+                self.assertFalse(item < q.queue[(pos - 1) >> 1])
+
+    def test_update_and_delete(self):
+        q = PriorityTaskQueue()
+        for i in range(200):
+            q.put(InQueueTask(str(i), priority=random.randint(0, 10)))
+        self.assertHeapIndexed(q)
+
+        for i in range(0, 200, 3):
+            q.put(InQueueTask(str(i), priority=random.randint(5, 20)))
+        self.assertHeapIndexed(q)
+
+        for i in range(0, 200, 7):
+            del q[str(i)]
+        self.assertHeapIndexed(q)
+        self.assertEqual(q.qsize(), 200 - len(range(0, 200, 7)))
+
+        last = None
+        while q.qsize():
+            task = q.get_nowait()
+            self.assertNotIn(task.taskid, q)
+            if last is not None:
+                self.assertGreaterEqual(last.priority, task.priority)
+            last = task
+        self.assertEqual(q.queue, [])
+        self.assertEqual(q.queue_index, {})
+
+    def test_update_priority(self):
+        q = PriorityTaskQueue()
+        q.put(InQueueTask('a1', priority=1))
+        q.put(InQueueTask('a2', priority=2))
+        q.put(InQueueTask('a3', priority=3))
+        q.put(InQueueTask('a1', priority=5))
+        q.put(InQueueTask('a3', priority=0))
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual(q.get_nowait().taskid, 'a1')
+        self.assertEqual(q.get_nowait().taskid, 'a3')
+        self.assertEqual(q.get_nowait().taskid, 'a2')
+
+    def test_merged_put_raises_priority(self):
+        q = PriorityTaskQueue()
+        for i in range(10):
+            q.put(InQueueTask('a%d' % i, priority=i))
+        # merged with exetime=0 of queued task, only priority is raised
+        q.put(InQueueTask('a0', priority=100, exetime=time.time() + 100))
+        self.assertHeapIndexed(q)
+        self.assertEqual(q['a0'].exetime, 0)
+        self.assertEqual([q.get_nowait().taskid for _ in range(10)],
+                         ['a0'] + ['a%d' % i for i in range(9, 0, -1)])
+
+
+class TestTimingWheel(unittest.TestCase):
+
+    def test_expire(self):
+        now = 1000000000.5
+        wheel = TimingWheel(now)
+        exetimes = dict()
+        for i in range(2000):
+            exetimes[str(i)] = now + random.choice([0.1, 30, 3000, 86400, 30 * 86400, 400 * 86400]) * random.random()
+            wheel.put(InQueueTask(str(i), exetime=exetimes[str(i)]))
+        wheel.put(InQueueTask('1', exetime=exetimes['1'] + 10))
+        wheel.put(InQueueTask('2', exetime=now + 1))
+        exetimes['2'] = min(exetimes['2'], now + 1)
+        for i in range(0, 2000, 9):
+            del wheel[str(i)]
+            del exetimes[str(i)]
+        self.assertEqual(wheel.qsize(), len(exetimes))
+        self.assertEqual(wheel.top.exetime, min(exetimes.values()))
+
+        for step in [0.3, 0.5, 1, 59, 3600, 7 * 86400, 50 * 86400, 400 * 86400]:
+            now += step * random.random()
+            expired = wheel.expire(now)
+            for task in expired:
+                self.assertLess(task.exetime, now)
+                self.assertEqual(exetimes.pop(task.taskid), task.exetime)
+            self.assertEqual(wheel.qsize(), len(exetimes))
+            for exetime in exetimes.values():
+                self.assertGreaterEqual(exetime, now)
+        self.assertEqual(len(wheel.queue_slot), len(exetimes))
+        self.assertEqual(sum(wheel.counts) + len(wheel.parked), len(exetimes))
+
+    def test_get_in_time_order(self):
+        wheel = TimingWheel()
+        for i in range(100):
+            wheel.put(InQueueTask(str(i), exetime=time.time() + random.random() * 3 * 86400))
+        last = 0
+        while wheel.qsize():
+            task = wheel.get_nowait()
+            self.assertGreaterEqual(task.exetime, last)
+            last = task.exetime
+        self.assertRaises(Queue.Empty, wheel.get_nowait)
+
+    def test_same_order_as_heap(self):
+        day = 24 * 60 * 60
+        for _ in range(20):
+            now = 1000000000.5
+            wheel = TimingWheel(now)
+            exetimes = dict()
+            for i in range(300):
+                op = random.random()
+                if op < 0.6:
+                    taskid = str(random.randrange(200))
+                    exetime = now + random.choice([1, 3600, 30 * day, 400 * day, 1000 * day]) * random.random()
+                    wheel.put(InQueueTask(taskid, exetime=exetime))
+                    exetimes[taskid] = min(exetimes.get(taskid, exetime), exetime)
+                elif op < 0.8:
+                    now += random.choice([1, 3600, day, 100 * day, 400 * day]) * random.random()
+                    expired = set(task.taskid for task in wheel.expire(now))
+                    self.assertEqual(expired, set(k for k, v in exetimes.items() if v < now))
+                    for taskid in expired:
+                        del exetimes[taskid]
+                elif exetimes:
+                    heap = [(v, k) for k, v in exetimes.items()]
+                    heapq.heapify(heap)
+                    task = wheel.get_nowait()
+                    self.assertEqual(task.exetime, heap[0][0])
+                    del exetimes[task.taskid]
+                self.assertEqual(wheel.qsize(), len(exetimes))
+            while exetimes:
+                task = wheel.get_nowait()
+                self.assertEqual(task.exetime, min(exetimes.values()))
+                del exetimes[task.taskid]
+            self.assertRaises(Queue.Empty, wheel.get_nowait)
+
+    def test_next_time(self):
+        now = 1000000000.5
+        wheel = TimingWheel(now)
+        self.assertIsNone(wheel.next_time())
+        wheel.put(InQueueTask('a', exetime=now + 3000.5))
+        self.assertLessEqual(wheel.next_time(), now + 3000.5)
+        self.assertGreater(wheel.next_time(), now)
+        wheel.put(InQueueTask('b', exetime=now + 0.2))
+        self.assertEqual(wheel.next_time(), now + 0.2)
+
+
 class TestTimeQueue(unittest.TestCase):
     def test_time_queue(self):
 
@@ -119,5 +287,196 @@ class TestTimeQueue(unittest.TestCase):
     pass
 
 
+class TestCompactTaskQueue(unittest.TestCase):
+
+    def test_same_as_task_queue(self):
+        tq = TaskQueue(rate=1e9, burst=1e9)
+        cq = CompactTaskQueue(rate=1e9, burst=1e9)
+        taskids = [hashlib.md5(str(i).encode('utf8')).hexdigest() for i in range(300)]
+        taskids += ['on_start', '_on_get_info', u'\u4e2d\u6587']
+        for _ in range(5000):
+            taskid = random.choice(taskids)
+            op = random.random()
+            if op < 0.5:
+                priority = random.randint(0, 5)
+                exetime = random.choice([0, 0, time.time() + 1000 + random.random()])
+                tq.put(taskid, priority, exetime)
+                cq.put(taskid, priority, exetime)
+            elif op < 0.7:
+                self.assertEqual(tq.get(), cq.get())
+            elif op < 0.8:
+                self.assertEqual(tq.done(taskid), cq.done(taskid))
+            elif op < 0.85:
+                self.assertEqual(tq.delete(taskid), cq.delete(taskid))
+            self.assertEqual(taskid in tq, taskid in cq)
+            self.assertEqual(bool(tq.is_processing(taskid)), cq.is_processing(taskid))
+            self.assertEqual(len(tq), len(cq))
+
+    def test_float_and_large_priority(self):
+        tq = TaskQueue(rate=1e9, burst=1e9)
+        cq = CompactTaskQueue(rate=1e9, burst=1e9)
+        for taskid, priority in (('a', 1.5), ('b', 2 ** 40), ('c', -2 ** 40), ('d', 1.25),
+                                 ('e', 2)):
+            tq.put(taskid, priority)
+            cq.put(taskid, priority)
+        cq.put('d', 1.75)
+        tq.put('d', 1.75)
+        self.assertEqual([(taskid, priority) for taskid, priority, _, _, _ in cq.dump()],
+                         [('a', 1.5), ('b', 2 ** 40), ('c', -2 ** 40), ('d', 1.75), ('e', 2)])
+        self.assertEqual([cq.get() for _ in range(6)], [tq.get() for _ in range(6)])
+
+    def test_time_queue_and_processing(self):
+        cq = CompactTaskQueue(rate=1e9, burst=1e9)
+        cq.processing_timeout = 0.1
+        cq.put('a1', 1, time.time() + 0.05)
+        cq.put('a2', 2)
+        self.assertEqual(cq.get(), 'a2')
+        self.assertIsNone(cq.get())
+        time.sleep(0.05)
+        cq.check_update()
+        self.assertEqual(cq.get(), 'a1')
+        self.assertTrue(cq.is_processing('a1'))
+        time.sleep(0.1)
+        cq.check_update()
+        self.assertFalse(cq.is_processing('a2'))
+        self.assertEqual(cq.get(), 'a2')
+        self.assertTrue(cq.done('a2'))
+        self.assertFalse(cq.done('a2'))
+        self.assertEqual(len(cq), 1)
+
+
+class TestHostLimits(unittest.TestCase):
+
+    def test_rate(self):
+        tq = TaskQueue(rate=1e9, burst=1e9)
+        tq.set_host_limits(rate=10, burst=2)
+        for i in range(5):
+            tq.put('a%d' % i, 10 - i, host='a.com')
+            tq.put('b%d' % i, 0, host='b.com')
+        tq.put('data', 0)
+        self.assertIsInstance(tq.priority_queue, HostPriorityQueue)
+
+        # burst of each host first, then other hosts and tasks without host
+        self.assertEqual([tq.get() for _ in range(6)], ['a0', 'a1', 'b0', 'b1', 'data', None])
+        time.sleep(0.11)
+        self.assertEqual(sorted([tq.get(), tq.get()]), ['a2', 'b2'])
+        self.assertIsNone(tq.get())
+        self.assertEqual(len(tq), 11)
+
+        tq.set_host_limits()
+        self.assertIsInstance(tq.priority_queue, PriorityTaskQueue)
+        self.assertEqual([tq.get() for _ in range(5)], ['a3', 'a4', 'b3', 'b4', None])
+
+    def test_concurrency(self):
+        tq = TaskQueue(rate=1e9, burst=1e9)
+        tq.processing_timeout = 0.05
+        for i in range(3):
+            tq.put('a%d' % i, host='a.com')
+        tq.put('b0', host='b.com')
+        self.assertEqual(tq.get(), 'a0')
+        tq.set_host_limits(concurrency=1)
+        self.assertEqual(tq.get(), 'b0')
+        self.assertIsNone(tq.get())
+        tq.done('a0')
+        self.assertEqual(tq.get(), 'a1')
+        tq.delete('a2')
+        self.assertIsNone(tq.get())
+        tq.put('a3', host='a.com')
+        self.assertIsNone(tq.get())
+        tq.done('b0')
+        time.sleep(0.06)
+        tq.check_update()
+        # a1 timeout and retried
+        self.assertIn(tq.get(), ('a1', 'a3'))
+        self.assertIsNone(tq.get())
+
+
+    def test_hosts_pruned(self):
+        for limits in ({}, {'concurrency': 1}):
+            tq = TaskQueue(rate=1e9, burst=1e9)
+            tq.set_host_limits(**limits)
+            tq.put('a1', host='a.com')
+            tq.put('a2', host=''.join(['a', '.com']))
+            tq.put('b1', exetime=time.time() + 100, host='b.com')
+            tq.put('b1', exetime=time.time() + 10, host='b.com')
+            tq.load('c1', processing=True, host='c.com')
+            self.assertEqual(sorted(tq.hosts), ['a.com', 'b.com', 'c.com'])
+            self.assertIs(tq.priority_queue['a1'].host, tq.priority_queue['a2'].host)
+
+            self.assertEqual(tq.get(), 'a1')
+            self.assertTrue(tq.done('a1'))
+            self.assertIn('a.com', tq.hosts)
+            self.assertTrue(tq.delete('a2'))
+            self.assertTrue(tq.delete('b1'))
+            self.assertTrue(tq.done('c1'))
+            self.assertEqual(tq.hosts, {})
+            self.assertEqual(len(tq), 0)
+
+    def test_host_state_pruned(self):
+        tq = TaskQueue(rate=1e9, burst=1e9)
+        tq.set_host_limits(rate=5, burst=1)
+        for i in range(1000):
+            tq.put('t%d' % i, host='h%d.com' % i)
+        taskids = [tq.get() for _ in range(1000)]
+        for taskid in taskids:
+            self.assertTrue(tq.done(taskid))
+        self.assertEqual(tq.hosts, {})
+        self.assertEqual(tq.priority_queue.host_queues, {})
+        # states are kept until the buckets are full again, to limit rate of hosts
+        self.assertEqual(len(tq.priority_queue.host_state), 1000)
+
+        time.sleep(0.21)
+        self.assertIsNone(tq.get())
+        self.assertEqual(tq.priority_queue.host_state, {})
+        self.assertEqual(tq.priority_queue.idle, [])
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_dump_and_restore(self):
+        for cls in (TaskQueue, CompactTaskQueue):
+            tq = cls(rate=1e9, burst=1e9)
+            for i in range(100):
+                tq.put('task%d' % i, i % 7, random.choice([0, time.time() + 1000]),
+                       random.choice([None, 'a.com', u'\u4e2d\u6587.com']))
+            tq.put(u'\u4e2d\u6587', 3)
+            for i in range(10):
+                tq.get()
+
+            path = os.path.join(self.path, 'scheduler.queue')
+            snapshot.dump(path, 123.5, {'a': tq.dump(), 'b': []})
+            snap = snapshot.Snapshot.open(path)
+            self.assertEqual(snap.watermark, 123.5)
+            self.assertIn('a', snap)
+            self.assertEqual(list(snap.tasks('b')), [])
+
+            restored = cls(rate=1e9, burst=1e9)
+            for taskid, priority, exetime, processing, host in snap.tasks('a'):
+                restored.load(taskid, priority, exetime, processing, host)
+            self.assertEqual(sorted(restored.dump()), sorted(tq.dump()))
+            while True:
+                taskid = tq.get()
+                self.assertEqual(restored.get(), taskid)
+                if taskid is None:
+                    break
+            snap.close()
+
+    def test_broken(self):
+        path = os.path.join(self.path, 'scheduler.queue')
+        self.assertIsNone(snapshot.Snapshot.open(path))
+        snapshot.dump(path, 0, {'a': [('a1', 1, 0, False, None)]})
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        with open(path, 'wb') as fp:
+            fp.write(data[:-1])
+        self.assertIsNone(snapshot.Snapshot.open(path))
+
+
 if __name__ == '__main__':
     unittest.main()
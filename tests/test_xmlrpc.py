@@ -56,3 +56,63 @@ class TestXMLRPCServer(unittest.TestCase):
         
         assert client.test_1() == 'test_1'
         assert client.test_3({'asdf':4}) == {'asdf':4}
+
+
+class TestMsgpackRPC(unittest.TestCase):
+    port = 3424
+
+    @classmethod
+    def setUpClass(self):
+        import time
+        from six.moves.xmlrpc_client import Binary
+        from pyspider.libs.msgpack_rpc import WSGIRPCApplication
+
+        def echo(obj):
+            return obj
+
+        def error():
+            raise ValueError('error')
+
+        application = WSGIRPCApplication()
+        application.register_function(echo)
+        application.register_function(error)
+        application.register_function(lambda: Binary(b'\x00\x01'), 'binary')
+        application.register_function(lambda: True, '_quit')
+
+        def run():
+            container = tornado.wsgi.WSGIContainer(application)
+            self.io_loop = tornado.ioloop.IOLoop.current()
+            http_server = tornado.httpserver.HTTPServer(container)
+            http_server.listen(self.port)
+            self.io_loop.start()
+        self.thread = utils.run_in_thread(run)
+        time.sleep(0.5)
+
+    @classmethod
+    def tearDownClass(self):
+        self.io_loop.add_callback(self.io_loop.stop)
+        self.thread.join()
+
+    def test_msgpack_rpc(self):
+        from six.moves.xmlrpc_client import ServerProxy
+        from pyspider.libs.msgpack_rpc import MsgpackRPCClient, RPCError
+
+        client = MsgpackRPCClient('msgpack://127.0.0.1:%d/' % self.port)
+        obj = {'a': [1, 2.5, None, u'中'], 'b': {'c': b'\xff'}}
+        self.assertEqual(client.echo(obj), obj)
+        connection = client._local.connection
+        self.assertEqual(client.echo(1), 1)
+        # connection is reused
+        self.assertIs(client._local.connection, connection)
+        self.assertEqual(client.binary(), b'\x00\x01')
+        self.assertRaises(RPCError, client.error)
+        self.assertRaises(RPCError, client.not_exists)
+        self.assertTrue(client._quit())
+        self.assertRaises(AttributeError, getattr, client, '__deepcopy__')
+
+        # closed connection is reconnected
+        client._local.connection.sock.close()
+        self.assertEqual(client.echo(2), 2)
+
+        # xmlrpc on the same port
+        self.assertEqual(ServerProxy('http://127.0.0.1:%d/' % self.port).echo({'a': 1}), {'a': 1})
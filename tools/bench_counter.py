@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Memory and read cost of time window counters
+
+    python tools/bench_counter.py --counters 10000 --window 1h
+
+Counters of a CounterManager are filled with one event every window interval until
+the windows are full, on a simulated clock. Memory is the memory allocated per
+counter, to_dict is the time of dumping all counters as the webui does.
+"""
+
+import time
+import tracemalloc
+
+import click
+from six.moves import cPickle
+
+from pyspider.libs import counter
+
+WINDOWS = {
+    '5m': (counter.TimebaseAverageWindowCounter, 30, 10),
+    '5m_time': (counter.TimebaseAverageEventCounter, 30, 10),
+    '1h': (counter.TimebaseAverageWindowCounter, 60, 60),
+    '1d': (counter.TimebaseAverageWindowCounter, 10 * 60, 24 * 6),
+}
+
+
+class Clock(object):
+    '''simulated time module of counters'''
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        # a new float object each call, as time.time()
+        return self.now + 0.0
+
+
+def bench(counters, window, reads):
+    cls, size, interval = WINDOWS[window]
+    clock = counter.time = Clock()
+    keys = [('project%d' % (i // 4), ('success', 'failed', 'pending', 'retry')[i % 4])
+            for i in range(counters)]
+
+    tracemalloc.start()
+    manager = counter.CounterManager(lambda: cls(size, interval))
+    start = time.time()
+    for _ in range(size + 1):
+        for key in keys:
+            manager.event(key, 1)
+        clock.now += interval + 0.01
+    fill = time.time() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    result = {
+        'events': counters * (size + 1) / fill,
+        'memory': memory / counters,
+        'pickle': len(cPickle.dumps(manager.counters)) / counters,
+    }
+    for get_value in ('sum', 'avg'):
+        start = time.time()
+        for _ in range(reads):
+            manager.to_dict(get_value)
+        result[get_value] = (time.time() - start) / reads
+    counter.time = time
+    return result
+
+
+@click.command()
+@click.option('--counters', default=10000, show_default=True, help='number of counters')
+@click.option('--window', default='1h', show_default=True, type=click.Choice(sorted(WINDOWS)),
+              help='window size and interval of counters, as of scheduler')
+@click.option('--reads', default=10, show_default=True, help='number of to_dict calls')
+def main(counters, window, reads):
+    result = bench(counters, window, reads)
+    click.echo('event:         %10.0f/s' % result['events'])
+    click.echo('memory:        %10.0f bytes per counter' % result['memory'])
+    click.echo('pickle:        %10.0f bytes per counter' % result['pickle'])
+    click.echo('to_dict(sum):  %10.2fms' % (result['sum'] * 1000))
+    click.echo('to_dict(avg):  %10.2fms' % (result['avg'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Sustained requests/s of fetcher against a local fast HTTP server
+
+    python tools/bench_fetcher.py --tasks 5000 --poolsize 100
+
+Tasks are put into inqueue of a Fetcher running in a thread, as the scheduler
+does, and results are taken from outqueue. It's measured with inqueue polled
+every 100ms and with inqueue taken as soon as a fetch is done (event_driven).
+"""
+
+import time
+
+import click
+
+from pyspider.libs import utils
+from pyspider.libs.multiprocessing_queue import Queue
+
+
+def serve(port):
+    import tornado.web
+    import tornado.ioloop
+
+    class Handler(tornado.web.RequestHandler):
+        def get(self):
+            self.write('ok')
+
+    tornado.web.Application([(r'/.*', Handler)]).listen(port, '127.0.0.1')
+    tornado.ioloop.IOLoop.current().start()
+
+
+def bench(tasks, poolsize, port, event_driven):
+    from pyspider.fetcher.tornado_fetcher import Fetcher
+
+    inqueue = Queue()
+    outqueue = Queue()
+    fetchers = []
+
+    def run():
+        fetcher = Fetcher(inqueue, outqueue, poolsize=poolsize)
+        fetcher.event_driven = event_driven
+        fetchers.append(fetcher)
+        fetcher.run()
+    thread = utils.run_in_thread(run)
+    time.sleep(0.5)
+
+    start = time.time()
+    for i in range(tasks):
+        inqueue.put({'taskid': 'task%d' % i, 'project': 'bench',
+                     'url': 'http://127.0.0.1:%d/%d' % (port, i)})
+    errors = 0
+    for _ in range(tasks):
+        task, result = outqueue.get()
+        if result.get('status_code') != 200:
+            errors += 1
+    elapsed = time.time() - start
+
+    fetchers[0].quit()
+    thread.join()
+    return tasks / elapsed, errors
+
+
+@click.command()
+@click.option('--tasks', default=5000, show_default=True, help='number of tasks fetched')
+@click.option('--poolsize', default=100, show_default=True, help='poolsize of fetcher')
+@click.option('--port', default=14890, show_default=True, help='port of http server')
+def main(tasks, poolsize, port):
+    import logging
+    logging.getLogger('fetcher').setLevel(logging.ERROR)
+
+    server = utils.run_in_subprocess(serve, port)
+    time.sleep(0.5)
+    try:
+        for name, event_driven in (('polling', False), ('event_driven', True)):
+            rate, errors = bench(tasks, poolsize, port, event_driven)
+            click.echo('%-14s %10.0f requests/s  %d errors' % (name, rate, errors))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Payload size and latency of XML-RPC and msgpack RPC
+
+    python tools/bench_rpc.py --projects 1000 --tasks 1000
+
+A server with webui_update of counters of projects, newtask and newtask_batch is
+started on a local port, and called by xmlrpc ServerProxy and MsgpackRPCClient.
+"""
+
+import time
+import random
+
+import click
+import umsgpack
+import tornado.wsgi
+import tornado.ioloop
+import tornado.httpserver
+from six.moves import xmlrpc_client
+
+from pyspider.libs.utils import run_in_thread
+from pyspider.libs.msgpack_rpc import WSGIRPCApplication, MsgpackRPCClient
+
+
+def webui_update(projects):
+    status = ('pending', 'success', 'retry', 'failed')
+    counter = lambda: dict(('project%d' % i, dict((s, random.randint(0, 10000)) for s in status))
+                           for i in range(projects))
+    return {
+        'pause_status': dict(('project%d' % i, False) for i in range(projects)),
+        'loading': {},
+        'counter': {
+            '5m_time': dict(('project%d' % i, {'fetch_time': random.random(),
+                                               'process_time': random.random()})
+                            for i in range(projects)),
+            '5m': counter(),
+            '1h': counter(),
+            '1d': counter(),
+            'all': counter(),
+        },
+    }
+
+
+def serve(port, result):
+    application = WSGIRPCApplication()
+    application.register_function(lambda: result, 'webui_update')
+    application.register_function(lambda task: True, 'newtask')
+    application.register_function(lambda tasks: [True] * len(tasks), 'newtask_batch')
+
+    def run():
+        container = tornado.wsgi.WSGIContainer(application)
+        serve.ioloop = tornado.ioloop.IOLoop.current()
+        tornado.httpserver.HTTPServer(container).listen(port, '127.0.0.1')
+        serve.ioloop.start()
+    thread = run_in_thread(run)
+    time.sleep(0.5)
+    return thread
+
+
+def timeit(func, number):
+    times = []
+    for _ in range(number):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+
+@click.command()
+@click.option('--projects', default=1000, show_default=True, help='number of projects in counters')
+@click.option('--tasks', default=1000, show_default=True, help='number of newtasks')
+@click.option('--number', default=20, show_default=True, help='number of calls measured')
+@click.option('--port', default=23399, show_default=True)
+def main(projects, tasks, number, port):
+    result = webui_update(projects)
+    thread = serve(port, result)
+    clients = {
+        'xmlrpc': xmlrpc_client.ServerProxy('http://127.0.0.1:%d/' % port, allow_none=True),
+        'msgpack': MsgpackRPCClient('msgpack://127.0.0.1:%d/' % port),
+    }
+    sizes = {
+        'xmlrpc': len(xmlrpc_client.dumps((result, ), methodresponse=True, allow_none=True)),
+        'msgpack': len(umsgpack.packb([None, result])),
+    }
+    newtasks = [{'taskid': 'task%d' % i, 'project': 'project%d' % (i % projects),
+                 'url': 'http://example.com/%d' % i, 'schedule': {'age': 0}}
+                for i in range(tasks)]
+
+    click.echo('%-8s %14s %14s %14s %14s' % ('rpc', 'webui_update', 'latency',
+                                           'newtask x%d' % tasks, 'newtask_batch'))
+    for name, client in sorted(clients.items()):
+        latency = timeit(client.webui_update, number)
+        one_by_one = timeit(lambda: [client.newtask(task) for task in newtasks], 1)
+        batch = timeit(lambda: client.newtask_batch(newtasks), number)
+        click.echo('%-8s %12.1fKB %12.2fms %12.2fms %12.2fms' % (
+            name, sizes[name] / 1024.0, latency, one_by_one, batch))
+
+    serve.ioloop.add_callback(serve.ioloop.stop)
+    thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Select latency and idle CPU of scheduler loop
+
+    python tools/bench_scheduler_loop.py --tasks 500 --idle 5
+
+Newtasks are put into newtask_queue one by one with random gaps, latency is the time
+until the task is sent to out_queue. Idle CPU is the CPU time used by the process
+while scheduler has nothing to do.
+
+polling: sleep LOOP_INTERVAL between loops (default).
+event: Scheduler.EVENT_DRIVEN with multiprocessing queues, waiting for new items.
+backoff: Scheduler.EVENT_DRIVEN with queues can't be waited, adaptive backoff polling.
+"""
+
+import os
+import time
+import random
+import shutil
+import tempfile
+import threading
+
+import click
+from six.moves import queue as Queue
+
+from pyspider.database.sqlite import taskdb, projectdb
+from pyspider.libs.multiprocessing_queue import Queue as MPQueue
+from pyspider.libs.utils import run_in_thread
+from pyspider.scheduler.scheduler import Scheduler
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench(mode, tasks, idle, gap):
+    queue_cls = Queue.Queue if mode == 'backoff' else MPQueue
+    newtask_queue, status_queue, out_queue = queue_cls(), queue_cls(), queue_cls()
+
+    # sqlite connections are per thread, use files
+    path = tempfile.mkdtemp()
+    _projectdb = projectdb.ProjectDB(os.path.join(path, 'project.db'))
+    _projectdb.insert('bench', {
+        'name': 'bench', 'group': '', 'status': 'RUNNING', 'script': '',
+        'rate': 1e6, 'burst': 1e6, 'updatetime': time.time(),
+    })
+    scheduler = Scheduler(taskdb=taskdb.TaskDB(os.path.join(path, 'task.db')),
+                          projectdb=_projectdb, newtask_queue=newtask_queue,
+                          status_queue=status_queue, out_queue=out_queue, data_path=path)
+    scheduler.EVENT_DRIVEN = mode != 'polling'
+    scheduler._dump_cnt = lambda: None
+    scheduler._last_tick = int(time.time())
+
+    sent, latency = dict(), []
+    stop = threading.Event()
+
+    def fetcher():
+        while not stop.is_set():
+            try:
+                task = out_queue.get(timeout=0.5)
+            except Queue.Empty:
+                continue
+            if task['taskid'] == '_on_get_info':
+                status_queue.put({
+                    'taskid': '_on_get_info', 'project': 'bench', 'url': task['url'],
+                    'track': {'save': {'min_tick': 0, 'retry_delay': {}, 'crawl_config': {}}},
+                })
+            elif task['taskid'] in sent:
+                latency.append(time.time() - sent[task['taskid']])
+
+    fetcher_thread = run_in_thread(fetcher)
+    scheduler_thread = run_in_thread(scheduler.run)
+    while 'bench' not in scheduler.projects or scheduler.projects['bench'].waiting_get_info:
+        time.sleep(0.01)
+
+    for i in range(tasks):
+        taskid = 'task%d' % i
+        sent[taskid] = time.time()
+        newtask_queue.put({'taskid': taskid, 'project': 'bench', 'url': 'http://example.com/%d' % i})
+        time.sleep(random.random() * gap * 2)
+    while len(latency) < tasks:
+        time.sleep(0.01)
+
+    time.sleep(0.5)
+    start, cpu_start = time.time(), time.process_time()
+    time.sleep(idle)
+    cpu = (time.process_time() - cpu_start) / (time.time() - start)
+
+    scheduler.quit()
+    stop.set()
+    scheduler_thread.join()
+    fetcher_thread.join()
+    shutil.rmtree(path)
+    return {
+        'p50': _percentile(latency, 0.5) * 1000,
+        'p99': _percentile(latency, 0.99) * 1000,
+        'cpu': cpu * 100,
+    }
+
+
+@click.command()
+@click.option('--tasks', default=500, show_default=True, help='number of newtasks')
+@click.option('--gap', default=0.01, show_default=True, help='average seconds between newtasks')
+@click.option('--idle', default=5.0, show_default=True, help='seconds of idle CPU measurement')
+def main(tasks, gap, idle):
+    click.echo('%-10s %10s %10s %10s' % ('mode', 'p50', 'p99', 'idle cpu'))
+    for mode in ('polling', 'event', 'backoff'):
+        result = bench(mode, tasks, idle, gap)
+        click.echo('%-10s %8.2fms %8.2fms %9.2f%%' % (mode, result['p50'], result['p99'], result['cpu']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Simulation of scheduler select policies
+
+    python tools/bench_select_policy.py --projects 1000 --loops 200
+
+Projects have heavy-tailed queue sizes (a few with huge backlogs, most with a handful
+of tasks) and new tasks arriving every loop. The select loop of Scheduler is
+simulated with `--loop-limit` tasks per loop.
+
+dispatch: tasks selected per loop and time spent per task in policy.
+fairness: Jain's index of tasks selected / weight among projects backlogged during the
+whole simulation (1.0 is perfectly fair).
+first: loops until a project with tasks is served for the first time, p50 / max.
+starved: projects with tasks never served.
+"""
+
+import time
+import random
+
+import click
+
+from pyspider.libs.utils import ObjectDict
+from pyspider.scheduler.select_policy import QueueSizePolicy, DeficitRoundRobinPolicy
+
+
+class FakeTaskQueue(object):
+
+    def __init__(self, size, rate):
+        self.size = size
+        self.rate = rate
+
+    def get(self):
+        if self.size <= 0:
+            return None
+        self.size -= 1
+        return 'taskid'
+
+    def __len__(self):
+        return self.size
+
+
+def _projects(count, seed):
+    rnd = random.Random(seed)
+    projects = []
+    for i in range(count):
+        size = int(rnd.paretovariate(0.8)) if rnd.random() < 0.05 else rnd.randint(0, 10)
+        rate = rnd.choice([1, 1, 1, 2, 5])
+        projects.append(ObjectDict(name='project%d' % i, task_queue=FakeTaskQueue(size * 100, rate)))
+    return projects
+
+
+def simulate(policy, count, loops, limit, seed=0):
+    rnd = random.Random(seed)
+    projects = _projects(count, seed)
+    served = dict((p.name, 0) for p in projects)
+    first = dict()
+    waiting_since = dict((p.name, 0) for p in projects if len(p.task_queue))
+    always_backlogged = set(p.name for p in projects)
+    selected = [0]
+    cost = 0
+
+    def take(project, n):
+        cnt = 0
+        while cnt < n and project.task_queue.get():
+            cnt += 1
+        served[project.name] += cnt
+        if cnt and project.name not in first and project.name in waiting_since:
+            first[project.name] = selected[0] - waiting_since[project.name]
+        return cnt
+
+    for loop in range(loops):
+        # new tasks
+        for project in rnd.sample(projects, max(1, count // 20)):
+            if not len(project.task_queue) and project.name not in waiting_since:
+                waiting_since[project.name] = loop
+            project.task_queue.size += rnd.randint(1, 10)
+
+        selectable = [p for p in projects if len(p.task_queue)]
+        always_backlogged &= set(p.name for p in selectable)
+        start = time.time()
+        policy.select(selectable, limit, take)
+        cost += time.time() - start
+        selected[0] = loop + 1
+
+    total = sum(served.values())
+    weights = dict((p.name, p.task_queue.rate) for p in projects)
+    shares = [1.0 * served[name] / weights[name] for name in always_backlogged]
+    if shares and sum(x * x for x in shares):
+        jain = sum(shares) ** 2 / (len(shares) * sum(x * x for x in shares))
+    else:
+        jain = 1.0
+    firsts = sorted(first.values())
+    starved = len([name for name in waiting_since if name not in first])
+    return {
+        'per_loop': 1.0 * total / loops,
+        'cost': cost / max(total, 1) * 1e6,
+        'jain': jain,
+        'backlogged': len(shares),
+        'first_p50': firsts[len(firsts) // 2] if firsts else 0,
+        'first_max': firsts[-1] if firsts else 0,
+        'starved': starved,
+    }
+
+
+@click.command()
+@click.option('--projects', default=1000, show_default=True, help='number of projects')
+@click.option('--loops', default=200, show_default=True, help='number of select loops')
+@click.option('--loop-limit', default=1000, show_default=True, help='tasks selected in a loop')
+def main(projects, loops, loop_limit):
+    click.echo('%-24s %10s %10s %8s %10s %10s %10s %8s' % (
+        'policy', 'per loop', 'cost', 'jain', 'backlogged', 'first p50', 'first max', 'starved'))
+    for policy in (QueueSizePolicy, DeficitRoundRobinPolicy):
+        result = simulate(policy(), projects, loops, loop_limit)
+        click.echo('%-24s %10.1f %8.2fus %8.3f %10d %10d %10d %8d' % (
+            policy.__name__, result['per_loop'], result['cost'], result['jain'],
+            result['backlogged'], result['first_p50'], result['first_max'], result['starved']))
+
+
+if __name__ == '__main__':
+    main()
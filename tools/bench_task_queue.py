@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+# vim: set et sw=4 ts=4 sts=4 ff=unix fenc=utf8:
+
+"""
+Microbenchmark of scheduler task queue
+
+    python tools/bench_task_queue.py --size 10000 --size 100000 --size 1000000
+    # 10**7 tasks of PriorityTaskQueue take about 3GB of memory
+    python tools/bench_task_queue.py --table queue --size 10000000
+
+put: insert new taskids, update: re-put known taskids with a higher priority,
+delete: remove taskids, get: pop everything in priority order.
+
+time queue: put taskids with exetime in next 3 days, expire: pop them every 10 minutes
+of simulated time, compared between a heap and the timing wheel.
+
+task queue: memory per task and put / get + done of TaskQueue and CompactTaskQueue.
+"""
+
+import gc
+import time
+import random
+import hashlib
+import tracemalloc
+
+import click
+
+from pyspider.scheduler.task_queue import InQueueTask, PriorityTaskQueue, TaskQueue, TimingWheel
+from pyspider.scheduler.compact_task_queue import CompactTaskQueue
+
+
+def _taskids(size):
+    return [hashlib.md5(str(i).encode('utf8')).hexdigest() for i in range(size)]
+
+
+def _timeit(func, *args):
+    gc.collect()
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def bench_queue(size, updates):
+    taskids = _taskids(size)
+    queue = PriorityTaskQueue()
+    result = {}
+
+    def put():
+        for taskid in taskids:
+            queue.put(InQueueTask(taskid, random.randint(0, 10)))
+    result['put'] = _timeit(put) / size
+
+    update_ids = random.sample(taskids, min(updates, size))
+
+    def update():
+        for taskid in update_ids:
+            queue.put(InQueueTask(taskid, queue[taskid].priority + 1))
+    result['update'] = _timeit(update) / len(update_ids)
+
+    delete_ids = update_ids[:len(update_ids) // 2]
+
+    def delete():
+        for taskid in delete_ids:
+            del queue[taskid]
+    result['delete'] = _timeit(delete) / len(delete_ids)
+
+    remain = queue.qsize()
+
+    def get():
+        while queue.qsize():
+            queue.get_nowait()
+    result['get'] = _timeit(get) / remain
+    return result
+
+
+def bench_time_queue(size, queue):
+    now = time.time()
+    tasks = [InQueueTask(taskid, exetime=now + random.random() * 3 * 24 * 60 * 60)
+             for taskid in _taskids(size)]
+    result = {}
+
+    def put():
+        for task in tasks:
+            queue.put(task)
+    result['put'] = _timeit(put) / size
+
+    def expire():
+        for step in range(0, 3 * 24 * 60 * 60 + 1, 10 * 60):
+            if isinstance(queue, TimingWheel):
+                queue.expire(now + step)
+                continue
+            while queue.qsize() and queue.top.exetime < now + step:
+                queue.get_nowait()
+    result['expire'] = _timeit(expire) / size
+    return result
+
+
+def bench_task_queue(size, cls):
+    taskids = _taskids(size)
+    result = {}
+
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    queue = cls(rate=size, burst=size)
+    for taskid in taskids:
+        # a new taskid string as loaded from taskdb
+        queue.put(''.join(taskid), random.randint(0, 10))
+    result['memory'] = (tracemalloc.get_traced_memory()[0] - start) / size
+    tracemalloc.stop()
+
+    queue = cls(rate=size, burst=size)
+
+    def put():
+        for taskid in taskids:
+            queue.put(taskid, random.randint(0, 10))
+    result['put'] = _timeit(put) / size
+
+    def get_done():
+        for _ in range(size):
+            queue.done(queue.get())
+    result['get'] = _timeit(get_done) / size
+    return result
+
+
+@click.command()
+@click.option('--size', multiple=True, type=int,
+              default=[10 ** 4, 10 ** 5, 10 ** 6], show_default=True,
+              help='queue sizes to test, up to 10**7 if memory allows.')
+@click.option('--updates', default=10000, show_default=True,
+              help='number of re-prioritized / deleted taskids.')
+@click.option('--table', multiple=True, type=click.Choice(['queue', 'time', 'task']),
+              default=['queue', 'time', 'task'], show_default=True,
+              help='benchmarks to run: priority queue, time queue and task queue.')
+def bench(size, updates, table):
+    """
+    Benchmark priority queue, time queue and task queue of scheduler
+    """
+    if 'queue' in table:
+        bench_queues(size, updates)
+    if 'time' in table:
+        bench_time_queues(size)
+    if 'task' in table:
+        bench_task_queues(size)
+
+
+def bench_queues(size, updates):
+    click.echo('%10s %12s %12s %12s %12s' % ('size', 'put', 'update', 'delete', 'get'))
+    for each in size:
+        result = bench_queue(each, updates)
+        click.echo('%10d %10.2fus %10.2fus %10.2fus %10.2fus' % (
+            each, result['put'] * 1e6, result['update'] * 1e6,
+            result['delete'] * 1e6, result['get'] * 1e6))
+
+
+def bench_time_queues(size):
+    click.echo('%10s %12s %12s %12s %12s' % ('time queue', 'heap put', 'heap expire',
+                                             'wheel put', 'wheel expire'))
+    for each in size:
+        heap = bench_time_queue(each, PriorityTaskQueue())
+        wheel = bench_time_queue(each, TimingWheel())
+        click.echo('%10d %10.2fus %10.2fus %10.2fus %10.2fus' % (
+            each, heap['put'] * 1e6, heap['expire'] * 1e6,
+            wheel['put'] * 1e6, wheel['expire'] * 1e6))
+
+
+def bench_task_queues(size):
+    click.echo('%10s %12s %12s %12s %12s %12s %12s' % (
+        'task queue', 'memory', 'put', 'get+done',
+        'compact mem', 'compact put', 'compact get'))
+    for each in size:
+        default = bench_task_queue(each, TaskQueue)
+        compact = bench_task_queue(each, CompactTaskQueue)
+        click.echo('%10d %11.1fB %10.2fus %10.2fus %11.1fB %10.2fus %10.2fus' % (
+            each, default['memory'], default['put'] * 1e6, default['get'] * 1e6,
+            compact['memory'], compact['put'] * 1e6, compact['get'] * 1e6))
+
+
+if __name__ == '__main__':
+    bench()